@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.db.models import Q
 from .models import (
-    VisaCategory, VisaRequirement, IndustryVisaMapping, 
-    DiagnosisSession, DocumentTemplate
+    VisaCategory, VisaRequirement, IndustryVisaMapping, WageReference,
+    DiagnosisSession, SessionRescore, DocumentTemplate, CohortJob
 )
+from . import export, search
 
 
 @admin.register(VisaCategory)
@@ -28,12 +30,53 @@ class IndustryVisaMappingAdmin(admin.ModelAdmin):
     ordering = ['-match_score']
 
 
+@admin.register(WageReference)
+class WageReferenceAdmin(admin.ModelAdmin):
+    list_display = ['industry', 'occupation', 'prefecture', 'experience_years_min', 'p25', 'p50', 'p75', 'source']
+    list_filter = ['prefecture', 'source']
+    search_fields = ['industry', 'occupation']
+    show_full_result_count = False  # 大量の行（統計の取り込み）でも一覧を速く表示する
+
+
 @admin.register(DiagnosisSession)
 class DiagnosisSessionAdmin(admin.ModelAdmin):
-    list_display = ['session_id', 'status', 'created_at', 'updated_at']
+    list_display = ['session_id', 'status', 'ruleset_version', 'created_at', 'updated_at']
     list_filter = ['status', 'created_at']
     search_fields = ['session_id']
+    search_help_text = '国籍・業種・職種・資格・学歴・推奨資格などを全文検索します（例: ベトナム 介護 N3）'
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['export_csv', 'export_jsonl']
+    
+    @admin.action(description='選択したセッションをCSVでエクスポート')
+    def export_csv(self, request, queryset):
+        return export.streaming_response(queryset, fmt='csv')
+    
+    @admin.action(description='選択したセッションをJSONLでエクスポート')
+    def export_jsonl(self, request, queryset):
+        return export.streaming_response(queryset, fmt='jsonl')
+    
+    def get_search_results(self, request, queryset, search_term):
+        """セッションIDの一致に加え、検索用ドキュメントを全文検索"""
+        if not search_term.strip():
+            return queryset, False
+        matched = search.search_documents(search_term).values('session_id')
+        return queryset.filter(Q(session_id=search_term.strip()) | Q(pk__in=matched)), False
+
+
+@admin.register(SessionRescore)
+class SessionRescoreAdmin(admin.ModelAdmin):
+    list_display = ['session', 'previous_top_code', 'new_top_code', 'top_changed', 'score_delta', 'ruleset_version', 'created_at']
+    list_filter = ['top_changed', 'ruleset_version', 'created_at']
+    search_fields = ['session__session_id']
+    raw_id_fields = ['session']
+
+
+@admin.register(CohortJob)
+class CohortJobAdmin(admin.ModelAdmin):
+    list_display = ['job_id', 'name', 'status', 'processed', 'failed', 'total', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['job_id', 'name', 'created_by']
+    readonly_fields = ['job_id', 'total', 'processed', 'failed', 'created_by', 'created_at', 'started_at', 'finished_at']
 
 
 @admin.register(DocumentTemplate)
@@ -1,38 +1,220 @@
 """
 AI統合モジュール - Claude APIを使用した高度な判定
+
+anthropic SDK（とそのHTTPスタック）の読み込みとクライアントの作成は起動時間の
+大半を占めるため、最初にAPIを呼び出す時点まで遅らせる。
+アナライザーはget_analyzer()でプロセス内で共有し、接続プールを使い回す。
+API呼び出しのトークン数は track_usage() の範囲（診断1回）ごとに集計する。
 """
+import hashlib
+import importlib.util
 import json
-from typing import Dict, Any, Optional
+import threading
+import unicodedata
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Any, Iterator, Optional
 import re # 正規表現モジュールを追加
 
+from .singleflight import SingleFlight, AsyncSingleFlight
+
+if TYPE_CHECKING:
+    from .profile import ApplicantProfile
+
+
+# 同一プロンプトの同時リクエストを1回のAPI呼び出しにまとめる（プロセス内で共有）
+_inflight = SingleFlight()
+_ainflight = AsyncSingleFlight()
+
+
+def _response_cache():
+    """AI応答のキャッシュ（settings.AI_RESPONSE_CACHE、Django外で使う場合はNone）"""
+    from django.conf import settings
+    if not settings.configured:
+        return None
+    from django.core.cache import caches
+    return caches[settings.AI_RESPONSE_CACHE]
+
+
+def _response_cache_ttl() -> int:
+    from django.conf import settings
+    return settings.AI_RESPONSE_CACHE_TTL
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角や余分な空白の揺れを正規化（同一入力の判定用）"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text or '')).strip()
+
+
+def sdk_installed() -> bool:
+    """anthropicパッケージがインストールされているか（読み込みはしない）"""
+    return importlib.util.find_spec('anthropic') is not None
+
+
+class TokenUsage:
+    """API呼び出しのトークン数の集計（診断1回分）"""
+    
+    FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+    
+    def __init__(self):
+        self.requests = 0           # APIを呼び出した回数
+        self.cached_responses = 0   # 応答のキャッシュ（AI_RESPONSE_CACHE）から返した回数
+        self.tokens = dict.fromkeys(self.FIELDS, 0)
+        self._lock = threading.Lock()
+    
+    def add(self, usage: Any) -> None:
+        with self._lock:
+            self.requests += 1
+            for field in self.FIELDS:
+                self.tokens[field] += getattr(usage, field, None) or 0
+    
+    def add_cached(self) -> None:
+        with self._lock:
+            self.cached_responses += 1
+    
+    def as_dict(self) -> Dict[str, int]:
+        return {'requests': self.requests, 'cached_responses': self.cached_responses, **self.tokens}
+
+
+_usage: ContextVar[Optional[TokenUsage]] = ContextVar('ai_token_usage', default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[TokenUsage]:
+    """範囲内のAPI呼び出しのトークン数を集計（asyncio.gatherで並行した呼び出しも含む）"""
+    usage = TokenUsage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def _record_usage(usage: Any = None, cached: bool = False) -> None:
+    tracker = _usage.get()
+    if tracker is None:
+        return
+    if cached:
+        tracker.add_cached()
+    elif usage is not None:
+        tracker.add(usage)
+
+
+def _messages_api(client: Any) -> Any:
+    """プロンプトキャッシュに対応したMessages API（SDK 0.40系ではベータの名前空間にある）"""
+    prompt_caching = getattr(client.beta, 'prompt_caching', None)
+    return prompt_caching.messages if prompt_caching is not None else client.messages
+
+
+# 一括分析（analyze_combined）の指示。毎回同じ内容のため、プロンプトキャッシュの対象にする
+# （キャッシュされるのはモデルごとの最小トークン数以上の場合のみ。Sonnetは1024トークン）
+COMBINED_INSTRUCTIONS = """あなたは日本の在留資格審査の専門家であり、外国人雇用に関する在留資格申請の専門コンサルタントです。
+企業の人事担当者が外国人の候補者について在留資格の取得可能性を判断するための分析を行います。
+ユーザーのメッセージには申請者情報、ルールに基づく診断の第1候補の在留資格と不足要件、および回答が必要な項目（sections）が含まれます。
+sectionsに含まれる項目だけを分析し、含まれない項目はnullとしてください。推測で事実を補わず、情報が不足する場合はその旨を回答に含めてください。
+
+## major_relevance（専攻と職種の関連性）
+申請者の専攻と、就労予定の職種・職務内容の関連性を評価します。
+「技術・人文知識・国際業務」では、大学・専門学校等で修得した知識と従事する業務との関連性が求められます。
+専門学校の卒業者は大学の卒業者よりも厳格に関連性が判断されることに留意してください。
+評価基準:
+- 直接関連（90-100点）: 専攻の知識が直接的に業務に活かせる（例: 情報工学とシステムエンジニア、会計学と経理）
+- 関連あり（70-89点）: 専攻の一部の知識が業務に活かせる（例: 経済学とマーケティング、機械工学と生産管理）
+- やや関連（50-69点）: 間接的に役立つ知識がある（例: 文学と翻訳を伴う営業、数学とデータ入力を伴う事務）
+- 関連性低（0-49点）: ほとんど関係がない
+levelは「高い」（70点以上）、「中程度」（50-69点）、「低い」（49点以下）のいずれかとします。
+reasonには関連性の理由を1-2文で、recommendationには在留資格申請に関するアドバイス（理由書で説明すべき点、補強資料など）を記載します。
+
+## job_suitability（業務内容の適合性）
+職務内容が第1候補の在留資格の活動に該当するかを分析します。専門的・技術的分野の在留資格では次の点を確認します。
+- 大学等で学んだ専門的な知識や技術が必要な業務であること
+- 単純労働（反復的な作業、現場作業、清掃、接客のみの業務など）でないこと
+- 判断、企画、設計、分析、通訳・翻訳、海外取引などの知的業務であること
+- 日本人と同等額以上の報酬であること、業務量が十分にあること
+特定技能の場合は、特定産業分野の業務区分に該当し、技能試験・日本語試験の合格等で定められた技能水準を満たすかを確認します。
+is_suitableは該当する場合true、該当しない場合false、判断できない場合nullとします。
+professional_scoreは業務の専門性を0-100の整数で評価します。concerns（懸念点）、strengths（強み）、recommendations（改善提案）はそれぞれ文字列のリストとします。
+
+## improvement_suggestions（改善提案）
+第1候補の在留資格の不足要件を満たすための、具体的で実行可能な改善提案を3-5個作成します。
+提案は申請者本人と受け入れ企業が実際に取り組める内容とし、所要期間の目安や必要な書類があれば含めてください。
+例: 日本語能力試験の受験（次回の試験日程）、実務経験の証明書の取得、職務内容の見直しと職務記述書の作成、報酬の見直し、
+他の在留資格（特定技能など）の検討、行政書士への相談。
+各提案は「・」で始め、改行で区切った1つの文字列とします。
+
+## 回答形式
+回答は次の形式のJSONのみとし、```json で始まるコードブロックで囲んでください。説明文は含めないでください。
+```json
+{
+    "major_relevance": {
+        "score": <0-100の整数>,
+        "level": "<高い/中程度/低い>",
+        "reason": "<関連性の理由を1-2文で>",
+        "recommendation": "<在留資格申請に関するアドバイス>"
+    },
+    "job_suitability": {
+        "is_suitable": <true/false/null>,
+        "professional_score": <0-100の整数>,
+        "concerns": [<懸念点のリスト>],
+        "strengths": [<強みのリスト>],
+        "recommendations": [<改善提案のリスト>]
+    },
+    "improvement_suggestions": "<・で始まる改善提案（改行区切り）>"
+}
+```"""
+COMBINED_SECTIONS = ('major_relevance', 'job_suitability', 'improvement_suggestions')
+
 
 class VisaAIAnalyzer:
     """
     Claude APIを使用した在留資格診断の高度化
     """
     
+    MODEL = "claude-sonnet-4-20250514"
+    
     def __init__(self, api_key: Optional[str] = None):
         """
-        初期化
+        初期化（SDKの読み込みとクライアントの作成は初回のAPI呼び出し時に行う）
         
         Args:
             api_key: Anthropic APIキー（Noneの場合はAI機能なしで動作）
         """
         self.api_key = api_key
-        self.client = None
-        
-        if api_key:
-            try:
-                import anthropic
-                self.client = anthropic.Anthropic(api_key=api_key)
-            except ImportError:
-                print("警告: anthropicパッケージがインストールされていません")
-            except Exception as e:
-                print(f"警告: Claude APIの初期化に失敗しました: {e}")
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self._available = bool(api_key) and sdk_installed()
+        if api_key and not self._available:
+            print("警告: anthropicパッケージがインストールされていません")
     
     def is_available(self) -> bool:
         """AI機能が利用可能かチェック"""
-        return self.client is not None
+        return self._available
+    
+    def _create_clients(self):
+        with self._lock:
+            if self._client is None:
+                try:
+                    import anthropic
+                    self._client = anthropic.Anthropic(api_key=self.api_key)
+                    self._async_client = anthropic.AsyncAnthropic(api_key=self.api_key)
+                except Exception as e:
+                    print(f"警告: Claude APIの初期化に失敗しました: {e}")
+                    raise
+    
+    @property
+    def client(self):
+        """同期クライアント（初回アクセス時に作成）"""
+        if self._client is None:
+            self._create_clients()
+        return self._client
+    
+    @property
+    def async_client(self):
+        """非同期クライアント（初回アクセス時に作成）"""
+        if self._async_client is None:
+            self._create_clients()
+        return self._async_client
 
     def _extract_json(self, text: str) -> str:
         """Markdownで囲まれたJSONコードブロックからJSON文字列を抽出する"""
@@ -43,22 +225,106 @@ class VisaAIAnalyzer:
         # Markdownコードブロックで囲まれていない場合
         return text.strip()
     
-    def analyze_major_relevance(self, major: str, job_field: str, job_description: str = "") -> Dict[str, Any]:
+    def _parse_json_response(self, response_text: str, label: str) -> Dict[str, Any]:
+        """AI応答のJSONをパース（失敗時は生の応答を出力して例外）"""
+        # ★ 修正箇所: Markdownラッパーを除去 ★
+        clean_json_text = self._extract_json(response_text)
+        
+        try:
+            return json.loads(clean_json_text)
+        except json.JSONDecodeError:
+            print(f"\n--- [DEBUG] Raw AI Response Text ({label}) ---")
+            print(response_text)
+            print("---------------------------------------------------------------")
+            raise Exception("AIからの応答が有効なJSON形式ではありませんでした。生の応答を確認してください。")
+    
+    def _request_key(self, prompt: str, system: Optional[str] = None) -> str:
+        if system:
+            prompt = f"{system}\n{prompt}"
+        return hashlib.sha256(f"{self.MODEL}\n{prompt}".encode('utf-8')).hexdigest()
+    
+    def _request_params(self, prompt: str, system: Optional[str], max_tokens: int) -> Dict[str, Any]:
+        params = {
+            'model': self.MODEL,
+            'max_tokens': max_tokens,
+            'messages': [{"role": "user", "content": prompt}],
+        }
+        if system:
+            # 毎回同じ指示はプロンプトキャッシュから読み込ませる
+            params['system'] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        return params
+    
+    def _create_message(self, prompt: str, label: Optional[str] = None,
+                        system: Optional[str] = None, max_tokens: int = 1024) -> Any:
         """
-        専攻と職種の関連性をAIで分析
+        Claude APIの呼び出し（同期、同一プロンプトの同時呼び出しは共有）
+
+        同一プロンプトの応答はAI_RESPONSE_CACHE_TTL秒キャッシュから返す。
+        labelを指定するとJSONとして解析した結果を返し、解析できた応答だけをキャッシュする。
+        systemを指定すると共通の指示としてプロンプトキャッシュの対象にする。
+        キャッシュへの保存は共有中の呼び出しが終わる前に行う
+        （終了直後に到着した呼び出しがキャッシュにも共有にも当たらず、重複して呼び出さないように）。
         """
-        if not self.is_available():
-            return {
-                'score': 50,
-                'level': '不明',
-                'reason': 'AI機能が無効です（手動確認が必要）',
-                'recommendation': '専攻と職種の関連性を手動で確認してください'
-            }
+        key = self._request_key(prompt, system)
+        cache = _response_cache()
         
-        try:
-            job_info = f"\n職務内容: {job_description}" if job_description else ""
-            
-            prompt = f"""あなたは日本の在留資格審査の専門家です。
+        def call():
+            # 共有の待機に入る直前に他の呼び出しが保存した応答
+            text = cache.get(key) if cache is not None else None
+            if text is not None:
+                _record_usage(cached=True)
+                return text
+            # モデル名はお客様のアカウントで動作確認できたものを使用
+            api = _messages_api(self.client) if system else self.client.messages
+            message = api.create(**self._request_params(prompt, system, max_tokens))
+            _record_usage(message.usage)
+            text = message.content[0].text
+            if label:
+                self._parse_json_response(text, label)
+            if cache is not None:
+                cache.set(key, text, _response_cache_ttl())
+            return text
+        
+        text = cache.get(key) if cache is not None else None
+        if text is not None:
+            _record_usage(cached=True)
+        else:
+            text = _inflight.do(key, call)
+        return self._parse_json_response(text, label) if label else text
+    
+    async def _acreate_message(self, prompt: str, label: Optional[str] = None,
+                               system: Optional[str] = None, max_tokens: int = 1024) -> Any:
+        """Claude APIの呼び出し（非同期、同一プロンプトの同時呼び出しは共有、キャッシュは同期版と共通）"""
+        key = self._request_key(prompt, system)
+        cache = _response_cache()
+        
+        async def call():
+            text = await cache.aget(key) if cache is not None else None
+            if text is not None:
+                _record_usage(cached=True)
+                return text
+            api = _messages_api(self.async_client) if system else self.async_client.messages
+            message = await api.create(**self._request_params(prompt, system, max_tokens))
+            _record_usage(message.usage)
+            text = message.content[0].text
+            if label:
+                self._parse_json_response(text, label)
+            if cache is not None:
+                await cache.aset(key, text, _response_cache_ttl())
+            return text
+        
+        text = await cache.aget(key) if cache is not None else None
+        if text is not None:
+            _record_usage(cached=True)
+        else:
+            text = await _ainflight.do(key, call)
+        return self._parse_json_response(text, label) if label else text
+    
+    def _major_relevance_prompt(self, major: str, job_field: str, job_description: str) -> str:
+        major, job_field, job_description = map(normalize_text, (major, job_field, job_description))
+        job_info = f"\n職務内容: {job_description}" if job_description else ""
+        
+        return f"""あなたは日本の在留資格審査の専門家です。
 以下の専攻と職種の関連性を評価してください。回答は必ずJSONブロック内で行ってください。
 
 専攻: {major}
@@ -77,54 +343,52 @@ class VisaAIAnalyzer:
     "reason": "<関連性の理由を1-2文で>",
     "recommendation": "<在留資格申請に関するアドバイス>"
 }}"""
-            
-            # モデル名はお客様のアカウントで動作確認できたものを使用
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt}]
+    
+    def _major_relevance_fallback(self, reason: str, recommendation: str) -> Dict[str, Any]:
+        return {
+            'score': 50,
+            'level': '不明',
+            'reason': reason,
+            'recommendation': recommendation
+        }
+    
+    def analyze_major_relevance(self, major: str, job_field: str, job_description: str = "") -> Dict[str, Any]:
+        """
+        専攻と職種の関連性をAIで分析
+        """
+        if not self.is_available():
+            return self._major_relevance_fallback(
+                'AI機能が無効です（手動確認が必要）', '専攻と職種の関連性を手動で確認してください'
             )
-            
-            # レスポンスのパース (JSONパースエラー対応を強化)
-            response_text = message.content[0].text
-            
-            # ★ 修正箇所: Markdownラッパーを除去 ★
-            clean_json_text = self._extract_json(response_text)
-            
-            try:
-                result = json.loads(clean_json_text)
-            except json.JSONDecodeError:
-                print("\n--- [DEBUG] Raw AI Response Text (Analyze Major Relevance) ---")
-                print(response_text)
-                print("---------------------------------------------------------------")
-                raise Exception("AIからの応答が有効なJSON形式ではありませんでした。生の応答を確認してください。")
-            
-            return result
-            
+        
+        try:
+            return self._create_message(self._major_relevance_prompt(major, job_field, job_description), 'Analyze Major Relevance')
         except Exception as e:
             print(f"AI分析エラー: {e}")
-            return {
-                'score': 50,
-                'level': '不明',
-                'reason': f'AI分析中にエラーが発生しました: {str(e)}',
-                'recommendation': '手動での確認を推奨します'
-            }
+            return self._major_relevance_fallback(
+                f'AI分析中にエラーが発生しました: {str(e)}', '手動での確認を推奨します'
+            )
     
-    def analyze_job_description(self, job_description: str, visa_type: str = "技術・人文知識・国際業務") -> Dict[str, Any]:
+    async def aanalyze_major_relevance(self, major: str, job_field: str, job_description: str = "") -> Dict[str, Any]:
         """
-        業務内容を分析し、単純労働でないかを判定
+        専攻と職種の関連性をAIで分析（非同期版）
         """
         if not self.is_available():
-            return {
-                'is_suitable': None,
-                'professional_score': 50,
-                'concerns': ['AI機能が無効です'],
-                'strengths': [],
-                'recommendations': ['手動で業務内容を確認してください']
-            }
+            return self._major_relevance_fallback(
+                'AI機能が無効です（手動確認が必要）', '専攻と職種の関連性を手動で確認してください'
+            )
         
         try:
-            prompt = f"""あなたは日本の在留資格審査の専門家です。
+            return await self._acreate_message(self._major_relevance_prompt(major, job_field, job_description), 'Analyze Major Relevance')
+        except Exception as e:
+            print(f"AI分析エラー: {e}")
+            return self._major_relevance_fallback(
+                f'AI分析中にエラーが発生しました: {str(e)}', '手動での確認を推奨します'
+            )
+    
+    def _job_description_prompt(self, job_description: str, visa_type: str) -> str:
+        job_description, visa_type = normalize_text(job_description), normalize_text(visa_type)
+        return f"""あなたは日本の在留資格審査の専門家です。
 以下の業務内容が在留資格「{visa_type}」に該当するか分析してください。回答は必ずJSONブロック内で行ってください。
 
 業務内容:
@@ -143,84 +407,225 @@ class VisaAIAnalyzer:
     "strengths": [<強みのリスト>],
     "recommendations": [<改善提案のリスト>]
 }}"""
-
-            # モデル名はお客様のアカウントで動作確認できたものを使用
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            response_text = message.content[0].text
-            
-            # ★ 修正箇所: Markdownラッパーを除去 ★
-            clean_json_text = self._extract_json(response_text)
-
-            try:
-                result = json.loads(clean_json_text)
-            except json.JSONDecodeError:
-                print("\n--- [DEBUG] Raw AI Response Text (Analyze Job Description) ---")
-                print(response_text)
-                print("-------------------------------------------------------------")
-                raise Exception("AIからの応答が有効なJSON形式ではありませんでした。生の応答を確認してください。")
-
-            return result
-            
+    
+    def _job_description_fallback(self, concern: str, recommendation: str) -> Dict[str, Any]:
+        return {
+            'is_suitable': None,
+            'professional_score': 50,
+            'concerns': [concern],
+            'strengths': [],
+            'recommendations': [recommendation]
+        }
+    
+    def analyze_job_description(self, job_description: str, visa_type: str = "技術・人文知識・国際業務") -> Dict[str, Any]:
+        """
+        業務内容を分析し、単純労働でないかを判定
+        """
+        if not self.is_available():
+            return self._job_description_fallback('AI機能が無効です', '手動で業務内容を確認してください')
+        
+        try:
+            return self._create_message(self._job_description_prompt(job_description, visa_type), 'Analyze Job Description')
         except Exception as e:
             print(f"AI分析エラー: {e}")
-            return {
-                'is_suitable': None,
-                'professional_score': 50,
-                'concerns': [f'AI分析中にエラーが発生: {str(e)}'],
-                'strengths': [],
-                'recommendations': ['手動での確認を推奨します']
-            }
-    
-    def generate_improvement_suggestions(self, applicant_data: Dict[str, Any], diagnosis_result: Dict[str, Any]) -> str:
+            return self._job_description_fallback(f'AI分析中にエラーが発生: {str(e)}', '手動での確認を推奨します')
+    
+    async def aanalyze_job_description(self, job_description: str, visa_type: str = "技術・人文知識・国際業務") -> Dict[str, Any]:
         """
-        診断結果に基づいて改善提案を生成
+        業務内容を分析し、単純労働でないかを判定（非同期版）
         """
         if not self.is_available():
-            return "AI機能が無効のため、改善提案を生成できません。"
+            return self._job_description_fallback('AI機能が無効です', '手動で業務内容を確認してください')
         
         try:
-            # 不足要件を抽出
-            missing_items = []
-            if diagnosis_result.get('top_recommendations'):
-                top = diagnosis_result['top_recommendations'][0]
-                missing_items = top.get('missing_items', [])
-            
-            if not missing_items:
-                return "現在の条件で申請可能です。特に改善が必要な点はありません。"
-            
-            prompt = f"""あなたは在留資格申請の専門コンサルタントです。
+            return await self._acreate_message(self._job_description_prompt(job_description, visa_type), 'Analyze Job Description')
+        except Exception as e:
+            print(f"AI分析エラー: {e}")
+            return self._job_description_fallback(f'AI分析中にエラーが発生: {str(e)}', '手動での確認を推奨します')
+    
+    def _improvement_prompt(self, profile: 'ApplicantProfile', missing_items: list) -> str:
+        return f"""あなたは在留資格申請の専門コンサルタントです。
 
 申請者情報:
-- 学歴: {applicant_data.get('education', {}).get('degree', '未記入')}
-- 専攻: {applicant_data.get('education', {}).get('major', '未記入')}
-- 経験年数: {sum([exp.get('years', 0) for exp in applicant_data.get('experience', [])])}年
-- 職種: {applicant_data.get('job_details', {}).get('position', '未記入')}
-- 報酬: {applicant_data.get('salary', 0)}円
+- 学歴: {profile.degree or '未記入'}
+- 専攻: {profile.major or '未記入'}
+- 経験年数: {profile.total_years}年
+- 職種: {profile.position or '未記入'}
+- 報酬: {profile.salary}円
 
 不足している要件:
 {json.dumps(missing_items, ensure_ascii=False, indent=2)}
 
 これらの不足要件を満たすための具体的で実行可能な改善提案を3-5個、箇条書きで提案してください。
 各提案は「・」で始めてください。"""
+    
+    def _top_missing_items(self, diagnosis_result: Dict[str, Any]) -> list:
+        """最上位候補の不足要件を抽出"""
+        if diagnosis_result.get('top_recommendations'):
+            top = diagnosis_result['top_recommendations'][0]
+            return top.get('missing_items', [])
+        return []
+    
+    def generate_improvement_suggestions(self, profile: 'ApplicantProfile', diagnosis_result: Dict[str, Any]) -> str:
+        """
+        診断結果に基づいて改善提案を生成
+        """
+        if not self.is_available():
+            return "AI機能が無効のため、改善提案を生成できません。"
+        
+        try:
+            missing_items = self._top_missing_items(diagnosis_result)
+            if not missing_items:
+                return "現在の条件で申請可能です。特に改善が必要な点はありません。"
             
-            # モデル名はお客様のアカウントで動作確認できたものを使用
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            return self._create_message(self._improvement_prompt(profile, missing_items))
+            
+        except Exception as e:
+            print(f"AI分析エラー: {e}")
+            return f"改善提案の生成中にエラーが発生しました: {str(e)}"
+    
+    async def agenerate_improvement_suggestions(self, profile: 'ApplicantProfile', diagnosis_result: Dict[str, Any]) -> str:
+        """
+        診断結果に基づいて改善提案を生成（非同期版）
+        """
+        if not self.is_available():
+            return "AI機能が無効のため、改善提案を生成できません。"
+        
+        try:
+            missing_items = self._top_missing_items(diagnosis_result)
+            if not missing_items:
+                return "現在の条件で申請可能です。特に改善が必要な点はありません。"
             
-            return message.content[0].text
+            return await self._acreate_message(self._improvement_prompt(profile, missing_items))
             
         except Exception as e:
             print(f"AI分析エラー: {e}")
             return f"改善提案の生成中にエラーが発生しました: {str(e)}"
 
+    
+    def _combined_prompt(self, profile: 'ApplicantProfile', top_visa: Optional[str], missing_items: list,
+                         sections: list) -> str:
+        applicant = {
+            '国籍': profile.nationality or '未記入',
+            '学歴': profile.degree or '未記入',
+            '専攻': normalize_text(profile.major) or '未記入',
+            '経験年数': f'{profile.total_years}年',
+            '保有資格': list(profile.qualifications),
+            '業種': profile.industry or '未記入',
+            '職種': normalize_text(profile.position) or '未記入',
+            '職務内容': normalize_text(profile.duties) or '未記入',
+            '月額報酬': f'{profile.salary}円',
+        }
+        return json.dumps({
+            'sections': sections,
+            '申請者情報': applicant,
+            '第1候補の在留資格': top_visa,
+            '不足している要件': missing_items,
+        }, ensure_ascii=False, indent=2)
+    
+    def _combined_sections(self, profile: 'ApplicantProfile', diagnosis_result: Dict[str, Any],
+                           include_major_relevance: bool) -> Dict[str, Any]:
+        """一括分析で回答を求める項目と、APIを使わずに決まる項目"""
+        top = (diagnosis_result.get('top_recommendations') or [None])[0]
+        top_visa = top['visa_category']['name_ja'] if top else None
+        sections = []
+        local = dict.fromkeys(COMBINED_SECTIONS)
+        if include_major_relevance:
+            sections.append('major_relevance')
+        if profile.duties and top_visa:
+            sections.append('job_suitability')
+        missing_items = self._top_missing_items(diagnosis_result)
+        if missing_items:
+            sections.append('improvement_suggestions')
+        elif top:
+            local['improvement_suggestions'] = "現在の条件で申請可能です。特に改善が必要な点はありません。"
+        return {'sections': sections, 'local': local, 'top_visa': top_visa, 'missing_items': missing_items}
+    
+    def _combined_result(self, plan: Dict[str, Any], answer: Any) -> Dict[str, Any]:
+        """一括分析の応答を項目ごとの結果（個別の分析と同じ形式）に変換"""
+        result = dict(plan['local'])
+        answer = answer if isinstance(answer, dict) else {}
+        for section in plan['sections']:
+            value = answer.get(section)
+            if value is None:
+                value = self._combined_fallback(section, 'AIの応答に含まれていません')
+            result[section] = value
+        return result
+    
+    def _combined_fallback(self, section: str, error: str) -> Any:
+        if section == 'major_relevance':
+            return self._major_relevance_fallback(f'AI分析中にエラーが発生しました: {error}', '手動での確認を推奨します')
+        if section == 'job_suitability':
+            return self._job_description_fallback(f'AI分析中にエラーが発生: {error}', '手動での確認を推奨します')
+        return f"改善提案の生成中にエラーが発生しました: {error}"
+    
+    def analyze_combined(self, profile: 'ApplicantProfile', diagnosis_result: Dict[str, Any],
+                         include_major_relevance: bool = True) -> Dict[str, Any]:
+        """
+        専攻と職種の関連性・業務内容の適合性・改善提案を1回のAPI呼び出しで分析
+        
+        共通の指示（COMBINED_INSTRUCTIONS）はプロンプトキャッシュの対象とし、申請者ごとの情報だけを送る。
+        
+        Args:
+            profile: 申請者プロファイル
+            diagnosis_result: top_recommendations を含む診断結果
+            include_major_relevance: Falseの場合は関連性を分析しない（オフラインで判定できた場合）
+        
+        Returns:
+            major_relevance・job_suitability・improvement_suggestions（分析しない項目はNone）
+        """
+        plan = self._combined_sections(profile, diagnosis_result, include_major_relevance)
+        if not plan['sections']:
+            return dict(plan['local'])
+        if not self.is_available():
+            return self._combined_result(plan, {
+                section: self._combined_fallback(section, 'AI機能が無効です') for section in plan['sections']
+            })
+        
+        try:
+            prompt = self._combined_prompt(profile, plan['top_visa'], plan['missing_items'], plan['sections'])
+            answer = self._create_message(prompt, 'Combined Analysis', system=COMBINED_INSTRUCTIONS, max_tokens=2048)
+        except Exception as e:
+            print(f"AI分析エラー: {e}")
+            answer = {section: self._combined_fallback(section, str(e)) for section in plan['sections']}
+        return self._combined_result(plan, answer)
+    
+    async def aanalyze_combined(self, profile: 'ApplicantProfile', diagnosis_result: Dict[str, Any],
+                                include_major_relevance: bool = True) -> Dict[str, Any]:
+        """
+        専攻と職種の関連性・業務内容の適合性・改善提案を1回のAPI呼び出しで分析（非同期版）
+        """
+        plan = self._combined_sections(profile, diagnosis_result, include_major_relevance)
+        if not plan['sections']:
+            return dict(plan['local'])
+        if not self.is_available():
+            return self._combined_result(plan, {
+                section: self._combined_fallback(section, 'AI機能が無効です') for section in plan['sections']
+            })
+        
+        try:
+            prompt = self._combined_prompt(profile, plan['top_visa'], plan['missing_items'], plan['sections'])
+            answer = await self._acreate_message(prompt, 'Combined Analysis', system=COMBINED_INSTRUCTIONS, max_tokens=2048)
+        except Exception as e:
+            print(f"AI分析エラー: {e}")
+            answer = {section: self._combined_fallback(section, str(e)) for section in plan['sections']}
+        return self._combined_result(plan, answer)
+
+
+_analyzers: Dict[str, VisaAIAnalyzer] = {}
+_analyzers_lock = threading.Lock()
+
+
+def get_analyzer(api_key: str) -> VisaAIAnalyzer:
+    """APIキーごとにプロセス内で共有するアナライザー"""
+    analyzer = _analyzers.get(api_key)
+    if analyzer is None:
+        with _analyzers_lock:
+            analyzer = _analyzers.get(api_key)
+            if analyzer is None:
+                analyzer = _analyzers[api_key] = VisaAIAnalyzer(api_key)
+    return analyzer
+
 
 # 簡易的なテスト用関数
 def test_ai_integration(api_key: str):
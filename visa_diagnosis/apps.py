@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class VisaDiagnosisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'visa_diagnosis'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import throttling  # noqa: F401  レート制限のシステムチェックを登録
@@ -0,0 +1,385 @@
+"""
+一括診断 - 候補者名簿のアップロードとDBを使ったジョブキュー
+
+アップロードされた名簿はジョブ（CohortJob）と一定件数ごとの処理単位（CohortChunk）に分けて保存し、
+run_diagnosis_worker コマンドのワーカーが処理単位を1つずつ取得して診断する。
+取得は「待機中、または処理期限切れ」の行を条件つきのUPDATE（filter().update()）で書き換え、
+更新できた1プロセスだけが処理するため、ワーカーのプロセスを増やすだけで並列に処理できる。
+止まったワーカーの処理単位は処理期限（COHORT_LEASE_SECONDS）が過ぎると他のワーカーが取得し直す。
+
+診断結果は処理単位ごとに1トランザクションで一括保存する。完了の記録も同じトランザクションで
+「自分が取得したままであること」を条件に行うため、取得し直された処理単位が二重に保存されることはない。
+"""
+import csv
+import io
+import json
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import export, identifiers, search
+from .logic import VisaDiagnosisEngine
+from .models import CohortChunk, CohortJob, CohortResult, DiagnosisSession
+from .profile import applicant_data_from_form
+
+ROSTER_FORMATS = ('csv', 'jsonl', 'json')
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 名簿ファイルの上限
+MAX_REPORTED_ERRORS = 100   # 進捗に含める失敗行の上限
+CLAIM_CANDIDATES = 10       # 1回の取得で試す処理単位の数（他のワーカーと競合した場合に次を試す）
+
+# 名簿（CSV）の見出し → 診断フォームの項目名
+CSV_HEADER_ALIASES = {
+    '国籍': 'nationality',
+    '年齢': 'age',
+    '学位': 'degree',
+    '最終学歴': 'degree',
+    '専攻': 'major',
+    '大学': 'university',
+    '学校名': 'university',
+    '経験年数': 'experience_years',
+    '実務経験年数': 'experience_years',
+    '経験分野': 'experience_field',
+    '資格': 'qualifications',
+    '保有資格': 'qualifications',
+    '業種': 'industry',
+    '職種': 'position',
+    '勤務地': 'prefecture',
+    '都道府県': 'prefecture',
+    '業務内容': 'duties',
+    '月額報酬': 'salary',
+    '企業名': 'company_name',
+}
+_NUMERIC_FIELDS = ('age', 'experience_years', 'salary')
+_LIST_SEPARATORS = ('、', ';', '；')
+
+
+class CohortError(ValueError):
+    """名簿の入力エラー"""
+
+
+class LeaseLost(Exception):
+    """処理期限が切れ、処理単位を他のワーカーが取得し直した"""
+
+
+def roster_format(filename: str) -> str:
+    """ファイル名の拡張子から名簿の形式を判定（不明ならcsv）"""
+    name = filename.lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.json'):
+        return 'json'
+    return 'csv'
+
+
+def _decode(data: bytes) -> str:
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        pass
+    try:
+        # Excelで保存したCSV
+        return data.decode('cp932')
+    except UnicodeDecodeError:
+        raise CohortError('文字コードはUTF-8またはShift_JIS（CP932）にしてください')
+
+
+def _csv_applicant(row: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    fields = {}
+    for header, value in row.items():
+        if header is None:
+            continue
+        header = header.strip()
+        fields[CSV_HEADER_ALIASES.get(header, header)] = (value or '').strip()
+    for name in _NUMERIC_FIELDS:
+        if fields.get(name):
+            fields[name] = fields[name].replace(',', '').replace('円', '').replace('歳', '').replace('年', '')
+    if fields.get('qualifications'):
+        for separator in _LIST_SEPARATORS:
+            fields['qualifications'] = fields['qualifications'].replace(separator, ',')
+    return applicant_data_from_form(fields)
+
+
+def parse_roster(data: bytes, fmt: str = 'csv') -> List[Dict[str, Any]]:
+    """
+    名簿を申請者情報（diagnose()と同じ形式）の一覧に変換
+
+    Args:
+        data: ファイルの内容
+        fmt: csv（1行目は見出し。列名は診断フォームの項目名または日本語の見出し）、
+            jsonl（1行1名）、json（配列、または {"applicants": [...]}）
+
+    Raises:
+        CohortError: 形式・件数・内容に誤りがある場合（誤りのある行をまとめて報告する）
+    """
+    if fmt not in ROSTER_FORMATS:
+        raise CohortError(f'名簿の形式は {", ".join(ROSTER_FORMATS)} のいずれかを指定してください')
+    text = _decode(data)
+
+    applicants: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(io.StringIO(text)), 1):
+            if not any((value or '').strip() for value in row.values() if isinstance(value, str)):
+                continue
+            try:
+                applicants.append(_csv_applicant(row))
+            except ValueError:
+                errors.append(f'{number}行目: 年齢・経験年数・月額報酬は整数で入力してください')
+    else:
+        try:
+            if fmt == 'jsonl':
+                items = [json.loads(line) for line in text.splitlines() if line.strip()]
+            else:
+                items = json.loads(text)
+                if isinstance(items, dict):
+                    items = items.get('applicants')
+        except ValueError as e:
+            raise CohortError(f'JSONとして読み込めませんでした: {e}')
+        if not isinstance(items, list):
+            raise CohortError('申請者情報の配列（または {"applicants": [...]}）を指定してください')
+        for number, item in enumerate(items, 1):
+            if isinstance(item, dict):
+                applicants.append(item)
+            else:
+                errors.append(f'{number}件目: 申請者情報はオブジェクトで指定してください')
+
+    if errors:
+        shown = errors[:10]
+        if len(errors) > len(shown):
+            shown.append(f'ほか{len(errors) - len(shown)}件')
+        raise CohortError('\n'.join(shown))
+    if not applicants:
+        raise CohortError('名簿に候補者がいません')
+    if len(applicants) > settings.COHORT_MAX_APPLICANTS:
+        raise CohortError(f'一度に診断できるのは{settings.COHORT_MAX_APPLICANTS}名までです')
+    return applicants
+
+
+def create_job(applicants: List[Dict[str, Any]], name: str = '', created_by: str = '') -> CohortJob:
+    """名簿を処理単位（COHORT_CHUNK_SIZE名ずつ）に分けてキューに登録"""
+    size = settings.COHORT_CHUNK_SIZE
+    with transaction.atomic():
+        job = CohortJob.objects.create(
+            job_id=identifiers.new_id(), name=name[:200], total=len(applicants), created_by=created_by,
+        )
+        CohortChunk.objects.bulk_create([
+            CohortChunk(job=job, index=index, start_row=start, applicants=applicants[start:start + size])
+            for index, start in enumerate(range(0, len(applicants), size))
+        ])
+    return job
+
+
+def _claimable(now) -> Q:
+    """取得できる処理単位（待機中、または処理期限が切れて試行回数が残っているもの）"""
+    return Q(status='queued') | Q(
+        status='running', leased_until__lt=now, attempts__lt=settings.COHORT_MAX_ATTEMPTS,
+    )
+
+
+def claim_chunk(worker: str) -> Optional[CohortChunk]:
+    """
+    次の処理単位を取得（古いジョブから順に）
+
+    条件つきのUPDATEで状態を書き換えられた場合だけ取得できるため、
+    複数のワーカーが同時に呼んでも同じ処理単位を取得するのは1つだけ。
+
+    Returns:
+        取得した処理単位（キューが空ならNone）
+    """
+    now = timezone.now()
+    _fail_abandoned(now)
+    candidates = list(
+        CohortChunk.objects.filter(_claimable(now)).order_by('job_id', 'index')
+        .values_list('pk', flat=True)[:CLAIM_CANDIDATES]
+    )
+    for pk in candidates:
+        claimed = CohortChunk.objects.filter(_claimable(now), pk=pk).update(
+            status='running',
+            worker=worker,
+            leased_until=now + timedelta(seconds=settings.COHORT_LEASE_SECONDS),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            chunk = CohortChunk.objects.select_related('job').get(pk=pk)
+            CohortJob.objects.filter(pk=chunk.job_id, status='queued').update(status='running', started_at=now)
+            return chunk
+    return None
+
+
+def _renew_lease(chunk: CohortChunk, worker: str) -> None:
+    renewed = CohortChunk.objects.filter(pk=chunk.pk, worker=worker, status='running').update(
+        leased_until=timezone.now() + timedelta(seconds=settings.COHORT_LEASE_SECONDS),
+    )
+    if not renewed:
+        raise LeaseLost(f'処理単位 {chunk.job.job_id} #{chunk.index} は他のワーカーが取得しました')
+
+
+def process_chunk(chunk: CohortChunk, worker: str, enable_ai: bool = False) -> Tuple[int, int]:
+    """
+    処理単位の候補者を診断し、診断セッションと行ごとの結果を一括保存
+
+    候補者ごとのエラーは失敗行として記録し、処理単位全体は止めない。
+
+    Returns:
+        (診断できた件数, 失敗した件数)
+
+    Raises:
+        LeaseLost: 処理中に処理期限が切れ、他のワーカーが取得し直した場合（何も保存しない）
+    """
+    engine = VisaDiagnosisEngine(enable_ai=enable_ai)
+    sessions: List[DiagnosisSession] = []
+    results: List[CohortResult] = []
+    renewed = time.monotonic()
+    for offset, applicant in enumerate(chunk.applicants):
+        row = chunk.start_row + offset
+        try:
+            result = engine.diagnose(applicant)
+        except Exception as e:
+            results.append(CohortResult(job_id=chunk.job_id, row=row, error=str(e) or e.__class__.__name__))
+        else:
+            session = DiagnosisSession(
+                session_id=result['diagnosis_id'],  # 診断IDをそのままセッションIDとして使う
+                status='completed',
+                applicant_data=applicant,
+                diagnosis_result=result,
+                ruleset_version=engine.ruleset.version,
+            )
+            sessions.append(session)
+            results.append(CohortResult(job_id=chunk.job_id, row=row, session=session))
+        # AI分析つきでは1名に数秒かかるため、処理期限を延長しながら進める
+        if time.monotonic() - renewed > settings.COHORT_LEASE_SECONDS / 3:
+            _renew_lease(chunk, worker)
+            renewed = time.monotonic()
+
+    failed = len(results) - len(sessions)
+    with transaction.atomic():
+        finished = CohortChunk.objects.filter(pk=chunk.pk, worker=worker, status='running').update(
+            status='done', leased_until=None, last_error='',
+        )
+        if not finished:
+            raise LeaseLost(f'処理単位 {chunk.job.job_id} #{chunk.index} は他のワーカーが取得しました')
+        DiagnosisSession.objects.bulk_create(sessions, batch_size=500)
+        # bulk_createはシグナルを送らないため検索用ドキュメントを直接作成
+        search.bulk_index(sessions)
+        CohortResult.objects.bulk_create(results, batch_size=500)
+        CohortJob.objects.filter(pk=chunk.job_id).update(
+            processed=F('processed') + len(sessions), failed=F('failed') + failed,
+        )
+    _finish_job(chunk.job_id)
+    return len(sessions), failed
+
+
+def release_chunk(chunk: CohortChunk, worker: str, error: str) -> bool:
+    """
+    処理単位をキューに戻す（試行回数が上限に達していれば全行を失敗にする）
+
+    Returns:
+        キューに戻した場合True
+    """
+    chunk.refresh_from_db(fields=['attempts'])
+    if chunk.attempts < settings.COHORT_MAX_ATTEMPTS:
+        released = CohortChunk.objects.filter(pk=chunk.pk, worker=worker, status='running').update(
+            status='queued', leased_until=None, last_error=error,
+        )
+        return bool(released)
+    if CohortChunk.objects.filter(pk=chunk.pk, worker=worker, status='running').update(
+        status='failed', leased_until=None, last_error=error,
+    ):
+        _record_failure(chunk, error)
+    return False
+
+
+def _fail_abandoned(now) -> None:
+    """処理期限が切れ、試行回数も上限に達した処理単位を失敗にする"""
+    abandoned = CohortChunk.objects.filter(
+        status='running', leased_until__lt=now, attempts__gte=settings.COHORT_MAX_ATTEMPTS,
+    ).select_related('job')
+    for chunk in abandoned:
+        message = chunk.last_error or 'ワーカーが処理期限内に完了しませんでした'
+        if CohortChunk.objects.filter(pk=chunk.pk, status='running', leased_until__lt=now).update(
+            status='failed', leased_until=None, last_error=message,
+        ):
+            _record_failure(chunk, message)
+
+
+def _record_failure(chunk: CohortChunk, error: str) -> None:
+    rows = range(chunk.start_row, chunk.start_row + len(chunk.applicants))
+    with transaction.atomic():
+        CohortResult.objects.bulk_create(
+            [CohortResult(job_id=chunk.job_id, row=row, error=error) for row in rows],
+            ignore_conflicts=True,
+        )
+        CohortJob.objects.filter(pk=chunk.job_id).update(failed=F('failed') + len(rows))
+    _finish_job(chunk.job_id)
+
+
+def _finish_job(job_pk: int) -> None:
+    """残りの処理単位がなければジョブを完了にする（全行が失敗なら失敗）"""
+    if CohortChunk.objects.filter(job_id=job_pk, status__in=('queued', 'running')).exists():
+        return
+    job = CohortJob.objects.filter(pk=job_pk).values('processed').first()
+    if job is None:
+        return
+    CohortJob.objects.filter(pk=job_pk, status__in=('queued', 'running')).update(
+        status='completed' if job['processed'] else 'failed', finished_at=timezone.now(),
+    )
+
+
+def progress(job: CohortJob) -> Dict[str, Any]:
+    """ジョブの進捗（処理済み件数・残り時間の見込み・失敗行）"""
+    done = job.processed + job.failed
+    now = timezone.now()
+    elapsed = ((job.finished_at or now) - job.started_at).total_seconds() if job.started_at else 0.0
+    throughput = done / elapsed if done and elapsed > 0 else None
+    eta = None
+    if job.status == 'running' and throughput:
+        eta = round((job.total - done) / throughput, 1)
+
+    chunks = dict(job.chunks.values_list('status').annotate(count=Count('pk')))
+    errors = [
+        {'row': row + 1, 'error': error}
+        for row, error in job.results.filter(session__isnull=True).order_by('row')
+        .values_list('row', 'error')[:MAX_REPORTED_ERRORS]
+    ]
+    return {
+        'job_id': job.job_id,
+        'name': job.name,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'failed': job.failed,
+        'remaining': job.total - done,
+        'percent': round(done / job.total * 100, 1) if job.total else 100.0,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'elapsed_seconds': round(elapsed, 1),
+        'throughput_per_second': round(throughput, 2) if throughput else None,
+        'eta_seconds': eta,
+        'chunks': {status: chunks.get(status, 0) for status, _ in CohortChunk.STATUS_CHOICES},
+        'errors': errors,
+    }
+
+
+RESULT_HEADERS = ['row', 'error', *export.HEADERS]
+
+
+def result_rows(job: CohortJob) -> Iterator[List[Any]]:
+    """名簿の行順の結果（行番号は1始まり。失敗行はエラーのみ）"""
+    fields = [f'session__{name}' for name in export.SESSION_FIELDS]
+    records = (
+        job.results.order_by('row').values('row', 'error', *fields)
+        .iterator(chunk_size=export.ITERATOR_CHUNK_SIZE)
+    )
+    blank = [''] * len(export.HEADERS)
+    for record in records:
+        if record['session__session_id'] is None:
+            yield [record['row'] + 1, record['error'], *blank]
+        else:
+            session = {name: record[f'session__{name}'] for name in export.SESSION_FIELDS}
+            yield [record['row'] + 1, '', *export.session_row(session)]
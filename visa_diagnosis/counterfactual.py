@@ -0,0 +1,241 @@
+"""
+改善パス探索 - 不足要件を解消する最小コストの変更の組み合わせ
+
+各在留資格の要件から「変更できる項目」（報酬の引き上げ・経験年数の追加・資格の取得）の
+候補値を抽出し、目標スコア到達かつ解消可能な必須要件をすべて充足する組み合わせのうち
+コスト最小のものを分枝限定法で探索する。
+
+どの変更も要件の充足を減らさない（単調）ため、未決定の項目に依存する未充足要件が
+すべて充足されたと仮定したスコアを上界として枝刈りできる。
+（「日本人と同等以上」の基準額は経験年数の追加で上がり得るが、上界は充足済みの要件を
+そのまま数えるため過大評価にしかならず、枝刈りの正しさは変わらない）
+"""
+import math
+import re
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from . import hsp_points, vocabulary, wages
+from .profile import ApplicantProfile
+from .ruleset import HSP_POINTS_DEPENDENCIES, CompiledRequirement, CompiledVisa
+from .whatif import apply_change
+
+if TYPE_CHECKING:
+    from .logic import VisaDiagnosisEngine
+
+# 変更のコスト（比較用の相対値）
+COST_PER_10K_YEN = 1       # 月額報酬1万円の引き上げ
+COST_PER_YEAR = 12         # 実務経験1年の追加
+COST_PER_QUALIFICATION = 8  # 資格1つの取得
+
+# 資格要件から取得候補とする資格
+SKILL_TEST = '特定技能評価試験'
+HSP_QUALIFICATIONS = ('日本語能力試験N2', '日本語能力試験N1')
+
+# 変更項目 → 書き換える申請者情報のキー
+LEVER_FIELDS = {
+    'salary': 'salary',
+    'experience_years': 'experience',
+    'qualifications': 'qualifications',
+}
+
+
+class _Option:
+    __slots__ = ('lever', 'value', 'cost', 'label')
+
+    def __init__(self, lever: str, value: Any, cost: int, label: str):
+        self.lever = lever
+        self.value = value
+        self.cost = cost
+        self.label = label
+
+
+def _salary_targets(req: CompiledRequirement) -> List[int]:
+    condition = req.condition
+    amount_match = re.search(r'(\d+)万円', condition)
+    if amount_match:
+        amount = int(amount_match.group(1)) * 10000
+        return [math.ceil(amount / 12)] if '年収' in condition else [amount]
+    return []
+
+
+def _experience_targets(req: CompiledRequirement) -> List[int]:
+    years_match = re.search(r'(\d+)年', req.condition)
+    return [int(years_match.group(1))] if years_match else []
+
+
+def _qualification_targets(req: CompiledRequirement) -> List[str]:
+    terms = vocabulary.parse_condition(req.condition)
+    targets = []
+    if terms.jlpt_level:
+        targets.append(f'日本語能力試験N{terms.jlpt_level}')
+    if terms.skill_test:
+        targets.append(SKILL_TEST)
+    return targets
+
+
+def compile_levers(visa: CompiledVisa, profile: ApplicantProfile,
+                   equivalent_salary: Callable[[ApplicantProfile], int]) -> List[List[_Option]]:
+    """
+    在留資格の要件から変更候補を抽出
+
+    Args:
+        equivalent_salary: 「日本人と同等以上」の基準額（経験年数で変わるため、変更後のプロファイルごとに求める）
+
+    Returns:
+        変更項目ごとの選択肢のリスト（各項目から高々1つを選ぶ）
+    """
+    salary = profile.salary
+    years = profile.total_years
+
+    salaries, year_targets, qualifications = set(), set(), []
+    equivalent = False
+    for req in visa.requirements:
+        if req.requirement_type == 'salary':
+            if wages.is_equivalent_condition(req.condition):
+                equivalent = True
+            else:
+                salaries.update(_salary_targets(req))
+        elif req.requirement_type == 'experience':
+            year_targets.update(_experience_targets(req))
+        elif req.requirement_type == 'qualification':
+            qualifications.extend(q for q in _qualification_targets(req) if q not in qualifications)
+        elif req.depends_on == HSP_POINTS_DEPENDENCIES:
+            salaries.update(math.ceil(t / 12) for t in hsp_points.SALARY_THRESHOLDS)
+            salaries.add(math.ceil(hsp_points.MINIMUM_ANNUAL_SALARY / 12))
+            year_targets.update(y for y, _ in hsp_points.CAREER_POINTS)
+            qualifications.extend(q for q in HSP_QUALIFICATIONS if q not in qualifications)
+
+    if equivalent:
+        salaries.update(
+            equivalent_salary(profile.vary(total_years=y))
+            for y in {years} | {y for y in year_targets if y > years}
+        )
+
+    levers = []
+    salary_options = [
+        _Option('salary', s, math.ceil((s - salary) / 10000) * COST_PER_10K_YEN, f'月額報酬を¥{s:,}以上に引き上げ')
+        for s in sorted(salaries) if s > salary
+    ]
+    if salary_options:
+        levers.append(salary_options)
+    year_options = [
+        _Option('experience_years', y, (y - years) * COST_PER_YEAR, f'実務経験を{y}年以上にする（あと{y - years}年）')
+        for y in sorted(year_targets) if y > years
+    ]
+    if year_options:
+        levers.append(year_options)
+    for q in qualifications:
+        levers.append([_Option('qualifications', [q], COST_PER_QUALIFICATION, f'{q}を取得')])
+    return levers
+
+
+class _Evaluator:
+    """1つの在留資格について、変更後の申請者プロファイルの充足状況を計算"""
+
+    def __init__(self, engine: 'VisaDiagnosisEngine', visa: CompiledVisa):
+        self.engine = engine
+        self.requirements = visa.requirements
+        self.max_score = sum(req.weight for req in visa.requirements)
+
+    def met(self, profile: ApplicantProfile) -> List[bool]:
+        return [bool(self.engine._check_requirement(req, profile)['met']) for req in self.requirements]
+
+    def score(self, points: int) -> int:
+        return int(points / self.max_score * 100) if self.max_score else 0
+
+    def points(self, met: List[bool]) -> int:
+        return sum(req.weight for req, ok in zip(self.requirements, met) if ok)
+
+
+def solve(engine: 'VisaDiagnosisEngine', visa: CompiledVisa, profile: ApplicantProfile,
+          target_score: int) -> Optional[Dict[str, Any]]:
+    """
+    1つの在留資格について最小コストの改善パスを探索
+
+    Returns:
+        改善パス（要件未設定の在留資格はNone）
+    """
+    if not visa.requirements:
+        return None
+
+    evaluator = _Evaluator(engine, visa)
+    levers = compile_levers(visa, profile, lambda p: engine.equivalent_salary(p)[0])
+
+    base_met = evaluator.met(profile)
+    base_score = evaluator.score(evaluator.points(base_met))
+
+    # すべての変更を最大限行った場合に充足できる要件（＝解消可能な範囲）
+    maxed = profile
+    for options in levers:
+        maxed = apply_change(maxed, options[-1].lever, options[-1].value)
+    max_met = evaluator.met(maxed)
+    reachable_score = evaluator.score(evaluator.points(max_met))
+    goal_score = min(target_score, reachable_score)
+    required = [req.is_mandatory and ok for req, ok in zip(evaluator.requirements, max_met)]
+
+    # 各要件に影響する変更項目の番号
+    lever_deps = [
+        {i for i, options in enumerate(levers) if LEVER_FIELDS[options[0].lever] in req.depends_on}
+        for req in evaluator.requirements
+    ]
+
+    best: Dict[str, Any] = {'cost': math.inf, 'changes': None, 'met': None}
+
+    def is_goal(met: List[bool]) -> bool:
+        if any(need and not ok for need, ok in zip(required, met)):
+            return False
+        return evaluator.score(evaluator.points(met)) >= goal_score
+
+    def upper_bound(met: List[bool], depth: int) -> int:
+        # 未決定の変更項目に依存する未充足要件がすべて充足されたと仮定
+        points = sum(
+            req.weight for req, ok, deps in zip(evaluator.requirements, met, lever_deps)
+            if ok or any(i >= depth for i in deps)
+        )
+        return evaluator.score(points)
+
+    def search(depth: int, current: ApplicantProfile, met: List[bool], cost: int, changes: Tuple[_Option, ...]):
+        if cost >= best['cost']:
+            return
+        if is_goal(met):
+            best.update(cost=cost, changes=changes, met=met)
+            return
+        if depth == len(levers) or upper_bound(met, depth) < goal_score:
+            return
+        # 変更なし → 低コストの選択肢の順に試す
+        search(depth + 1, current, met, cost, changes)
+        for option in levers[depth]:
+            if cost + option.cost >= best['cost']:
+                break
+            varied = apply_change(current, option.lever, option.value)
+            search(depth + 1, varied, evaluator.met(varied), cost + option.cost, changes + (option,))
+
+    search(0, profile, base_met, 0, ())
+
+    final_met = best['met'] if best['met'] is not None else base_met
+    return {
+        'visa_category': {'code': visa.code, 'name_ja': visa.name_ja},
+        'current_score': base_score,
+        'target_score': target_score,
+        'target_reachable': reachable_score >= target_score,
+        'projected_score': evaluator.score(evaluator.points(final_met)),
+        'changes': [
+            {'field': o.lever, 'value': o.value, 'label': o.label, 'cost': o.cost}
+            for o in (best['changes'] or ())
+        ],
+        'total_cost': best['cost'] if best['changes'] is not None else 0,
+        'unresolvable': [
+            req.condition
+            for req, ok in zip(evaluator.requirements, final_met)
+            if req.is_mandatory and not ok
+        ],
+    }
+
+
+def solve_all(engine: 'VisaDiagnosisEngine', visas: List[CompiledVisa], profile: ApplicantProfile,
+              target_score: int) -> List[Dict[str, Any]]:
+    """候補となる各在留資格について改善パスを探索（到達スコアの高い順、同点は低コスト順）"""
+    paths = [solve(engine, visa, profile, target_score) for visa in visas]
+    paths = [path for path in paths if path is not None]
+    paths.sort(key=lambda p: (-p['projected_score'], p['total_cost']))
+    return paths
@@ -0,0 +1,140 @@
+"""
+診断結果の詳細度 - detail（minimal / standard / full）とfieldsによる項目の選択
+
+診断エンジンは選択された項目だけを計算する（シリアライズ時に削るのではない）。
+fieldsには結果の項目名と、候補ごとの項目名（options.<項目名>）をカンマ区切りで指定する。
+topを指定すると上位の候補だけを返し、エンジンはそれ以外の候補の計算を打ち切る。
+"""
+from dataclasses import dataclass
+from typing import FrozenSet, Optional
+
+# 診断結果の項目
+RESULT_FIELDS = (
+    'diagnosis_id', 'applicant_summary', 'top_recommendations', 'all_options',
+    'analysis_summary', 'next_steps', 'improvement_paths', 'ai_analysis',
+)
+# 候補（top_recommendations / all_options の各要素）の項目
+OPTION_FIELDS = (
+    'visa_category', 'match_score', 'requirements_status', 'missing_items',
+    'recommendation_level', 'approval_probability', 'required_documents',
+)
+OPTION_PREFIX = 'options.'
+# top_recommendations・AI分析で使う上位の候補数
+TOP_RECOMMENDATIONS = 3
+
+DETAIL_LEVELS = {
+    # スコアのみ（在留資格とスコアの一覧）
+    'minimal': (('diagnosis_id', 'all_options'), ('visa_category', 'match_score')),
+    # AI分析と改善パス探索を除く
+    'standard': (
+        ('diagnosis_id', 'applicant_summary', 'top_recommendations', 'all_options', 'analysis_summary', 'next_steps'),
+        OPTION_FIELDS,
+    ),
+    'full': (RESULT_FIELDS, OPTION_FIELDS),
+}
+DEFAULT_DETAIL = 'full'
+
+
+class DetailError(ValueError):
+    """detail・fieldsの指定エラー"""
+
+
+@dataclass(frozen=True)
+class ResultSpec:
+    """計算して返す項目"""
+    result_fields: FrozenSet[str]
+    option_fields: FrozenSet[str]
+    top: Optional[int] = None  # 返す候補数の上限（Noneは全件）
+
+    def wants(self, field: str) -> bool:
+        return field in self.result_fields
+
+    def wants_option(self, field: str) -> bool:
+        return field in self.option_fields
+
+    @property
+    def needs_missing(self) -> bool:
+        """不足要件の集計が必要か（候補の項目のほか、サマリー・次のステップ・AI分析で使う）"""
+        return bool(
+            self.option_fields & {'missing_items', 'approval_probability'}
+            or self.result_fields & {'analysis_summary', 'next_steps', 'ai_analysis'}
+        )
+
+    @property
+    def candidate_limit(self) -> Optional[int]:
+        """
+        スコア順の上位何件まで計算すればよいか（Noneは全件）
+
+        all_optionsを返さない場合、top_recommendations・AI分析は上位3件、
+        サマリー・次のステップは第1候補だけを使う。
+        """
+        if self.wants('all_options'):
+            return self.top
+        if self.result_fields & {'top_recommendations', 'ai_analysis'}:
+            needed = TOP_RECOMMENDATIONS
+        elif self.result_fields & {'analysis_summary', 'next_steps'}:
+            needed = 1
+        else:
+            needed = 0
+        return needed if self.top is None else min(needed, self.top)
+
+
+def _parse_top(top: Optional[str]) -> Optional[int]:
+    if top in (None, ''):
+        return None
+    try:
+        value = int(top)
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise DetailError('topは1以上の整数で指定してください')
+    return value
+
+
+def parse(detail: Optional[str] = None, fields: Optional[str] = None, top: Optional[str] = None) -> ResultSpec:
+    """
+    detail・fieldsの指定から計算する項目を決定
+
+    Args:
+        detail: minimal / standard / full（省略時はfull）
+        fields: カンマ区切りの項目名（指定した場合はdetailの項目を置き換える。
+            diagnosis_idと候補のvisa_categoryは常に含み、候補の項目を指定しない場合は
+            detailの候補の項目を使う）
+        top: 返す候補数の上限（top_recommendations・all_optionsをスコア順の上位top件に絞る）
+    """
+    detail = detail or DEFAULT_DETAIL
+    if detail not in DETAIL_LEVELS:
+        raise DetailError(f'detailは {", ".join(DETAIL_LEVELS)} のいずれかを指定してください')
+    result_fields, option_fields = DETAIL_LEVELS[detail]
+    top = _parse_top(top)
+    if not fields:
+        return ResultSpec(frozenset(result_fields), frozenset(option_fields), top)
+
+    selected_results, selected_options = set(), set()
+    for name in (f.strip() for f in fields.split(',')):
+        if not name:
+            continue
+        if name.startswith(OPTION_PREFIX) and name[len(OPTION_PREFIX):] in OPTION_FIELDS:
+            selected_options.add(name[len(OPTION_PREFIX):])
+        elif name in RESULT_FIELDS:
+            selected_results.add(name)
+        else:
+            raise DetailError(
+                f'fieldsに不明な項目があります: {name}'
+                f'（指定できる項目: {", ".join(RESULT_FIELDS)}、options.<{"|".join(OPTION_FIELDS)}>）'
+            )
+    if selected_options and not selected_results & {'top_recommendations', 'all_options'}:
+        selected_results.add('all_options')
+    if selected_results:
+        selected_results.add('diagnosis_id')  # セッションIDを兼ねるため常に含める
+    if selected_options:
+        selected_options.add('visa_category')  # 候補の識別に必要なため常に含める
+    return ResultSpec(
+        frozenset(selected_results or result_fields),
+        frozenset(selected_options or option_fields),
+        top,
+    )
+
+
+FULL = parse('full')
+SCORES_ONLY = parse('minimal')
@@ -0,0 +1,185 @@
+"""
+診断セッションのエクスポート - フラットなCSV / JSONLのストリーミング生成
+
+セッションはiterator()で少しずつ読み出し（PostgreSQLではサーバーサイドカーソル）、
+行をまとめて文字列化して返すため、件数によらずメモリ使用量は一定。
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import DiagnosisSession
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+ITERATOR_CHUNK_SIZE = 2000  # DBから1回に読み出す行数
+ROWS_PER_WRITE = 500        # 1回に送出する行数
+
+SESSION_FIELDS = ('session_id', 'status', 'created_at', 'updated_at', 'ruleset_version',
+                   'applicant_data', 'diagnosis_result')
+
+
+class ExportError(ValueError):
+    """エクスポート条件の入力エラー"""
+
+
+def _recommendations(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # detail=minimal の結果はtop_recommendationsを持たないため、スコア順のall_optionsの先頭で代用
+    return (result.get('top_recommendations') or result.get('all_options') or [])[:3]
+
+
+def _top(result: Dict[str, Any]) -> Dict[str, Any]:
+    return (_recommendations(result) or [{}])[0]
+
+
+# 出力列（見出し, 値の取り出し）: 引数は (session値のdict, 申請者情報, 診断結果)
+COLUMNS: List[Tuple[str, Callable[[Dict[str, Any], Dict[str, Any], Dict[str, Any]], Any]]] = [
+    ('session_id', lambda s, a, r: s['session_id']),
+    ('status', lambda s, a, r: s['status']),
+    ('created_at', lambda s, a, r: s['created_at'].isoformat()),
+    ('updated_at', lambda s, a, r: s['updated_at'].isoformat()),
+    ('ruleset_version', lambda s, a, r: s['ruleset_version']),
+    ('nationality', lambda s, a, r: a.get('nationality', '')),
+    ('age', lambda s, a, r: a.get('age')),
+    ('degree', lambda s, a, r: (a.get('education') or {}).get('degree', '')),
+    ('major', lambda s, a, r: (a.get('education') or {}).get('major', '')),
+    ('university', lambda s, a, r: (a.get('education') or {}).get('university', '')),
+    ('experience_years', lambda s, a, r: sum(exp.get('years', 0) for exp in a.get('experience') or [])),
+    ('experience_fields', lambda s, a, r: '; '.join(exp.get('field', '') for exp in a.get('experience') or [])),
+    ('qualifications', lambda s, a, r: '; '.join(a.get('qualifications') or [])),
+    ('industry', lambda s, a, r: (a.get('job_details') or {}).get('industry', '')),
+    ('position', lambda s, a, r: (a.get('job_details') or {}).get('position', '')),
+    ('salary', lambda s, a, r: a.get('salary', 0)),
+    ('company_name', lambda s, a, r: (a.get('company_info') or {}).get('name', '')),
+    ('diagnosis_id', lambda s, a, r: r.get('diagnosis_id', '')),
+    ('top_visa_code', lambda s, a, r: (_top(r).get('visa_category') or {}).get('code', '')),
+    ('top_visa_name', lambda s, a, r: (_top(r).get('visa_category') or {}).get('name_ja', '')),
+    ('top_score', lambda s, a, r: _top(r).get('match_score')),
+    ('top_level', lambda s, a, r: _top(r).get('recommendation_level', '')),
+    ('recommended_codes', lambda s, a, r: '; '.join(
+        rec['visa_category']['code'] for rec in _recommendations(r)
+    )),
+]
+HEADERS = [name for name, _ in COLUMNS]
+
+
+def _parse_date(value: str, name: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'{name}はYYYY-MM-DD形式で指定してください')
+
+
+def filter_sessions(params: Dict[str, str]) -> QuerySet:
+    """
+    エクスポート対象のセッション
+
+    Args:
+        params: status（完了・中断など）、created_from・created_to（作成日、両端を含む）
+    """
+    queryset = DiagnosisSession.objects.all()
+    if params.get('status'):
+        statuses = dict(DiagnosisSession.STATUS_CHOICES)
+        if params['status'] not in statuses:
+            raise ExportError(f'statusは {", ".join(statuses)} のいずれかを指定してください')
+        queryset = queryset.filter(status=params['status'])
+
+    tz = timezone.get_current_timezone()
+    if params.get('created_from'):
+        start = _parse_date(params['created_from'], 'created_from')
+        queryset = queryset.filter(created_at__gte=datetime.combine(start, time.min, tz))
+    if params.get('created_to'):
+        end = _parse_date(params['created_to'], 'created_to') + timedelta(days=1)
+        queryset = queryset.filter(created_at__lt=datetime.combine(end, time.min, tz))
+    return queryset
+
+
+def session_row(session: Dict[str, Any]) -> List[Any]:
+    """セッション（SESSION_FIELDSの値のdict）の出力列の値"""
+    applicant = session['applicant_data'] or {}
+    result = session['diagnosis_result'] or {}
+    return [getter(session, applicant, result) for _, getter in COLUMNS]
+
+
+def _rows(queryset: QuerySet) -> Iterator[List[Any]]:
+    """セッションを主キー順に少しずつ読み出して出力列の値に変換"""
+    for session in queryset.order_by('pk').values(*SESSION_FIELDS).iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        yield session_row(session)
+
+
+def csv_chunks(headers: List[str], rows: Iterable[List[Any]]) -> Iterator[str]:
+    """CSV（見出し行つき）をROWS_PER_WRITE行ずつ生成"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % ROWS_PER_WRITE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(headers: List[str], rows: Iterable[List[Any]]) -> Iterator[str]:
+    """JSONL（1行1レコード、CSVと同じ列）をROWS_PER_WRITE行ずつ生成"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(headers, row)), ensure_ascii=False))
+        if len(lines) == ROWS_PER_WRITE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_csv(queryset: QuerySet) -> Iterator[str]:
+    """セッションのCSV"""
+    return csv_chunks(HEADERS, _rows(queryset))
+
+
+def iter_jsonl(queryset: QuerySet) -> Iterator[str]:
+    """セッションのJSONL"""
+    return jsonl_chunks(HEADERS, _rows(queryset))
+
+
+def gzip_stream(chunks: Iterable[str]) -> Iterator[bytes]:
+    """文字列の列をgzip形式で逐次圧縮"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_response(queryset: QuerySet, fmt: str = 'csv', compress: bool = False) -> StreamingHttpResponse:
+    """エクスポートのStreamingHttpResponse（添付ファイル）"""
+    return rows_response(HEADERS, _rows(queryset), fmt, compress)
+
+
+def rows_response(headers: List[str], rows: Iterable[List[Any]], fmt: str = 'csv', compress: bool = False,
+                  basename: str = 'diagnosis_sessions') -> StreamingHttpResponse:
+    """任意の行のStreamingHttpResponse（添付ファイル、ファイル名は basename_日時.形式）"""
+    if fmt not in FORMATS:
+        raise ExportError(f'formatは {", ".join(FORMATS)} のいずれかを指定してください')
+
+    chunks = csv_chunks(headers, rows) if fmt == 'csv' else jsonl_chunks(headers, rows)
+    filename = f'{basename}_{timezone.localtime():%Y%m%d_%H%M%S}.{fmt}'
+    if compress:
+        response = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,188 @@
+"""
+高度専門職ポイント計算 - 高度専門・技術活動（1号ロ）のポイント表
+
+ポイント表はすべてデータとして定義し、候補者リストを列単位でまとめて評価する。
+1件の計算も score_batch([applicant]) と同じ経路を通る。診断エンジンからは
+解析済みのApplicantProfileを score_profiles() に渡す。
+"""
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional
+
+from . import vocabulary
+from .profile import ApplicantProfile
+
+# ---------------------------------------------------------------------------
+# ポイント表
+# ---------------------------------------------------------------------------
+
+PASS_LINE = 70
+FAST_TRACK_LINE = 80
+MINIMUM_ANNUAL_SALARY = 3_000_000  # 年収300万円未満は対象外
+
+# 学歴（最上位の学位のみ加算）
+ACADEMIC_POINTS = {
+    'doctor': 30,
+    'professional_master': 25,  # MBA・MOT等の専門職学位
+    'master': 20,
+    'bachelor': 10,
+    'none': 0,
+}
+MULTIPLE_DEGREE_BONUS = 5
+
+# 職歴（従事しようとする業務に係る実務経験年数の下限, ポイント）
+CAREER_POINTS = ((10, 20), (7, 15), (5, 10), (3, 5))
+
+# 年齢帯（上限未満で判定）: 〜29歳, 30〜34歳, 35〜39歳, 40歳〜
+AGE_BAND_UPPER = (30, 35, 40)
+AGE_POINTS = (15, 10, 5, 0)
+
+# 年収（下限の昇順）× 年齢帯のポイント
+SALARY_THRESHOLDS = (4_000_000, 5_000_000, 6_000_000, 7_000_000, 8_000_000, 9_000_000, 10_000_000)
+SALARY_POINTS_BY_AGE_BAND = (
+    # 400万 500万 600万 700万 800万 900万 1000万
+    (10, 15, 20, 25, 30, 35, 40),  # 〜29歳
+    (0, 15, 20, 25, 30, 35, 40),   # 30〜34歳
+    (0, 0, 20, 25, 30, 35, 40),    # 35〜39歳
+    (0, 0, 0, 0, 30, 35, 40),      # 40歳〜
+)
+
+# ボーナス
+JLPT_BONUS = {'N1': 15, 'N2': 10}
+JAPAN_UNIVERSITY_BONUS = 10
+RESEARCH_BONUS = 15
+
+# ---------------------------------------------------------------------------
+# 表の事前展開（評価時は添字参照のみ）
+# ---------------------------------------------------------------------------
+
+_MAX_CAREER_YEARS = CAREER_POINTS[0][0]
+_CAREER_LOOKUP = tuple(
+    next((points for years, points in CAREER_POINTS if y >= years), 0)
+    for y in range(_MAX_CAREER_YEARS + 1)
+)
+_SALARY_LOOKUP = tuple((0,) + row for row in SALARY_POINTS_BY_AGE_BAND)
+_UNKNOWN_AGE_BAND = len(AGE_BAND_UPPER)  # 年齢不明は最も厳しい帯で評価
+
+
+def _degree_rank(level: str) -> str:
+    # 加点のない学位（短大・専門学校など）は none
+    return level if level in ACADEMIC_POINTS else 'none'
+
+
+def _bonus(jlpt_label: str, japan_university: bool, research: bool) -> int:
+    # N2の加算は日本の大学の卒業者には付かない（N1取得者はN1の加算のみ）
+    jlpt = 0 if jlpt_label == 'N2' and japan_university else JLPT_BONUS.get(jlpt_label, 0)
+    return (
+        jlpt
+        + (JAPAN_UNIVERSITY_BONUS if japan_university else 0)
+        + (RESEARCH_BONUS if research else 0)
+    )
+
+
+def _annual_salary(applicant: Dict[str, Any]) -> int:
+    if applicant.get('annual_salary'):
+        return int(applicant['annual_salary'])
+    return int(applicant.get('salary') or 0) * 12
+
+
+def _age(applicant: Dict[str, Any]) -> Optional[int]:
+    age = applicant.get('age')
+    return int(age) if age not in (None, '') else None
+
+
+def score_batch(applicants: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    候補者リストのポイントを一括計算
+
+    Args:
+        applicants: 申請者情報のリスト（diagnose()と同じ形式、加えて任意で
+            age, annual_salary, education.japan_university,
+            education.multiple_degrees, research_achievements）
+
+    Returns:
+        各候補者の {'total', 'breakdown', 'annual_salary', 'eligible', 'fast_track', 'notes'}
+    """
+    # 列の抽出（ポイント計算だけのためにApplicantProfile全体は作らない）
+    educations = [a.get('education') or {} for a in applicants]
+    return _score_columns(
+        degree_col=[_degree_rank(vocabulary.parse_degree(e.get('degree') or '')) for e in educations],
+        multiple_col=[bool(e.get('multiple_degrees')) for e in educations],
+        years_col=[sum(exp.get('years', 0) for exp in a.get('experience') or []) for a in applicants],
+        salary_col=[_annual_salary(a) for a in applicants],
+        age_col=[_age(a) for a in applicants],
+        bonus_col=[
+            _bonus(
+                vocabulary.parse_qualifications(a.get('qualifications')).jlpt_label,
+                bool(e.get('japan_university')),
+                bool(a.get('research_achievements')),
+            )
+            for a, e in zip(applicants, educations)
+        ],
+    )
+
+
+def score_profiles(profiles: List[ApplicantProfile]) -> List[Dict[str, Any]]:
+    """解析済みの申請者プロファイルのポイントを一括計算（戻り値はscore_batch()と同じ）"""
+    return _score_columns(
+        degree_col=[_degree_rank(p.degree_level) for p in profiles],
+        multiple_col=[p.multiple_degrees for p in profiles],
+        years_col=[p.total_years for p in profiles],
+        salary_col=[p.annual_salary for p in profiles],
+        age_col=[p.age for p in profiles],
+        bonus_col=[_bonus(p.held.jlpt_label, p.japan_university, p.research_achievements) for p in profiles],
+    )
+
+
+def _score_columns(degree_col: List[str], multiple_col: List[bool], years_col: List[int],
+                   salary_col: List[int], age_col: List[Optional[int]], bonus_col: List[int]) -> List[Dict[str, Any]]:
+    """抽出済みの列からポイントを計算"""
+    # 列ごとの表引き
+    band_col = [
+        _UNKNOWN_AGE_BAND if age is None else bisect_right(AGE_BAND_UPPER, age)
+        for age in age_col
+    ]
+    academic_col = [
+        ACADEMIC_POINTS[rank] + (MULTIPLE_DEGREE_BONUS if multiple else 0)
+        for rank, multiple in zip(degree_col, multiple_col)
+    ]
+    career_col = [_CAREER_LOOKUP[max(0, min(int(y), _MAX_CAREER_YEARS))] for y in years_col]
+    salary_idx_col = [bisect_right(SALARY_THRESHOLDS, s) for s in salary_col]
+    salary_points_col = [_SALARY_LOOKUP[b][i] for b, i in zip(band_col, salary_idx_col)]
+    age_points_col = [0 if age is None else AGE_POINTS[b] for age, b in zip(age_col, band_col)]
+
+    results = []
+    for academic, career, salary_points, age_points, bonus, salary, age in zip(
+        academic_col, career_col, salary_points_col, age_points_col, bonus_col, salary_col, age_col
+    ):
+        total = academic + career + salary_points + age_points + bonus
+        eligible = total >= PASS_LINE and salary >= MINIMUM_ANNUAL_SALARY
+        notes = []
+        if age is None:
+            notes.append('年齢が未入力のため年齢・年収ポイントは40歳以上として計算')
+        if salary < MINIMUM_ANNUAL_SALARY:
+            notes.append('年収300万円未満のため対象外')
+        results.append({
+            'total': total,
+            'breakdown': {
+                'academic': academic,
+                'career': career,
+                'salary': salary_points,
+                'age': age_points,
+                'bonus': bonus,
+            },
+            'annual_salary': salary,
+            'eligible': eligible,
+            'fast_track': eligible and total >= FAST_TRACK_LINE,
+            'notes': notes,
+        })
+    return results
+
+
+def score(applicant: Dict[str, Any]) -> Dict[str, Any]:
+    """1名分のポイント計算"""
+    return score_batch([applicant])[0]
+
+
+def score_profile(profile: ApplicantProfile) -> Dict[str, Any]:
+    """1名分のポイント計算（解析済みのプロファイルから）"""
+    return score_profiles([profile])[0]
@@ -0,0 +1,65 @@
+"""
+診断ID - 時刻順に並ぶ一意なID（UUIDv7形式）
+
+先頭48ビットがミリ秒単位のUNIX時刻のため、IDの文字列順が発行順と一致し、
+セッションIDの一意インデックスへの挿入は末尾への追記になる。
+同じミリ秒内はプロセス内のカウンタ（12ビット）で順序を保ち、
+残りの62ビットは乱数のため、複数プロセスで同時に発行しても衝突しない。
+
+IDは発行時刻を含み、乱数部分も62ビットしかないため秘密の値としては扱わない。
+診断セッションの外部URLにはIDとは別にアクセストークン（access_token）を付ける。
+"""
+import os
+import threading
+import time
+import uuid
+
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+
+_COUNTER_BITS = 12
+_COUNTER_MAX = (1 << _COUNTER_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def new_id() -> str:
+    """新しい診断ID（診断結果のdiagnosis_idとセッションIDで共用）"""
+    global _last_ms, _counter
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            # カウンタの初期値は乱数の下位ビットから取り、上位には桁あふれの余地を残す
+            _counter = int.from_bytes(os.urandom(2), 'big') & (_COUNTER_MAX >> 1)
+        elif _counter < _COUNTER_MAX:
+            _counter += 1
+        else:
+            # 同じミリ秒内でカウンタを使い切った場合は時刻を1ミリ秒進める
+            _last_ms += 1
+            _counter = 0
+        ms, counter = _last_ms, _counter
+
+    rand = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    value = (ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | rand
+    return str(uuid.UUID(int=value))
+
+
+
+_ACCESS_TOKEN_SALT = 'visa_diagnosis.session-access'
+
+
+def access_token(session_id: str) -> str:
+    """
+    診断セッションのアクセストークン（結果ページ・取得APIのURLに付ける）
+
+    セッションIDのHMAC-SHA256署名（SECRET_KEYを知らなければ作れない）のため、DBに保存しない。
+    """
+    return signing.Signer(salt=_ACCESS_TOKEN_SALT).signature(session_id)
+
+
+def verify_access_token(session_id: str, token: str) -> bool:
+    """アクセストークンがセッションIDのものか"""
+    return bool(token) and constant_time_compare(token, access_token(session_id))
@@ -0,0 +1,316 @@
+"""
+負荷試験 - asyncioによる仮想クライアントの負荷生成と集計（loadtestコマンド用）
+
+- クローズドモデル: 同時実行数（仮想クライアント数）を固定し、各クライアントは応答を
+  受け取ってから次のリクエストを送る。ワーカー構成ごとの最大スループットの測定向け
+- オープンモデル: 到着率（リクエスト/秒）を固定し、応答を待たずに予定時刻に送る。
+  遅延は予定時刻から計測するため、サーバーの飽和による待ちも遅延に含まれる
+  （coordinated omissionを起こさない）
+
+遅延は対数ビンのヒストグラム（ビン幅は約9%）で集計するため、件数によらずメモリは一定。
+"""
+import asyncio
+import bisect
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MODES = ('closed', 'open')
+ARRIVALS = ('poisson', 'uniform')
+ENDPOINTS = ('diagnose', 'submit', 'visa_list')
+
+# 遅延ヒストグラムのビン（0.1ms〜約140秒、2^(1/8)倍ずつ）
+_BUCKET_BOUNDS = [0.1 * 2 ** (i / 8) for i in range(8 * 21)]
+
+
+class LatencyHistogram:
+    """遅延（ミリ秒）のヒストグラム"""
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms: float):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p: float) -> float:
+        """p（0〜100）パーセンタイル（ビンの上限値、最大値を超えない）"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_BUCKET_BOUNDS[i], self.max) if i < len(_BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'mean': round(self.total / self.count, 2) if self.count else 0.0,
+            'p50': round(self.percentile(50), 2),
+            'p90': round(self.percentile(90), 2),
+            'p99': round(self.percentile(99), 2),
+            'max': round(self.max, 2),
+        }
+
+    def buckets(self) -> List[Dict[str, Any]]:
+        """件数のあるビン（le_ms: ビンの上限、最後のビンはnull）"""
+        return [
+            {'le_ms': round(_BUCKET_BOUNDS[i], 3) if i < len(_BUCKET_BOUNDS) else None, 'count': n}
+            for i, n in enumerate(self.counts) if n
+        ]
+
+
+@dataclass
+class _Counter:
+    """件数と遅延の集計（ステージ全体・エンドポイント別・時間区間別）"""
+    requests: int = 0
+    ok: int = 0
+    throttled: int = 0
+    errors: int = 0
+    status_codes: Dict[str, int] = field(default_factory=dict)
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def record(self, status: str, ms: float):
+        self.requests += 1
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+        if status.isdigit() and int(status) < 400:
+            self.ok += 1
+        elif status == '429':
+            self.throttled += 1
+        else:
+            self.errors += 1
+        self.latency.record(ms)
+
+    def report(self, seconds: float, histogram: bool = False) -> Dict[str, Any]:
+        report = {
+            'requests': self.requests,
+            'ok': self.ok,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'error_rate': round(self.errors / self.requests, 4) if self.requests else 0.0,
+            'throughput_rps': round(self.ok / seconds, 2) if seconds > 0 else 0.0,
+            'status_codes': dict(sorted(self.status_codes.items())),
+            'latency_ms': self.latency.summary(),
+        }
+        if histogram:
+            report['histogram'] = self.latency.buckets()
+        return report
+
+
+class StageStats:
+    """1ステージの集計（ウォームアップ中に完了したリクエストは含めない）"""
+
+    def __init__(self, warmup: float, duration: float, interval: float):
+        self.warmup = warmup
+        self.duration = duration
+        self.interval = interval
+        self.total = _Counter()
+        self.endpoints: Dict[str, _Counter] = {}
+        self.timeline: Dict[int, _Counter] = {}
+        self.dropped = 0
+
+    def record(self, endpoint: str, status: str, elapsed: float, ms: float):
+        """
+        Args:
+            elapsed: ステージ開始から完了までの秒数
+            ms: 遅延（ミリ秒）
+        """
+        t = elapsed - self.warmup
+        if t < 0:
+            return
+        self.total.record(status, ms)
+        self.endpoints.setdefault(endpoint, _Counter()).record(status, ms)
+        self.timeline.setdefault(int(t // self.interval), _Counter()).record(status, ms)
+
+    def report(self) -> Dict[str, Any]:
+        report = self.total.report(self.duration, histogram=True)
+        report['dropped'] = self.dropped
+        report['endpoints'] = {
+            name: counter.report(self.duration, histogram=True) for name, counter in sorted(self.endpoints.items())
+        }
+        last = max(self.timeline) if self.timeline else -1
+        report['timeline'] = [
+            {'t': round(i * self.interval, 3), **self.timeline.get(i, _Counter()).report(self.interval)}
+            for i in range(last + 1)
+        ]
+        return report
+
+
+# ---------------------------------------------------------------------------
+# リクエスト内容
+# ---------------------------------------------------------------------------
+
+_NATIONALITIES = ['ベトナム', '中国', 'フィリピン', 'インドネシア', 'ネパール', 'ミャンマー', '韓国', 'インド']
+_DEGREES = ['学士', '修士', '博士', '専門士', '高校', 'Bachelor', '']
+_MAJORS = ['情報工学', '経営学', '機械工学', '日本語', '国際関係学', '調理', '']
+_JOBS = [
+    ('IT・ソフトウェア', 'システムエンジニア'), ('IT・ソフトウェア', 'プログラマー'),
+    ('製造業', '製造技術者'), ('製造業', '製造ライン作業'), ('商社・貿易', '海外営業'),
+    ('飲食業', '調理師'), ('建設業', '建設作業員'), ('介護', '介護職員'),
+    ('宿泊業', 'フロント業務'), ('農業', '農業作業員'), ('サービス業', '通訳'),
+]
+_QUALIFICATIONS = [
+    [], ['日本語能力試験N1'], ['日本語能力試験N2'], ['JLPT N3'], ['日本語能力試験N4'],
+    ['特定技能評価試験（介護）', '日本語能力試験N4'], ['基本情報技術者試験', '日本語能力試験N2'],
+]
+
+
+def synthetic_applicant(rng: random.Random) -> Dict[str, Any]:
+    """合成の申請者情報（/diagnose/ と同じ形式）"""
+    industry, position = rng.choice(_JOBS)
+    return {
+        'nationality': rng.choice(_NATIONALITIES),
+        'age': rng.randint(20, 45),
+        'education': {'degree': rng.choice(_DEGREES), 'major': rng.choice(_MAJORS), 'university': ''},
+        'experience': [{'years': rng.randint(0, 12), 'field': position}] if rng.random() < 0.8 else [],
+        'qualifications': list(rng.choice(_QUALIFICATIONS)),
+        'job_details': {'industry': industry, 'position': position, 'duties': ''},
+        'salary': rng.choice([180000, 220000, 250000, 300000, 400000, 600000]),
+        'company_info': {'name': '株式会社サンプル'} if rng.random() < 0.7 else {},
+    }
+
+
+def form_fields(applicant: Dict[str, Any]) -> Dict[str, str]:
+    """申請者情報を診断フォームの項目に変換（profile.applicant_data_from_form の逆）"""
+    education = applicant.get('education') or {}
+    experience = applicant.get('experience') or []
+    job_details = applicant.get('job_details') or {}
+    return {
+        'nationality': applicant.get('nationality') or '',
+        'age': str(applicant.get('age') or ''),
+        'degree': education.get('degree') or '',
+        'major': education.get('major') or '',
+        'university': education.get('university') or '',
+        'experience_years': str(sum(exp.get('years', 0) for exp in experience)) if experience else '',
+        'experience_field': experience[0].get('field', '') if experience else '',
+        'qualifications': ','.join(applicant.get('qualifications') or []),
+        'industry': job_details.get('industry') or '',
+        'position': job_details.get('position') or '',
+        'prefecture': job_details.get('prefecture') or '',
+        'duties': job_details.get('duties') or '',
+        'salary': str(applicant.get('salary') or ''),
+        'company_name': (applicant.get('company_info') or {}).get('name') or '',
+    }
+
+
+@dataclass(frozen=True)
+class LoadConfig:
+    """負荷の設定（ステージ間で共通）"""
+    mode: str
+    paths: Dict[str, str]                 # エンドポイント名 → パス
+    mix: Tuple[Tuple[str, float], ...]    # (エンドポイント名, 重み)
+    payloads: Sequence[Dict[str, Any]]    # 空なら合成データ
+    diagnose_query: str = ''
+    duration: float = 30.0
+    warmup: float = 5.0
+    interval: float = 1.0
+    think_time: float = 0.0               # クローズドモデルの応答後の待ち時間（秒）
+    arrival: str = 'poisson'
+    connections: int = 100                # オープンモデルの最大接続数
+    max_in_flight: int = 10000            # オープンモデルで同時に待つリクエストの上限（超えた分は破棄）
+
+
+class _Requester:
+    """エンドポイントの選択とリクエストの送信"""
+
+    def __init__(self, client, config: LoadConfig, rng: random.Random):
+        self.client = client
+        self.config = config
+        self.rng = rng
+        self.names = [name for name, _ in config.mix]
+        self.weights = [weight for _, weight in config.mix]
+
+    def _applicant(self) -> Dict[str, Any]:
+        if self.config.payloads:
+            return self.rng.choice(self.config.payloads)
+        return synthetic_applicant(self.rng)
+
+    async def send(self, stats: StageStats, stage_start: float, scheduled: Optional[float] = None):
+        endpoint = self.rng.choices(self.names, self.weights)[0]
+        path = self.config.paths[endpoint]
+        if endpoint == 'diagnose':
+            if self.config.diagnose_query:
+                path = f'{path}?{self.config.diagnose_query}'
+            request = self.client.post(path, json=self._applicant())
+        elif endpoint == 'submit':
+            request = self.client.post(path, data=form_fields(self._applicant()))
+        else:
+            request = self.client.get(path)
+
+        started = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            response = await request
+            await response.aread()
+            status = str(response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        stats.record(endpoint, status, finished - stage_start, (finished - started) * 1000)
+
+
+async def run_closed(client, config: LoadConfig, concurrency: int, rng: random.Random) -> StageStats:
+    """クローズドモデルの1ステージ（concurrency個の仮想クライアント）"""
+    stats = StageStats(config.warmup, config.duration, config.interval)
+    requester = _Requester(client, config, rng)
+    stage_start = time.perf_counter()
+    deadline = stage_start + config.warmup + config.duration
+
+    async def virtual_client():
+        while time.perf_counter() < deadline:
+            await requester.send(stats, stage_start)
+            if config.think_time:
+                await asyncio.sleep(config.think_time)
+
+    await asyncio.gather(*(virtual_client() for _ in range(concurrency)))
+    return stats
+
+
+async def run_open(client, config: LoadConfig, rate: float, rng: random.Random) -> StageStats:
+    """オープンモデルの1ステージ（rate件/秒で到着）"""
+    stats = StageStats(config.warmup, config.duration, config.interval)
+    requester = _Requester(client, config, rng)
+    stage_start = time.perf_counter()
+    deadline = stage_start + config.warmup + config.duration
+    in_flight = set()
+
+    scheduled = stage_start
+    while True:
+        scheduled += rng.expovariate(rate) if config.arrival == 'poisson' else 1.0 / rate
+        if scheduled >= deadline:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= config.max_in_flight:
+            stats.dropped += scheduled - stage_start >= config.warmup
+            continue
+        task = asyncio.create_task(requester.send(stats, stage_start, scheduled))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return stats
+
+
+def best_stage(stages: List[Dict[str, Any]], slo_p99_ms: float, max_error_rate: float) -> Optional[Dict[str, Any]]:
+    """遅延のSLO（p99）とエラー率を満たすうち最もスループットが高いステージ（飽和点の目安）"""
+    passing = [
+        stage for stage in stages
+        if stage['latency_ms']['p99'] <= slo_p99_ms and stage['error_rate'] <= max_error_rate
+        and not stage['throttled'] and not stage['dropped']
+    ]
+    if not passing:
+        return None
+    best = max(passing, key=lambda stage: stage['throughput_rps'])
+    return {'level': best['level'], 'throughput_rps': best['throughput_rps'], 'p99_ms': best['latency_ms']['p99']}
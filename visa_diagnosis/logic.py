@@ -1,32 +1,75 @@
 """
 在留資格診断エンジン
 """
+import asyncio
+import bisect
 import re
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 from django.conf import settings
-from .models import VisaCategory, VisaRequirement, IndustryVisaMapping, DocumentTemplate
+from . import ai_integration, counterfactual, detail, hsp_points, identifiers, relevance, vocabulary, wages
 from .ai_integration import VisaAIAnalyzer
+from .profile import ApplicantProfile
+from .ruleset import CompiledRequirement, CompiledVisa, Ruleset, get_ruleset
+
+
+_ai_status_reported = False
+
+
+def _report_ai_status() -> None:
+    """AI機能の状態を表示（プロセスごとに1回）"""
+    global _ai_status_reported
+    if _ai_status_reported:
+        return
+    _ai_status_reported = True
+    if settings.ENABLE_AI_FEATURES and settings.ANTHROPIC_API_KEY:
+        if ai_integration.get_analyzer(settings.ANTHROPIC_API_KEY).is_available():
+            print("✅ AI機能が有効化されました")
+        else:
+            print("⚠️ AI機能の初期化に失敗しました")
+    else:
+        print("ℹ️ AI機能は無効です（settings.pyで有効化できます）")
 
 
 class VisaDiagnosisEngine:
     """在留資格診断エンジン"""
     
-    def __init__(self):
-        """初期化"""
-        self.visa_categories = VisaCategory.objects.filter(is_active=True)
+    # 「日本人と同等以上」の報酬要件で用いる最低基準（月額、賃金の参照値がない場合）
+    EQUIVALENT_SALARY_FLOOR = 220000
+    
+    # 改善パス探索の目標スコア（◎ 強く推奨）
+    IMPROVEMENT_TARGET_SCORE = 80
+    
+    # 関連専攻の要件を満たすとみなす専攻と職種の関連性スコア（やや関連以上）
+    MAJOR_RELEVANCE_PASS = 50
+    
+    def __init__(self, ruleset: Optional[Ruleset] = None, enable_ai: bool = True):
+        """
+        初期化（リクエストごとに作成するため、ルールセット・関連性モデル・AIのSDKは初回使用時に準備する）
         
-        # AI機能の初期化
-        self.ai_analyzer = None
-        if settings.ENABLE_AI_FEATURES and settings.ANTHROPIC_API_KEY:
-            self.ai_analyzer = VisaAIAnalyzer(settings.ANTHROPIC_API_KEY)
-            if self.ai_analyzer.is_available():
-                print("✅ AI機能が有効化されました")
-            else:
-                print("⚠️ AI機能の初期化に失敗しました")
-        else:
-            print("ℹ️ AI機能は無効です（settings.pyで有効化できます）")
+        Args:
+            ruleset: 使用するルールセット（Noneの場合は初回使用時に取得）
+            enable_ai: Falseの場合はAI機能を使わない（再診断などのバッチ処理用）
+        """
+        self._ruleset = ruleset
+        self._relevance_model = None
+        self.enable_ai = enable_ai
+        if enable_ai:
+            _report_ai_status()
+    
+    @property
+    def ai_analyzer(self) -> Optional[VisaAIAnalyzer]:
+        """AIアナライザー（プロセス内で共有、AI機能が無効ならNone）"""
+        if self.enable_ai and settings.ENABLE_AI_FEATURES and settings.ANTHROPIC_API_KEY:
+            return ai_integration.get_analyzer(settings.ANTHROPIC_API_KEY)
+        return None
     
-    def diagnose(self, applicant_data: Dict[str, Any]) -> Dict[str, Any]:
+    @property
+    def relevance_model(self) -> relevance.RelevanceModel:
+        if self._relevance_model is None:
+            self._relevance_model = relevance.get_model()
+        return self._relevance_model
+    
+    def diagnose(self, applicant_data: Dict[str, Any], spec: detail.ResultSpec = detail.FULL) -> Dict[str, Any]:
         """
         診断のメイン処理
         
@@ -39,86 +82,259 @@ class VisaDiagnosisEngine:
                 - job_details: 職務情報 {industry, position, duties}
                 - salary: 月額報酬
                 - company_info: 企業情報
+            spec: 計算して返す項目（detail.parse() で作成、省略時は全項目）
         
         Returns:
             診断結果の辞書
         """
-        results = []
+        # 申請者情報は1回だけ解析し、以降の判定・サマリー・AI分析はプロファイルを参照する
+        profile = ApplicantProfile.from_dict(applicant_data)
+        results = self._score_candidates(profile, spec)
         
-        # 業種・職種からの候補抽出
-        initial_candidates = self._get_candidates_by_job(applicant_data.get('job_details', {}))
+        # AI機能による追加分析
+        ai_analysis = self._perform_ai_analysis(profile, results) if spec.wants('ai_analysis') else None
         
-        # 各在留資格について適合度を計算
-        for visa in self.visa_categories:
-            # 初期候補に含まれない場合はスキップ（効率化）
-            if initial_candidates and visa.id not in initial_candidates:
-                continue
-            
-            score = self._calculate_match_score(visa, applicant_data)
-            
+        return self._build_result(profile, results, ai_analysis, spec)
+    
+    async def adiagnose(self, applicant_data: Dict[str, Any], spec: detail.ResultSpec = detail.FULL) -> Dict[str, Any]:
+        """
+        診断のメイン処理（非同期版）
+        
+        スコア計算はメモリ内のルールセットのみを使うため同期のまま実行し、
+        AI分析の待ち時間だけをイベントループに返す。
+        """
+        profile = ApplicantProfile.from_dict(applicant_data)
+        results = self._score_candidates(profile, spec)
+        
+        # AI機能による追加分析
+        ai_analysis = await self._aperform_ai_analysis(profile, results) if spec.wants('ai_analysis') else None
+        
+        return self._build_result(profile, results, ai_analysis, spec)
+    
+    @property
+    def ruleset(self) -> Ruleset:
+        if self._ruleset is None:
+            self._ruleset = get_ruleset()
+        return self._ruleset
+    
+    def _score_candidates(self, profile: ApplicantProfile, spec: detail.ResultSpec = detail.FULL) -> List[Dict[str, Any]]:
+        """
+        候補となる在留資格のスコアを計算し、スコア順に返す
+        
+        要件ごとの判定内容・必要書類・許可見込みはspecで要求された場合のみ作成する
+        （不足要件と推奨レベルはサマリー等で使うため要求がなくても保持し、_build_resultで除く）。
+        上位の候補だけを使う場合（spec.candidate_limit）は _top_candidates で残りの計算を打ち切る。
+        複数の在留資格に共通する要件（述語）は1回だけ判定する（_check_visa）。
+        """
+        with_details = spec.wants_option('requirements_status')
+        with_missing = spec.needs_missing
+        visas = self._candidate_visas(profile)
+        evaluated = self._new_evaluation()
+        
+        limit = spec.candidate_limit
+        if limit is None or len(visas) <= limit:
+            # 各在留資格について適合度を計算
+            scored = [
+                (visa, self._calculate_match_score(
+                    visa, profile, with_details, with_missing, self._check_visa(visa, profile, evaluated)
+                ))
+                for visa in visas
+            ]
+        else:
+            scored = self._top_candidates(visas, profile, limit, with_details, with_missing, evaluated)
+        
+        results = []
+        for visa, score in scored:
             if score['total_score'] > 0:
-                results.append({
-                    'visa_category': {
-                        'id': visa.id,
-                        'code': visa.code,
-                        'name_ja': visa.name_ja,
-                        'name_en': visa.name_en,
-                        'description': visa.description,
-                    },
+                option = {
+                    'visa_category': visa.category_summary,
                     'match_score': score['total_score'],
-                    'requirements_status': score['details'],
-                    'missing_items': score['missing'],
-                    'recommendation_level': self._get_recommendation_level(score['total_score']),
-                    'approval_probability': self._estimate_approval_probability(score['total_score'], score['missing']),
-                    'required_documents': self._get_required_documents(visa),
-                })
+                }
+                if with_details:
+                    option['requirements_status'] = score['details']
+                option['missing_items'] = score['missing']
+                option['recommendation_level'] = self._get_recommendation_level(score['total_score'])
+                if spec.wants_option('approval_probability'):
+                    option['approval_probability'] = self._estimate_approval_probability(score['total_score'], score['missing'])
+                if spec.wants_option('required_documents'):
+                    option['required_documents'] = self._get_required_documents(visa)
+                results.append(option)
         
         # スコアでソート
         results.sort(key=lambda x: x['match_score'], reverse=True)
+        return results
+    
+    def _top_candidates(self, visas: List[CompiledVisa], profile: ApplicantProfile, limit: int,
+                        with_details: bool, with_missing: bool,
+                        evaluated: List[Optional[Dict[str, Any]]]) -> List[Tuple[CompiledVisa, Dict[str, Any]]]:
+        """
+        スコア上位limit件の在留資格（全件を計算してソートした場合と同じ順・同じ結果）
         
-        # AI機能による追加分析
-        ai_analysis = self._perform_ai_analysis(applicant_data, results)
+        要件から求めたスコアの上限（_score_upper_bound）が高い順に判定し、残りの候補の上限が
+        上位limit件の最下位（同点は候補の順で先のもの）に届かなくなった時点で打ち切る。
+        判定内容・不足要件は上位に残った候補だけ、判定済みの結果から作成する。
+        """
+        if limit <= 0:
+            return []
+        possible: List[Optional[bool]] = [None] * len(self.ruleset.predicates)  # 述語ごとに1回だけ評価する
+        bounds = [self._score_upper_bound(visa, profile, possible) for visa in visas]
+        top: List[Tuple[int, int]] = []  # (-スコア, 候補の順) の昇順 ＝ ソート後の順
+        checks: Dict[int, Optional[List[Dict[str, Any]]]] = {}
+        for index in sorted(range(len(visas)), key=lambda i: (-bounds[i], i)):
+            if len(top) >= limit and (-bounds[index], index) > top[limit - 1]:
+                break
+            score, checks[index] = self._match_points(visas[index], profile, evaluated)
+            if score > 0:
+                bisect.insort(top, (-score, index))
+                del top[limit:]
+        return [
+            (visas[index], self._calculate_match_score(visas[index], profile, with_details, with_missing, checks[index]))
+            for _, index in top
+        ]
+    
+    def _score_upper_bound(self, visa: CompiledVisa, profile: ApplicantProfile,
+                           possible: List[Optional[bool]]) -> int:
+        """適合度スコアの上限（充足し得ない要件だけを除いて計算。_calculate_match_score以上になる）"""
+        if not visa.requirements:
+            return 50
+        points = 0
+        for req, index in zip(visa.requirements, self.ruleset.incidence[visa.id]):
+            met = possible[index]
+            if met is None:
+                met = possible[index] = self._may_meet(req, profile)
+            if met:
+                points += req.weight
+        return int(points / visa.max_score * 100)
+    
+    def _may_meet(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> bool:
+        """要件を充足し得るか（述語の基準だけで判定し、_check_requirement で充足となる場合は必ず真）"""
+        kind, *args = requirement.predicate
+        if kind == 'education':
+            rank, relevant = args
+            by_degree = rank is not None and profile.degree_level != 'none' and profile.degree_rank >= rank
+            return by_degree or (relevant and bool(profile.major))
+        elif kind == 'experience':
+            return args[0] is not None and profile.total_years >= args[0]
+        elif kind == 'salary':
+            basis = args[0]
+            if basis == 'equivalent':
+                return profile.salary >= self.equivalent_salary(profile)[0]
+            elif basis == 'monthly':
+                return profile.salary >= args[1]
+            elif basis == 'annual':
+                return profile.salary * 12 >= args[1]
+            return True
+        elif kind == 'qualification':
+            held = profile.held
+            if args[0] == 'jlpt':
+                level, accepts_jft = args[1:]
+                return bool(held.jlpt_level and held.jlpt_level <= level) or bool(accepts_jft and held.jft_basic)
+            elif args[0] == 'skill_test':
+                return bool(held.skill_tests)
+            return bool(profile.qualifications)
+        elif kind == 'company':
+            return profile.has_company
+        elif kind == 'manual':
+            return False
+        return True  # 高度専門職ポイント（計算が重いため上限では充足とみなす）
+
+    def rescore(self, applicant_data: Dict[str, Any], previous_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        保存済みの診断結果を現在のルールセットで再計算
+
+        診断IDとAI分析結果は以前のものを引き継ぐ。
+        """
+        profile = ApplicantProfile.from_dict(applicant_data)
+        results = self._score_candidates(profile)
+        result = self._build_result(profile, results, previous_result.get('ai_analysis'))
+        if previous_result.get('diagnosis_id'):
+            result['diagnosis_id'] = previous_result['diagnosis_id']
+        return result
+
+    def _candidate_visas(self, profile: ApplicantProfile) -> List[CompiledVisa]:
+        """業種・職種から候補となる在留資格を抽出（該当なしの場合は全件）"""
+        initial_candidates = self._get_candidates_by_job(profile)
         
-        return {
-            'diagnosis_id': self._generate_diagnosis_id(),
-            'applicant_summary': self._create_applicant_summary(applicant_data),
-            'top_recommendations': results[:3],
-            'all_options': results,
-            'analysis_summary': self._generate_summary(results, applicant_data),
-            'next_steps': self._generate_next_steps(results),
-            'ai_analysis': ai_analysis,  # AI分析結果を追加
+        # 初期候補に含まれない場合はスキップ（効率化）
+        return [
+            visa for visa in self.ruleset.visas
+            if not initial_candidates or visa.id in initial_candidates
+        ]
+    
+    def _build_result(self, profile: ApplicantProfile, results: List[Dict], ai_analysis: Optional[Dict[str, Any]],
+                      spec: detail.ResultSpec = detail.FULL) -> Dict[str, Any]:
+        """診断結果の組み立て（specで要求された項目のみ計算）"""
+        options = results
+        if any(key not in spec.option_fields for key in (results[0] if results else ())):
+            options = [{k: v for k, v in option.items() if k in spec.option_fields} for option in results]
+        
+        builders = {
+            'diagnosis_id': self._generate_diagnosis_id,
+            'applicant_summary': lambda: self._create_applicant_summary(profile),
+            'top_recommendations': lambda: options[:detail.TOP_RECOMMENDATIONS],
+            'all_options': lambda: options,
+            'analysis_summary': lambda: self._generate_summary(results, profile),
+            'next_steps': lambda: self._generate_next_steps(results),
+            'improvement_paths': lambda: counterfactual.solve_all(
+                self, self._candidate_visas(profile), profile, self.IMPROVEMENT_TARGET_SCORE
+            ),
+            'ai_analysis': lambda: ai_analysis,  # AI分析結果を追加
         }
+        return {field: builders[field]() for field in detail.RESULT_FIELDS if spec.wants(field)}
     
-    def _get_candidates_by_job(self, job_details: Dict[str, Any]) -> List[int]:
+    def _get_candidates_by_job(self, profile: ApplicantProfile) -> List[int]:
         """業種・職種から候補となる在留資格を抽出"""
-        if not job_details:
+        if not profile.industry_key and not profile.position_key:
             return []
         
-        industry = job_details.get('industry', '')
-        position = job_details.get('position', '')
-        
-        if not industry and not position:
-            return []
-        
-        # マッピングテーブルから検索
-        mappings = IndustryVisaMapping.objects.filter(
-            industry__icontains=industry
-        ) | IndustryVisaMapping.objects.filter(
-            job_category__icontains=position
-        )
+        # マッピングテーブルから検索（正規化済みの業種・職種で部分一致）
+        return self.ruleset.candidates_by_job(profile.industry_key, profile.position_key)
+    
+    def _new_evaluation(self) -> List[Optional[Dict[str, Any]]]:
+        """申請者1人分の述語ごとの判定結果（未判定はNone）"""
+        return [None] * len(self.ruleset.predicates)
+    
+    def _check_visa(self, visa: CompiledVisa, profile: ApplicantProfile,
+                    evaluated: List[Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        在留資格の要件ごとの判定結果
         
-        return [m.visa_category_id for m in mappings.distinct()]
+        要件を述語（ruleset.compile_predicate）の番号に置き換え、未判定の述語だけを
+        代表の要件で判定してevaluatedに保持する。同じ申請者の他の在留資格は判定結果を共有する。
+        """
+        checks = []
+        for index in self.ruleset.incidence[visa.id]:
+            check = evaluated[index]
+            if check is None:
+                check = evaluated[index] = self._check_requirement(self.ruleset.predicates[index], profile)
+            checks.append(check)
+        return checks
+    
+    def _match_points(self, visa: CompiledVisa, profile: ApplicantProfile,
+                      evaluated: List[Optional[Dict[str, Any]]]) -> Tuple[int, Optional[List[Dict[str, Any]]]]:
+        """適合度スコアと要件ごとの判定結果（判定内容・不足要件は作らない。要件未設定の場合は判定結果なし）"""
+        if not visa.requirements:
+            return 50, None
+        checks = self._check_visa(visa, profile, evaluated)
+        score = sum(req.weight for req, check in zip(visa.requirements, checks) if check['met'])
+        return int(score / visa.max_score * 100), checks
     
-    def _calculate_match_score(self, visa: VisaCategory, applicant_data: Dict[str, Any]) -> Dict[str, Any]:
-        """各在留資格の適合度スコア計算"""
+    def _calculate_match_score(self, visa: CompiledVisa, profile: ApplicantProfile,
+                               with_details: bool = True, with_missing: bool = True,
+                               checks: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        各在留資格の適合度スコア計算（with_details・with_missingがFalseの場合は判定内容・不足要件を作らない）
+        
+        checksに判定結果（_check_visa）を渡すと要件を判定し直さない。
+        """
         score = 0
         max_score = 0
         details = []
         missing = []
         
-        requirements = visa.requirements.all()
+        requirements = visa.requirements
         
-        if not requirements.exists():
+        if not requirements:
             # 要件が設定されていない場合は中程度のスコア
             return {
                 'total_score': 50,
@@ -126,29 +342,31 @@ class VisaDiagnosisEngine:
                 'missing': ['要件情報の確認が必要']
             }
         
-        for req in requirements:
-            weight = 20 if req.is_mandatory else 10
+        for i, req in enumerate(requirements):
+            weight = req.weight
             max_score += weight
             
-            check_result = self._check_requirement(req, applicant_data)
+            check_result = checks[i] if checks is not None else self._check_requirement(req, profile)
             
             if check_result['met']:
                 score += weight
-                details.append({
-                    'requirement': req.condition,
-                    'status': '✓ 充足',
-                    'type': req.get_requirement_type_display(),
-                    'detail': check_result.get('reason', '')
-                })
+                if with_details:
+                    details.append({
+                        'requirement': req.condition,
+                        'status': '✓ 充足',
+                        'type': req.get_requirement_type_display(),
+                        'detail': check_result.get('reason', '')
+                    })
             else:
-                status = '✗ 不足' if req.is_mandatory else '△ 推奨'
-                details.append({
-                    'requirement': req.condition,
-                    'status': status,
-                    'type': req.get_requirement_type_display(),
-                    'detail': check_result.get('reason', '')
-                })
-                if req.is_mandatory:
+                if with_details:
+                    status = '✗ 不足' if req.is_mandatory else '△ 推奨'
+                    details.append({
+                        'requirement': req.condition,
+                        'status': status,
+                        'type': req.get_requirement_type_display(),
+                        'detail': check_result.get('reason', '')
+                    })
+                if req.is_mandatory and with_missing:
                     missing.append({
                         'requirement': req.condition,
                         'alternative': req.alternative_condition if req.alternative_ok else None
@@ -160,42 +378,46 @@ class VisaDiagnosisEngine:
             'missing': missing
         }
     
-    def _check_requirement(self, requirement: VisaRequirement, applicant_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _check_requirement(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> Dict[str, Any]:
         """個別要件のチェック"""
         req_type = requirement.requirement_type
         
         if req_type == 'education':
-            return self._check_education(requirement, applicant_data.get('education', {}))
+            return self._check_education(requirement, profile)
         elif req_type == 'experience':
-            return self._check_experience(requirement, applicant_data.get('experience', []))
+            return self._check_experience(requirement, profile.total_years)
         elif req_type == 'salary':
-            return self._check_salary(requirement, applicant_data.get('salary', 0))
+            return self._check_salary(requirement, profile)
         elif req_type == 'qualification':
-            return self._check_qualifications(requirement, applicant_data.get('qualifications', []))
+            return self._check_qualifications(requirement, profile)
         elif req_type == 'company':
-            return self._check_company(requirement, applicant_data.get('company_info', {}))
+            return self._check_company(requirement, profile)
+        elif 'ポイント' in requirement.condition:
+            return self._check_hsp_points(requirement, profile)
         else:
             return {'met': None, 'reason': '手動確認が必要'}
     
-    def _check_education(self, requirement: VisaRequirement, education_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _check_education(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> Dict[str, Any]:
         """学歴要件チェック（AI統合版）"""
-        condition = requirement.condition.lower()
-        degree = education_data.get('degree', '').lower()
-        major = education_data.get('major', '')
-        
-        # 大学卒業以上
-        if '大学' in condition or '学士' in condition:
-            valid_degrees = ['学士', '修士', '博士', 'bachelor', 'master', 'phd', 'doctor']
-            if any(d in degree for d in valid_degrees):
-                return {'met': True, 'reason': f'学歴: {education_data.get("degree", "")}'}
-        
-        # 専門学校
-        if '専門学校' in condition:
-            if '専門' in degree or 'diploma' in degree or '専修' in degree:
-                return {'met': True, 'reason': f'学歴: {education_data.get("degree", "")}'}
-        
-        # 関連専攻（AI機能があれば使用）
+        condition = requirement.condition
+        terms = vocabulary.parse_condition(condition)
+        major = profile.major
+        
+        # 学位（大学卒業以上・専門学校卒業・修士以上など）
+        if terms.degree and profile.degree_level != 'none' and \
+                profile.degree_rank >= vocabulary.degree_rank(terms.degree):
+            return {'met': True, 'reason': f'学歴: {profile.degree}'}
+        
+        # 関連専攻（職種との関連性をオフラインで判定し、確信度が低ければAI機能に委ねる）
         if '関連' in condition or '専攻' in condition:
+            position = profile.position
+            if major and position:
+                prediction = self.relevance_model.predict(major, position)
+                if self.relevance_model.is_confident(prediction):
+                    return {
+                        'met': prediction['score'] >= self.MAJOR_RELEVANCE_PASS,
+                        'reason': f'専攻: {major}（職種との関連性: {prediction["level"]}、{prediction["score"]}点）'
+                    }
             if major:
                 # AI機能が有効な場合は詳細分析
                 if self.ai_analyzer and self.ai_analyzer.is_available():
@@ -204,11 +426,10 @@ class VisaDiagnosisEngine:
                 else:
                     return {'met': True, 'reason': f'専攻: {major}（関連性は要確認）'}
         
-        return {'met': False, 'reason': f'現在の学歴: {education_data.get("degree", "未記入")}'}
+        return {'met': False, 'reason': f'現在の学歴: {profile.degree or "未記入"}'}
     
-    def _check_experience(self, requirement: VisaRequirement, experience_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _check_experience(self, requirement: CompiledRequirement, total_years: int) -> Dict[str, Any]:
         """実務経験要件チェック"""
-        total_years = sum([exp.get('years', 0) for exp in experience_data])
         condition = requirement.condition
         
         # 正規表現で年数を抽出
@@ -222,23 +443,46 @@ class VisaDiagnosisEngine:
         
         return {'met': None, 'reason': '実務経験の確認が必要'}
     
-    def _check_salary(self, requirement: VisaRequirement, salary: int) -> Dict[str, Any]:
+    def equivalent_salary(self, profile: ApplicantProfile) -> Tuple[int, str]:
+        """
+        「日本人と同等以上」の基準額（月額）
+
+        業種・職種・勤務地・経験年数に該当する賃金の参照値（settings.WAGE_REFERENCE_PERCENTILE）。
+        参照値がなければ最低基準（EQUIVALENT_SALARY_FLOOR）。
+
+        Returns:
+            (基準額, 判定理由に表示する根拠)
+        """
+        percentile = settings.WAGE_REFERENCE_PERCENTILE
+        match = self.ruleset.wages.lookup(
+            profile.wage_industry_key, profile.position_key, profile.prefecture_key, profile.total_years, percentile,
+        )
+        if match is None:
+            return self.EQUIVALENT_SALARY_FLOOR, '最低基準'
+        return match.amount, f'{match.label}の{wages.PERCENTILE_LABELS[percentile]}'
+
+    def _check_salary(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> Dict[str, Any]:
         """報酬要件チェック"""
         condition = requirement.condition
+        salary = profile.salary
         
         # 日本人と同等以上
-        if '日本人と同等' in condition or '同等以上' in condition:
-            # 業種・職種別の最低ラインを設定（簡易版）
-            min_salary = 220000  # 最低基準
+        if wages.is_equivalent_condition(condition):
+            min_salary, basis = self.equivalent_salary(profile)
             if salary >= min_salary:
-                return {'met': True, 'reason': f'月額報酬: ¥{salary:,}'}
+                return {'met': True, 'reason': f'月額報酬: ¥{salary:,}（{basis} ¥{min_salary:,}以上）'}
             else:
-                return {'met': False, 'reason': f'月額報酬: ¥{salary:,}（低い可能性あり）'}
+                return {'met': False, 'reason': f'月額報酬: ¥{salary:,}（{basis} ¥{min_salary:,}を下回る）'}
         
-        # 金額指定がある場合
+        # 金額指定がある場合（「年収」の場合は月額報酬の12か月分と比較）
         amount_match = re.search(r'(\d+)万円', condition)
         if amount_match:
             required_amount = int(amount_match.group(1)) * 10000
+            if '年収' in condition:
+                annual = salary * 12
+                if annual >= required_amount:
+                    return {'met': True, 'reason': f'年収（月額×12）: ¥{annual:,}'}
+                return {'met': False, 'reason': f'年収（月額×12）: ¥{annual:,}（¥{required_amount:,}必要）'}
             if salary >= required_amount:
                 return {'met': True, 'reason': f'月額報酬: ¥{salary:,}'}
             else:
@@ -246,36 +490,48 @@ class VisaDiagnosisEngine:
         
         return {'met': True, 'reason': '報酬要件の詳細確認が必要'}
     
-    def _check_qualifications(self, requirement: VisaRequirement, qualifications: List[str]) -> Dict[str, Any]:
+    def _check_qualifications(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> Dict[str, Any]:
         """資格要件チェック"""
-        condition = requirement.condition
+        terms = vocabulary.parse_condition(requirement.condition)
+        held = profile.held
         
-        # 日本語能力試験
-        if 'N4' in condition or 'JLPT' in condition:
-            jlpt_found = any('N4' in q or 'N3' in q or 'N2' in q or 'N1' in q for q in qualifications)
-            if jlpt_found:
-                return {'met': True, 'reason': f'保有資格に日本語能力試験あり'}
-            else:
-                return {'met': False, 'reason': '日本語能力試験N4以上が必要'}
+        # 日本語能力試験（日本語基礎テストでも可とする要件あり）
+        if terms.jlpt_level:
+            if held.jlpt_level and held.jlpt_level <= terms.jlpt_level:
+                return {'met': True, 'reason': f'保有資格に日本語能力試験{held.jlpt_label}あり'}
+            if terms.accepts_jft and held.jft_basic:
+                return {'met': True, 'reason': '国際交流基金日本語基礎テスト合格'}
+            return {'met': False, 'reason': f'日本語能力試験N{terms.jlpt_level}以上が必要'}
         
         # 特定技能評価試験
-        if '特定技能' in condition and '評価試験' in condition:
-            tokutei_found = any('特定技能' in q or '評価試験' in q for q in qualifications)
-            if tokutei_found:
+        if terms.skill_test:
+            if held.skill_tests:
                 return {'met': True, 'reason': '特定技能評価試験合格'}
             else:
                 return {'met': False, 'reason': '特定技能評価試験の合格が必要'}
         
         # その他の資格
-        if qualifications:
+        if profile.qualifications:
             return {'met': True, 'reason': f'保有資格あり（要確認）'}
         
         return {'met': False, 'reason': '必要資格なし'}
     
-    def _check_company(self, requirement: VisaRequirement, company_info: Dict[str, Any]) -> Dict[str, Any]:
+    def _check_hsp_points(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> Dict[str, Any]:
+        """高度専門職ポイント要件チェック"""
+        result = hsp_points.score_profile(profile)
+        b = result['breakdown']
+        reason = (
+            f"ポイント合計: {result['total']}点（学歴{b['academic']}・職歴{b['career']}・"
+            f"年収{b['salary']}・年齢{b['age']}・加算{b['bonus']}）"
+        )
+        if result['notes']:
+            reason += ' ※' + '、'.join(result['notes'])
+        return {'met': result['eligible'], 'reason': reason}
+    
+    def _check_company(self, requirement: CompiledRequirement, profile: ApplicantProfile) -> Dict[str, Any]:
         """企業要件チェック"""
         # 簡易版：企業情報があればOK
-        if company_info:
+        if profile.has_company:
             return {'met': True, 'reason': '企業情報確認済み'}
         return {'met': None, 'reason': '企業情報の確認が必要'}
     
@@ -304,32 +560,20 @@ class VisaDiagnosisEngine:
         else:
             return '要検討（50%未満）'
     
-    def _get_required_documents(self, visa: VisaCategory) -> List[Dict[str, str]]:
+    def _get_required_documents(self, visa: CompiledVisa) -> List[Dict[str, str]]:
         """必要書類リストの取得"""
-        documents = visa.documents.filter(is_mandatory=True).order_by('display_order')
-        return [
-            {
-                'name': doc.document_name,
-                'description': doc.description,
-                'url': doc.url
-            }
-            for doc in documents
-        ]
+        return visa.mandatory_documents
     
-    def _create_applicant_summary(self, applicant_data: Dict[str, Any]) -> Dict[str, str]:
+    def _create_applicant_summary(self, profile: ApplicantProfile) -> Dict[str, str]:
         """申請者サマリーの作成"""
-        education = applicant_data.get('education', {})
-        experience = applicant_data.get('experience', [])
-        job_details = applicant_data.get('job_details', {})
-        
         return {
-            'nationality': applicant_data.get('nationality', '未記入'),
-            'education': f"{education.get('degree', '')}（{education.get('major', '')}専攻）" if education else '未記入',
-            'experience_years': sum([exp.get('years', 0) for exp in experience]),
-            'target_job': f"{job_details.get('industry', '')} - {job_details.get('position', '')}" if job_details else '未記入',
+            'nationality': profile.nationality or '未記入',
+            'education': f"{profile.degree}（{profile.major}専攻）" if profile.has_education else '未記入',
+            'experience_years': profile.total_years,
+            'target_job': f"{profile.industry} - {profile.position}" if profile.has_job_details else '未記入',
         }
     
-    def _generate_summary(self, results: List[Dict], applicant_data: Dict[str, Any]) -> str:
+    def _generate_summary(self, results: List[Dict], profile: ApplicantProfile) -> str:
         """診断サマリーの生成"""
         if not results:
             return '申請者の情報では、該当する在留資格が見つかりませんでした。詳細をご確認ください。'
@@ -356,9 +600,12 @@ class VisaDiagnosisEngine:
         top = results[0]
         steps = []
         
-        # 書類準備
-        if top['required_documents']:
-            steps.append(f"必要書類の準備（{len(top['required_documents'])}種類）")
+        # 書類準備（必要書類を返さない場合はルールセットから件数を取得）
+        documents = top.get('required_documents')
+        if documents is None:
+            documents = self.ruleset.by_code[top['visa_category']['code']].mandatory_documents
+        if documents:
+            steps.append(f"必要書類の準備（{len(documents)}種類）")
         
         # 不足要件への対応
         if top['missing_items']:
@@ -374,64 +621,141 @@ class VisaDiagnosisEngine:
         return steps
     
     def _generate_diagnosis_id(self) -> str:
-        """診断IDの生成"""
-        from datetime import datetime
-        import random
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        random_suffix = random.randint(1000, 9999)
-        return f"DIAG-{timestamp}-{random_suffix}"
-    
-    def _perform_ai_analysis(self, applicant_data: Dict[str, Any], results: List[Dict]) -> Dict[str, Any]:
-        """AI機能による追加分析"""
+        """診断IDの生成（時刻順のUUIDv7形式、セッションIDとしても使用）"""
+        return identifiers.new_id()
+    
+    def _perform_ai_analysis(self, profile: ApplicantProfile, results: List[Dict]) -> Dict[str, Any]:
+        """AI機能による追加分析（API呼び出しのトークン数をusageに記録）"""
         if not self.ai_analyzer or not self.ai_analyzer.is_available():
             return {
                 'enabled': False,
                 'message': 'AI機能は現在無効です。settings.pyでANTHROPIC_API_KEYを設定してください。'
             }
         
-        try:
-            education = applicant_data.get('education', {})
-            job_details = applicant_data.get('job_details', {})
-            
-            major = education.get('major', '')
-            position = job_details.get('position', '')
-            duties = job_details.get('duties', '')
-            
-            analysis = {
-                'enabled': True,
-                'major_relevance': None,
-                'job_suitability': None,
-                'improvement_suggestions': None
-            }
-            
-            # 専攻と職種の関連性分析
-            if major and position:
-                analysis['major_relevance'] = self.ai_analyzer.analyze_major_relevance(
-                    major, position, duties
-                )
-            
-            # 業務内容の分析
-            if duties and results:
-                top_visa = results[0]['visa_category']['name_ja']
-                analysis['job_suitability'] = self.ai_analyzer.analyze_job_description(
-                    duties, top_visa
-                )
-            
-            # 改善提案の生成
-            if results:
-                diagnosis_result = {
-                    'top_recommendations': results[:3]
+        with ai_integration.track_usage() as usage:
+            try:
+                major = profile.major
+                position = profile.position
+                duties = profile.duties
+                
+                analysis = {
+                    'enabled': True,
+                    'major_relevance': None,
+                    'job_suitability': None,
+                    'improvement_suggestions': None
                 }
-                analysis['improvement_suggestions'] = self.ai_analyzer.generate_improvement_suggestions(
-                    applicant_data, diagnosis_result
-                )
-            
-            return analysis
-            
-        except Exception as e:
-            print(f"AI分析エラー: {e}")
+                
+                # 専攻と職種の関連性分析（オフライン判定の確信度が低い場合のみAPIを使用）
+                ask_relevance = False
+                if major and position:
+                    prediction = self.relevance_model.predict(major, position)
+                    if self.relevance_model.is_confident(prediction):
+                        analysis['major_relevance'] = prediction
+                    else:
+                        ask_relevance = True
+                
+                if settings.AI_COMBINED_ANALYSIS:
+                    # 関連性・業務内容・改善提案を1回のAPI呼び出しで分析
+                    combined = self.ai_analyzer.analyze_combined(
+                        profile, {'top_recommendations': results[:detail.TOP_RECOMMENDATIONS]}, ask_relevance
+                    )
+                    analysis.update({key: value for key, value in combined.items() if value is not None})
+                else:
+                    if ask_relevance:
+                        analysis['major_relevance'] = self.ai_analyzer.analyze_major_relevance(
+                            major, position, duties
+                        )
+                    
+                    # 業務内容の分析
+                    if duties and results:
+                        top_visa = results[0]['visa_category']['name_ja']
+                        analysis['job_suitability'] = self.ai_analyzer.analyze_job_description(
+                            duties, top_visa
+                        )
+                    
+                    # 改善提案の生成
+                    if results:
+                        diagnosis_result = {
+                            'top_recommendations': results[:detail.TOP_RECOMMENDATIONS]
+                        }
+                        analysis['improvement_suggestions'] = self.ai_analyzer.generate_improvement_suggestions(
+                            profile, diagnosis_result
+                        )
+                
+            except Exception as e:
+                print(f"AI分析エラー: {e}")
+                analysis = {
+                    'enabled': True,
+                    'error': str(e),
+                    'message': 'AI分析中にエラーが発生しました'
+                }
+        analysis['usage'] = usage.as_dict()
+        return analysis
+    
+    async def _aperform_ai_analysis(self, profile: ApplicantProfile, results: List[Dict]) -> Dict[str, Any]:
+        """AI機能による追加分析（非同期版：3種類の分析を並行して待機、または一括分析）"""
+        if not self.ai_analyzer or not self.ai_analyzer.is_available():
             return {
-                'enabled': True,
-                'error': str(e),
-                'message': 'AI分析中にエラーが発生しました'
+                'enabled': False,
+                'message': 'AI機能は現在無効です。settings.pyでANTHROPIC_API_KEYを設定してください。'
             }
+        
+        with ai_integration.track_usage() as usage:
+            try:
+                major = profile.major
+                position = profile.position
+                duties = profile.duties
+                
+                tasks = {}
+                local = {}
+                
+                # 専攻と職種の関連性分析（オフライン判定の確信度が低い場合のみAPIを使用）
+                ask_relevance = False
+                if major and position:
+                    prediction = self.relevance_model.predict(major, position)
+                    if self.relevance_model.is_confident(prediction):
+                        local['major_relevance'] = prediction
+                    else:
+                        ask_relevance = True
+                
+                top_recommendations = results[:detail.TOP_RECOMMENDATIONS]
+                if settings.AI_COMBINED_ANALYSIS:
+                    # 関連性・業務内容・改善提案を1回のAPI呼び出しで分析
+                    combined = await self.ai_analyzer.aanalyze_combined(
+                        profile, {'top_recommendations': top_recommendations}, ask_relevance
+                    )
+                    outcomes = {key: value for key, value in combined.items() if value is not None}
+                    outcomes.update(local)
+                else:
+                    if ask_relevance:
+                        tasks['major_relevance'] = self.ai_analyzer.aanalyze_major_relevance(major, position, duties)
+                    
+                    # 業務内容の分析
+                    if duties and results:
+                        top_visa = results[0]['visa_category']['name_ja']
+                        tasks['job_suitability'] = self.ai_analyzer.aanalyze_job_description(duties, top_visa)
+                    
+                    # 改善提案の生成
+                    if results:
+                        tasks['improvement_suggestions'] = self.ai_analyzer.agenerate_improvement_suggestions(
+                            profile, {'top_recommendations': top_recommendations}
+                        )
+                    
+                    outcomes = dict(zip(tasks, await asyncio.gather(*tasks.values())), **local)
+                
+                analysis = {
+                    'enabled': True,
+                    'major_relevance': outcomes.get('major_relevance'),
+                    'job_suitability': outcomes.get('job_suitability'),
+                    'improvement_suggestions': outcomes.get('improvement_suggestions')
+                }
+                
+            except Exception as e:
+                print(f"AI分析エラー: {e}")
+                analysis = {
+                    'enabled': True,
+                    'error': str(e),
+                    'message': 'AI分析中にエラーが発生しました'
+                }
+        analysis['usage'] = usage.as_dict()
+        return analysis
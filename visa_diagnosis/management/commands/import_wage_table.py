@@ -0,0 +1,88 @@
+"""
+賃金の参照値の取り込み
+python manage.py import_wage_table wages.csv [--unit thousand] [--encoding cp932] [--replace] [--source "令和6年賃金構造基本統計調査"]
+
+業種・職種・都道府県・経験年数帯ごとの賃金の分布（第1十分位〜第9十分位）をCSVから取り込む。
+列名は英語（industry, occupation, prefecture, experience_years_min, p10, p25, p50, p75, p90）
+または統計表の見出し（業種・職種・都道府県・経験年数・第1四分位・中央値など）。
+同じ区分の行は上書きし、--replace を指定すると既存の行をすべて置き換える。
+10万行規模を想定し、モデルのインスタンスを作らずにexecutemanyで1トランザクションに
+一括挿入（バックエンドのON CONFLICT相当の構文で上書き）し、完了後にルールセットを再構築させる。
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+
+from visa_diagnosis import wages
+from visa_diagnosis.models import WageReference
+from visa_diagnosis.ruleset import invalidate_ruleset
+
+UNITS = {'yen': 1, 'thousand': 1000}
+KEY_FIELDS = list(wages.FIELDS[:4])
+
+
+class Command(BaseCommand):
+    help = '賃金の参照値（業種×職種×都道府県×経験年数帯）をCSVから取り込みます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSVファイルのパス')
+        parser.add_argument('--unit', choices=UNITS, default='yen', help='金額の単位（統計表の「千円」は thousand）')
+        parser.add_argument('--encoding', default='utf-8-sig', help='CSVの文字コード（e-Statの表は cp932 が多い）')
+        parser.add_argument('--source', default='', help='出典（管理画面に表示）')
+        parser.add_argument('--replace', action='store_true', help='既存の参照値をすべて削除してから取り込む')
+        parser.add_argument('--batch-size', type=int, default=2000, help='一括挿入の1回あたりの行数')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['path'], encoding=options['encoding'], newline='') as f:
+                # 同じ区分の行は後の行で上書き
+                rows = {row[:4]: row for row in wages.read_csv(f, UNITS[options['unit']])}
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            raise CommandError(f'CSVを読み込めませんでした: {e}')
+        if not rows:
+            raise CommandError('取り込む行がありません')
+        parsed = time.perf_counter()
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if options['replace']:
+                    # QuerySet.delete()は行ごとにシグナルを送るため、一括で削除する
+                    cursor.execute(f'DELETE FROM {self._table()}')
+                sql = self._insert_sql(upsert=not options['replace'])
+                source = options['source']
+                values = [(*row, source) for row in rows.values()]
+                for i in range(0, len(values), options['batch_size']):
+                    cursor.executemany(sql, values[i:i + options['batch_size']])
+        invalidate_ruleset()
+        saved = time.perf_counter()
+
+        self.stdout.write(
+            f'読み込み {len(rows):,}行: {(parsed - started) * 1000:.0f}ms、'
+            f'保存: {(saved - parsed) * 1000:.0f}ms'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'賃金の参照値を{"置き換え" if options["replace"] else "取り込み"}ました'
+            f'（{WageReference.objects.count():,}行）'
+        ))
+
+    @staticmethod
+    def _table() -> str:
+        return connection.ops.quote_name(WageReference._meta.db_table)
+
+    def _insert_sql(self, upsert: bool) -> str:
+        columns = [*wages.FIELDS, 'source']
+        sql = (
+            f'INSERT INTO {self._table()} ({", ".join(map(connection.ops.quote_name, columns))}) '
+            f'VALUES ({", ".join(["%s"] * len(columns))})'
+        )
+        if upsert:
+            sql += ' ' + connection.ops.on_conflict_suffix_sql(
+                [WageReference._meta.get_field(name) for name in columns],
+                OnConflict.UPDATE,
+                [*wages.PERCENTILES, 'source'],
+                KEY_FIELDS,
+            )
+        return sql
@@ -0,0 +1,128 @@
+"""
+起動時のモジュール読み込み時間のレポート
+python manage.py importtime [--top 20] [--forbid anthropic] [--budget-ms 800] [--json]
+
+別プロセスで `python -X importtime` によりWSGIアプリケーション（settings.WSGI_APPLICATION）と
+URLconfを読み込み、サーバーの起動から最初のリクエストまでに読み込まれるモジュールの
+所要時間を集計する。ウォームアップのスレッドは止めて計測する。
+--forbid のモジュールが起動時に読み込まれた場合や、合計が --budget-ms を超えた場合は
+エラー終了するため、CIで遅延読み込みの退行を検出できる。
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$')
+
+_SCRIPT = '''
+import importlib
+module = importlib.import_module({module!r})
+getattr(module, {attr!r})
+from django.urls import get_resolver
+get_resolver().url_patterns
+'''
+
+
+def _parse(stderr: str) -> List[Dict[str, Any]]:
+    """-X importtime の出力（self・cumulativeはマイクロ秒）"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            entries.append({
+                'module': match.group(4),
+                'self_ms': int(match.group(1)) / 1000,
+                'cumulative_ms': int(match.group(2)) / 1000,
+                'depth': len(match.group(3)) // 2,
+            })
+    return entries
+
+
+class Command(BaseCommand):
+    help = 'サーバー起動時のモジュール読み込み時間を集計します（-X importtime）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='表示する上位のモジュール数')
+        parser.add_argument('--repeat', type=int, default=3, help='計測回数（合計が最小の回を採用）')
+        parser.add_argument('--forbid', default='anthropic',
+                            help='起動時に読み込まれてはならないパッケージ（カンマ区切り、空文字で無効）')
+        parser.add_argument('--budget-ms', type=float, default=0, help='読み込み時間の合計の上限（0は無制限）')
+        parser.add_argument('--json', action='store_true', help='JSONで出力')
+
+    def handle(self, *args, **options):
+        module, _, attr = settings.WSGI_APPLICATION.rpartition('.')
+        env = dict(os.environ, WARMUP_ON_START='False', PYTHONDONTWRITEBYTECODE='1')
+        env.setdefault('DJANGO_SETTINGS_MODULE', os.environ.get('DJANGO_SETTINGS_MODULE', 'visa_system.settings'))
+
+        best = None
+        for _ in range(max(1, options['repeat'])):
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', _SCRIPT.format(module=module, attr=attr)],
+                env=env, capture_output=True, text=True, cwd=settings.BASE_DIR,
+            )
+            if process.returncode != 0:
+                raise CommandError(f'読み込みに失敗しました:\n{process.stderr[-2000:]}')
+            entries = _parse(process.stderr)
+            total = sum(e['cumulative_ms'] for e in entries if e['depth'] == 0)
+            if best is None or total < best[0]:
+                best = (total, entries)
+
+        total, entries = best
+        report = self._report(total, entries, options['top'])
+        forbidden = [name.strip() for name in options['forbid'].split(',') if name.strip()]
+        report['forbidden_imported'] = sorted(
+            name for name in forbidden if name in report['packages']
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            self._write_text(report)
+
+        if report['forbidden_imported']:
+            raise CommandError(f'起動時に読み込まれています: {", ".join(report["forbidden_imported"])}')
+        if options['budget_ms'] and total > options['budget_ms']:
+            raise CommandError(f'読み込み時間の合計 {total:.1f}ms が上限 {options["budget_ms"]}ms を超えています')
+
+    @staticmethod
+    def _report(total: float, entries: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+        packages: Dict[str, float] = defaultdict(float)
+        for entry in entries:
+            packages[entry['module'].split('.')[0]] += entry['self_ms']
+
+        def rows(key: str) -> List[Dict[str, Any]]:
+            ranked = sorted(entries, key=lambda e: e[key], reverse=True)[:top]
+            return [
+                {'module': e['module'], 'self_ms': round(e['self_ms'], 1), 'cumulative_ms': round(e['cumulative_ms'], 1)}
+                for e in ranked
+            ]
+
+        return {
+            'entry': settings.WSGI_APPLICATION,
+            'total_ms': round(total, 1),
+            'modules': len(entries),
+            'packages': {
+                name: round(ms, 1) for name, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)
+            },
+            'top_cumulative': rows('cumulative_ms'),
+            'top_self': rows('self_ms'),
+        }
+
+    def _write_text(self, report: Dict[str, Any]):
+        self.stdout.write(f'{report["entry"]}: 合計 {report["total_ms"]}ms（{report["modules"]}モジュール）')
+        self.stdout.write('\nパッケージ別（self合計）:')
+        for name, ms in list(report['packages'].items())[:15]:
+            self.stdout.write(f'  {ms:9.1f}ms  {name}')
+        self.stdout.write('\n累積時間の上位:')
+        for row in report['top_cumulative']:
+            self.stdout.write(f'  {row["cumulative_ms"]:9.1f}ms  {row["module"]}')
+        self.stdout.write('\n単体時間の上位:')
+        for row in report['top_self']:
+            self.stdout.write(f'  {row["self_ms"]:9.1f}ms  {row["module"]}')
@@ -0,0 +1,181 @@
+"""
+稼働中のサーバーへの負荷試験
+python manage.py loadtest --url http://127.0.0.1:8000 --mode closed --concurrency 1,2,4,8,16 --duration 30
+python manage.py loadtest --mode open --rate 5,10,20,40 --mix diagnose=6,submit=1,visa_list=3 --output report.json
+
+/diagnose/・/submit-diagnosis/・/visa-list/ に合成または記録済みの申請者情報を送り、
+ステージ（同時実行数または到着率）ごとにスループット・エラー率・遅延のヒストグラムと
+時間推移をJSONで出力する。ステージを段階的に上げ、SLOを満たす最大のスループット
+（飽和点）をワーカー構成ごとに比較するためのもの。
+
+対象サーバーはレート制限を無効（RATE_LIMIT_ENABLED=False）にして起動すること
+（有効な場合、429は throttled として別に数える）。診断セッションが保存されるため、
+使い捨てのDBを使う環境で実行する。
+"""
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from visa_diagnosis import loadtest
+from visa_diagnosis.models import DiagnosisSession
+
+
+def _levels(value: str, cast) -> List[Any]:
+    try:
+        levels = [cast(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise CommandError(f'数値のカンマ区切りで指定してください: {value}')
+    if not levels or any(level <= 0 for level in levels):
+        raise CommandError(f'正の数を指定してください: {value}')
+    return levels
+
+
+def _mix(value: str) -> Tuple[Tuple[str, float], ...]:
+    mix = []
+    for item in value.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in loadtest.ENDPOINTS:
+            raise CommandError(f'--mix のエンドポイントは {", ".join(loadtest.ENDPOINTS)} のいずれかです: {name}')
+        try:
+            mix.append((name, float(weight or 1)))
+        except ValueError:
+            raise CommandError(f'--mix の重みが数値ではありません: {item}')
+    if not any(weight > 0 for _, weight in mix):
+        raise CommandError('--mix の重みの合計が0です')
+    return tuple(mix)
+
+
+class Command(BaseCommand):
+    help = '稼働中のサーバーに負荷をかけ、スループット・エラー率・遅延をJSONで出力します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='対象サーバーのURL')
+        parser.add_argument('--mode', choices=loadtest.MODES, default='closed',
+                            help='closed: 同時実行数を固定 / open: 到着率を固定')
+        parser.add_argument('--concurrency', default='10',
+                            help='クローズドモデルの仮想クライアント数（カンマ区切りで段階的に実行）')
+        parser.add_argument('--rate', default='10',
+                            help='オープンモデルの到着率（リクエスト/秒、カンマ区切りで段階的に実行）')
+        parser.add_argument('--arrival', choices=loadtest.ARRIVALS, default='poisson', help='オープンモデルの到着間隔')
+        parser.add_argument('--connections', type=int, default=100, help='オープンモデルの最大接続数')
+        parser.add_argument('--duration', type=float, default=30.0, help='ステージごとの計測時間（秒）')
+        parser.add_argument('--warmup', type=float, default=5.0, help='ステージごとのウォームアップ時間（秒、集計しない）')
+        parser.add_argument('--interval', type=float, default=1.0, help='時間推移の区間（秒）')
+        parser.add_argument('--think-time', type=float, default=0.0, help='クローズドモデルの応答後の待ち時間（秒）')
+        parser.add_argument('--mix', default='diagnose=6,submit=1,visa_list=3', help='エンドポイントの比率')
+        parser.add_argument('--diagnose-query', default='', help='/diagnose/ のクエリ文字列（例: detail=standard）')
+        parser.add_argument('--payloads', help='記録済みの申請者情報（1行1件のJSONL）')
+        parser.add_argument('--from-sessions', type=int, default=0,
+                            help='ローカルDBの診断セッションから申請者情報をN件読み込む')
+        parser.add_argument('--timeout', type=float, default=30.0, help='リクエストのタイムアウト（秒）')
+        parser.add_argument('--seed', type=int, default=1, help='乱数の種（到着間隔・申請者情報の選択）')
+        parser.add_argument('--slo-p99', type=float, default=1000.0, help='飽和点の判定に使うp99遅延の上限（ミリ秒）')
+        parser.add_argument('--max-error-rate', type=float, default=0.01, help='飽和点の判定に使うエラー率の上限')
+        parser.add_argument('--output', help='レポートの出力先（省略時は標準出力）')
+
+    def handle(self, *args, **options):
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError('httpxパッケージがインストールされていません（pip install httpx）')
+
+        mode = options['mode']
+        if mode == 'closed':
+            levels = _levels(options['concurrency'], int)
+        else:
+            levels = _levels(options['rate'], float)
+        if options['duration'] <= 0 or options['interval'] <= 0 or options['warmup'] < 0:
+            raise CommandError('--duration・--interval は正の数、--warmup は0以上を指定してください')
+
+        payloads = self._load_payloads(options)
+        config = loadtest.LoadConfig(
+            mode=mode,
+            paths={
+                'diagnose': reverse('visa_diagnosis:diagnose'),
+                'submit': reverse('visa_diagnosis:submit_diagnosis'),
+                'visa_list': reverse('visa_diagnosis:visa_list'),
+            },
+            mix=_mix(options['mix']),
+            payloads=payloads,
+            diagnose_query=options['diagnose_query'],
+            duration=options['duration'],
+            warmup=options['warmup'],
+            interval=options['interval'],
+            think_time=options['think_time'],
+            arrival=options['arrival'],
+            connections=options['connections'],
+        )
+
+        self.stderr.write(
+            f'{options["url"]} に負荷をかけます（{mode}、ステージ: {", ".join(map(str, levels))}、'
+            f'申請者情報: {f"{len(payloads)}件" if payloads else "合成"}）'
+        )
+        started = time.time()
+        stages = asyncio.run(self._run(httpx, options, config, levels))
+        report = {
+            'config': {
+                'url': options['url'],
+                'mode': mode,
+                'levels': levels,
+                'arrival': options['arrival'] if mode == 'open' else None,
+                'duration_s': options['duration'],
+                'warmup_s': options['warmup'],
+                'interval_s': options['interval'],
+                'think_time_s': options['think_time'],
+                'mix': dict(config.mix),
+                'diagnose_query': options['diagnose_query'],
+                'payloads': len(payloads) or 'synthetic',
+                'seed': options['seed'],
+                'started_at': started,
+            },
+            'stages': stages,
+            'saturation': loadtest.best_stage(stages, options['slo_p99'], options['max_error_rate']),
+        }
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stderr.write(f'レポートを {options["output"]} に保存しました')
+        else:
+            self.stdout.write(output)
+
+    async def _run(self, httpx, options: Dict[str, Any], config: loadtest.LoadConfig, levels: List[Any]):
+        rng = random.Random(options['seed'])
+        connections = max(levels) if config.mode == 'closed' else config.connections
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        stages = []
+        async with httpx.AsyncClient(base_url=options['url'], timeout=options['timeout'], limits=limits) as client:
+            for level in levels:
+                if config.mode == 'closed':
+                    stats = await loadtest.run_closed(client, config, level, rng)
+                else:
+                    stats = await loadtest.run_open(client, config, level, rng)
+                stage = {'level': level, **stats.report()}
+                stages.append(stage)
+                self.stderr.write(
+                    f'  {level}: {stage["throughput_rps"]}件/秒、p50 {stage["latency_ms"]["p50"]}ms、'
+                    f'p99 {stage["latency_ms"]["p99"]}ms、エラー {stage["errors"]}件、'
+                    f'429 {stage["throttled"]}件、破棄 {stage["dropped"]}件'
+                )
+        return stages
+
+    def _load_payloads(self, options: Dict[str, Any]) -> List[Dict[str, Any]]:
+        payloads = []
+        if options['payloads']:
+            try:
+                with open(options['payloads'], encoding='utf-8') as f:
+                    payloads.extend(json.loads(line) for line in f if line.strip())
+            except (OSError, ValueError) as e:
+                raise CommandError(f'--payloads を読み込めませんでした: {e}')
+        if options['from_sessions']:
+            payloads.extend(
+                DiagnosisSession.objects.order_by('-created_at')
+                .values_list('applicant_data', flat=True)[:options['from_sessions']]
+            )
+        return [p for p in payloads if isinstance(p, dict)]
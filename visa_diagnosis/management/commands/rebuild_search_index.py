@@ -0,0 +1,45 @@
+"""
+診断セッション検索用ドキュメントの再構築
+python manage.py rebuild_search_index [--chunk-size 1000]
+
+既存のセッションを主キー順にチャンク単位で読み出し（全件をメモリに載せない）、
+検索用ドキュメントを作成・更新する。全文索引はトリガーで追従する。
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from visa_diagnosis.models import DiagnosisSession
+from visa_diagnosis.search import bulk_index
+
+
+class Command(BaseCommand):
+    help = '診断セッションの検索用ドキュメント（全文検索インデックス）を再構築します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='1回に読み出すセッション数')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        indexed = 0
+
+        while True:
+            sessions = list(
+                DiagnosisSession.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'session_id', 'status', 'applicant_data', 'diagnosis_result', 'created_at')[:chunk_size]
+            )
+            if not sessions:
+                break
+
+            with transaction.atomic():
+                indexed += bulk_index(sessions)
+            last_pk = sessions[-1].pk
+            self.stdout.write(f'  {indexed}件索引')
+
+        if connection.vendor == 'sqlite':
+            # FTS5のセグメントを統合して検索を高速化
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO session_search_fts(session_search_fts) VALUES ('optimize')")
+
+        self.stdout.write(self.style.SUCCESS(f'検索インデックスを再構築しました: {indexed}件'))
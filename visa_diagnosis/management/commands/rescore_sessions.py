@@ -0,0 +1,195 @@
+"""
+ルールセット変更後の診断セッション再計算
+python manage.py rescore_sessions [--workers 4] [--chunk-size 1000] [--checkpoint rescore.json]
+
+セッションを主キー順にチャンク単位で読み出し（全件をメモリに載せない）、
+プロセスプールで現在のルールセットにより再計算して一括更新する。
+チャンクごとにチェックポイントを書き出すため、中断しても続きから再開できる。
+失敗したセッションがあれば、チェックポイントを残したままエラー終了する。
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from visa_diagnosis.logic import VisaDiagnosisEngine
+from visa_diagnosis.models import DiagnosisSession, SessionRescore
+from visa_diagnosis.search import bulk_index
+from visa_diagnosis.session_store import invalidate
+from visa_diagnosis.ruleset import Ruleset, get_ruleset
+
+
+_engine: Optional[VisaDiagnosisEngine] = None
+
+
+def _init_worker(ruleset: Ruleset):
+    """ワーカープロセスの初期化（DBにはアクセスしない）"""
+    global _engine
+    _engine = VisaDiagnosisEngine(ruleset=ruleset, enable_ai=False)
+
+
+def _top(result: Dict[str, Any]) -> Tuple[str, int]:
+    top = (result.get('top_recommendations') or result.get('all_options') or [None])[0]
+    if not top:
+        return '', 0
+    return top['visa_category']['code'], top['match_score']
+
+
+def _rescore(row: Tuple[int, Dict[str, Any], Dict[str, Any]]) -> Tuple[int, Optional[Dict[str, Any]], Optional[str]]:
+    """1セッションの再計算（ワーカープロセスで実行）"""
+    pk, applicant_data, previous_result = row
+    try:
+        return pk, _engine.rescore(applicant_data or {}, previous_result or {}), None
+    except Exception as e:
+        return pk, None, str(e)
+
+
+class Command(BaseCommand):
+    help = '現在のルールセットで診断セッションを再計算し、結果の変化を記録します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='1回に読み出すセッション数')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='ワーカープロセス数（1の場合はプロセスプールを使わない）')
+        parser.add_argument('--checkpoint', default='rescore_checkpoint.json', help='チェックポイントファイル')
+        parser.add_argument('--reset', action='store_true', help='チェックポイントを無視して最初から実行')
+        parser.add_argument('--dry-run', action='store_true', help='変化を集計するだけで更新しない')
+        parser.add_argument('--status', default='completed', help='対象とするセッションのステータス')
+
+    def handle(self, *args, **options):
+        ruleset = get_ruleset()
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+
+        state = self._load_checkpoint(options['checkpoint'], ruleset.version, options['reset'])
+        self.stdout.write(
+            f'ルールセット {ruleset.version} で再計算します'
+            f'（開始位置: pk>{state["last_pk"]}、処理済み: {state["processed"]}件）'
+        )
+
+        queryset = (
+            DiagnosisSession.objects
+            .filter(status=options['status'])
+            .exclude(ruleset_version=ruleset.version)
+            .order_by('pk')
+        )
+
+        pool = None
+        if options['workers'] > 1:
+            # フォーク前にDB接続を閉じる（子プロセスはDBを使わない）
+            connections.close_all()
+            pool = ProcessPoolExecutor(options['workers'], initializer=_init_worker, initargs=(ruleset,))
+        else:
+            _init_worker(ruleset)
+
+        try:
+            while True:
+                rows = list(
+                    queryset.filter(pk__gt=state['last_pk'])
+                    .values_list('pk', 'applicant_data', 'diagnosis_result', 'ruleset_version', 'session_id')[:chunk_size]
+                )
+                if not rows:
+                    break
+
+                previous = {pk: (result, version) for pk, _, result, version, _ in rows}
+                session_ids = {pk: session_id for pk, _, _, _, session_id in rows}
+                jobs = [(pk, applicant_data, result) for pk, applicant_data, result, _, _ in rows]
+                if pool:
+                    outcomes = pool.map(_rescore, jobs, chunksize=max(1, len(jobs) // (options['workers'] * 4)))
+                else:
+                    outcomes = map(_rescore, jobs)
+
+                sessions, rescores = [], []
+                now = timezone.now()
+                for pk, result, error in outcomes:
+                    if error is not None:
+                        state['failed'] += 1
+                        state['failed_ids'].append(pk)
+                        self.stderr.write(f'pk={pk}: {error}')
+                        continue
+
+                    previous_result, previous_version = previous[pk]
+                    previous_top, previous_score = _top(previous_result or {})
+                    new_top, new_score = _top(result)
+                    if previous_top != new_top or previous_score != new_score:
+                        state['changed'] += 1
+                        state['top_changed'] += previous_top != new_top
+                        rescores.append(SessionRescore(
+                            session_id=pk,
+                            previous_ruleset_version=previous_version,
+                            ruleset_version=ruleset.version,
+                            previous_top_code=previous_top,
+                            new_top_code=new_top,
+                            top_changed=previous_top != new_top,
+                            previous_score=previous_score,
+                            new_score=new_score,
+                            score_delta=new_score - previous_score,
+                        ))
+                    sessions.append(DiagnosisSession(
+                        pk=pk, diagnosis_result=result, ruleset_version=ruleset.version, updated_at=now
+                    ))
+
+                if not dry_run:
+                    with transaction.atomic():
+                        DiagnosisSession.objects.bulk_update(
+                            sessions, ['diagnosis_result', 'ruleset_version', 'updated_at'], batch_size=500
+                        )
+                        SessionRescore.objects.bulk_create(rescores, batch_size=500)
+                        # bulk_updateはシグナルを送らないため検索用ドキュメントを直接更新
+                        bulk_index(DiagnosisSession.objects.filter(pk__in=[s.pk for s in sessions]))
+                    # 同じくセッション取得APIのキャッシュも削除
+                    invalidate(session_ids[s.pk] for s in sessions)
+
+                state['last_pk'] = rows[-1][0]
+                state['processed'] += len(rows)
+                if not dry_run:
+                    self._save_checkpoint(options['checkpoint'], state)
+                self.stdout.write(
+                    f'  {state["processed"]}件処理（変化あり: {state["changed"]}件、'
+                    f'第1候補の変化: {state["top_changed"]}件、失敗: {state["failed"]}件）'
+                )
+        finally:
+            if pool:
+                pool.shutdown()
+
+        summary = (
+            f'{state["processed"]}件（変化あり: {state["changed"]}件、'
+            f'第1候補の変化: {state["top_changed"]}件、失敗: {state["failed"]}件）'
+        )
+        if state['failed']:
+            # 失敗したセッションは旧バージョンのまま残る。チェックポイントは消さずに失敗として終了する
+            raise CommandError(
+                f'再計算に失敗したセッションがあります: {summary}\n'
+                f'失敗したセッションのpk: {state["failed_ids"]}\n'
+                '原因を修正して --reset を付けて再実行すると、未更新のセッションだけを再計算します'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'再計算が完了しました: {summary}'))
+        if not dry_run and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+    def _load_checkpoint(self, path: str, version: str, reset: bool) -> Dict[str, Any]:
+        state = {
+            'ruleset_version': version, 'last_pk': 0, 'processed': 0, 'changed': 0, 'top_changed': 0,
+            'failed': 0, 'failed_ids': [],
+        }
+        if reset or not os.path.exists(path):
+            return state
+
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('ruleset_version') != version:
+            self.stdout.write(self.style.WARNING('ルールセットが変更されているため、チェックポイントを破棄して最初から実行します'))
+            return state
+        state.update(saved)
+        return state
+
+    def _save_checkpoint(self, path: str, state: Dict[str, Any]):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,75 @@
+"""
+一括診断のワーカー
+python manage.py run_diagnosis_worker [--burst] [--poll-interval 2] [--with-ai]
+
+アップロードされた名簿（CohortJob）の処理単位をDBのキューから1つずつ取得して診断し、
+診断セッションを一括保存する。プロセスを増やすだけで並列に処理できる（同じ処理単位を
+複数のワーカーが処理することはない）。SIGTERM・SIGINTを受けると処理中の処理単位を
+保存してから終了する。--burst を指定するとキューが空になった時点で終了する。
+"""
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from visa_diagnosis import cohorts
+
+
+class Command(BaseCommand):
+    help = '一括診断のキューから名簿を取得して診断します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}', help='ワーカーの識別名（既定はホスト名:プロセスID）')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='キューが空のときの確認間隔（秒）')
+        parser.add_argument('--burst', action='store_true', help='キューが空になったら終了する')
+        parser.add_argument('--max-chunks', type=int, default=0, help='この数の処理単位を処理したら終了する（0は無制限）')
+        parser.add_argument('--with-ai', action='store_true', help='AI分析つきで診断する（ANTHROPIC_API_KEYが必要）')
+
+    def handle(self, *args, **options):
+        worker = options['worker_id']
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f'ワーカー {worker} を起動しました')
+        handled = 0
+        while not self._stopping:
+            close_old_connections()
+            chunk = cohorts.claim_chunk(worker)
+            if chunk is None:
+                if options['burst']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.perf_counter()
+            try:
+                ok, failed = cohorts.process_chunk(chunk, worker, enable_ai=options['with_ai'])
+            except cohorts.LeaseLost as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+            except Exception as e:
+                requeued = cohorts.release_chunk(chunk, worker, str(e) or e.__class__.__name__)
+                self.stdout.write(self.style.ERROR(
+                    f'{chunk.job.job_id} #{chunk.index}: {e}（{"キューに戻しました" if requeued else "失敗として記録しました"}）'
+                ))
+            else:
+                self.stdout.write(
+                    f'{chunk.job.job_id} #{chunk.index}: {ok}件診断、{failed}件失敗'
+                    f'（{time.perf_counter() - started:.1f}秒）'
+                )
+            handled += 1
+            if options['max_chunks'] and handled >= options['max_chunks']:
+                break
+
+        close_old_connections()
+        self.stdout.write(self.style.SUCCESS(f'ワーカー {worker} を終了しました（処理単位 {handled}件）'))
+
+    def _stop(self, signum, frame):
+        if self._stopping:
+            raise KeyboardInterrupt
+        # 処理中の処理単位を保存してから終了する（もう一度送ると即時終了）
+        self._stopping = True
+        self.stdout.write('終了シグナルを受け取りました。処理中の処理単位を保存してから終了します')
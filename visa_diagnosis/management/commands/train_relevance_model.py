@@ -0,0 +1,55 @@
+"""
+専攻と職種の関連性モデルの学習
+python manage.py train_relevance_model [--output relevance_model.json]
+
+保存済みの診断結果からClaude APIによる関連性判定（ai_analysis.major_relevance）を集め、
+判定済みの組を記憶するとともに、分野×分野の関連度行列を平均スコアで補正する。
+オフライン判定の結果（source付き）は学習に使わない。
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from visa_diagnosis import relevance
+from visa_diagnosis.models import DiagnosisSession
+
+
+class Command(BaseCommand):
+    help = '保存済みのAIの回答から専攻と職種の関連性モデルを学習します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.RELEVANCE_MODEL_PATH, help='モデルの出力先')
+        parser.add_argument('--min-confidence', type=float, default=settings.RELEVANCE_MIN_CONFIDENCE,
+                            help='関連度行列の補正に使う分類の確信度の下限')
+
+    def handle(self, *args, **options):
+        rows = (
+            DiagnosisSession.objects
+            .filter(diagnosis_result__ai_analysis__major_relevance__isnull=False)
+            .order_by('pk')
+            .values_list('applicant_data', 'diagnosis_result')
+            .iterator(chunk_size=2000)
+        )
+
+        examples = []
+        for applicant_data, result in rows:
+            answer = (result.get('ai_analysis') or {}).get('major_relevance')
+            if not isinstance(answer, dict) or 'source' in answer:
+                continue
+            major = (applicant_data.get('education') or {}).get('major', '')
+            position = (applicant_data.get('job_details') or {}).get('position', '')
+            if major and position:
+                examples.append((major, position, answer))
+
+        model = relevance.train(examples, options['min_confidence'])
+        relevance.save(model, options['output'])
+
+        default = relevance.default_matrix()
+        adjusted = sum(
+            1 for major_field, row in model.matrix.items()
+            for job_field, score in row.items() if score != default[major_field][job_field]
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'関連性モデルを保存しました: {options["output"]}'
+            f'（AIの回答: {len(examples)}件、判定済みの組: {len(model.pairs)}件、補正した分野の組: {adjusted}件）'
+        ))
+        self.stdout.write('稼働中のサーバーには再起動後に反映されます')
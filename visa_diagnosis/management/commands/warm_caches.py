@@ -0,0 +1,88 @@
+"""
+デプロイ後のキャッシュの事前作成
+python manage.py warm_caches [--url https://example.onrender.com]
+
+ルールセットをDBから構築して共有キャッシュに載せ、カタログAPI・在留資格一覧ページを
+アプリ内で一度リクエストして描画結果（HTML断片）をキャッシュに載せる。
+--url を指定すると稼働中のサーバーにも同じリクエストを送り、プロセス内のルールセットと
+CDNのキャッシュも温める。デプロイ直後の最初のリクエストを定常時と同じ速さで返すためのもの。
+"""
+import time
+import urllib.request
+from typing import List
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from visa_diagnosis.ruleset import warm_ruleset
+
+
+class Command(BaseCommand):
+    help = 'ルールセット・カタログAPI・在留資格一覧ページのキャッシュを事前に作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='稼働中のサーバーのURL（指定するとHTTPでも同じページをリクエストする）')
+        parser.add_argument('--timeout', type=float, default=30.0, help='--url へのリクエストのタイムアウト（秒）')
+
+    def handle(self, *args, **options):
+        if isinstance(caches[settings.RULESET_CACHE], LocMemCache) and not options['url']:
+            self.stdout.write(self.style.WARNING(
+                'ローカルメモリのキャッシュは他のプロセスと共有されないため、サーバーには反映されません'
+                '（CACHE_PROFILEでfile・redis・memcachedを指定するか、--url を指定してください）'
+            ))
+
+        started = time.perf_counter()
+        ruleset = warm_ruleset()
+        self.stdout.write(
+            f'ルールセット {ruleset.version}（在留資格 {len(ruleset.visas)}件）: '
+            f'{(time.perf_counter() - started) * 1000:.1f}ms'
+        )
+
+        paths = self._paths(ruleset.by_code)
+        client = Client(HTTP_HOST=self._host())
+        for path in paths:
+            started = time.perf_counter()
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f'{path} の応答が {response.status_code} でした')
+            self.stdout.write(f'  {path}: {(time.perf_counter() - started) * 1000:.1f}ms')
+
+        if options['url']:
+            base = options['url'].rstrip('/')
+            self.stdout.write(f'{base} にリクエストします')
+            for path in paths:
+                self._fetch(base + path, options['timeout'])
+
+        self.stdout.write(self.style.SUCCESS(f'キャッシュを作成しました（{len(paths)}ページ）'))
+
+    @staticmethod
+    def _paths(codes) -> List[str]:
+        return (
+            [reverse('visa_diagnosis:api_visa_list')]
+            + [reverse('visa_diagnosis:api_visa_detail', args=[code]) for code in codes]
+            + [reverse('visa_diagnosis:visa_list')]
+        )
+
+    @staticmethod
+    def _host() -> str:
+        """ALLOWED_HOSTSに含まれるホスト名（アプリ内のリクエスト用）"""
+        for host in settings.ALLOWED_HOSTS:
+            if host != '*':
+                return host.lstrip('.')
+        return 'localhost'
+
+    def _fetch(self, url: str, timeout: float):
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except Exception as e:
+            self.stderr.write(f'  {url}: {e}')
+            return
+        self.stdout.write(f'  {url}: {status}（{(time.perf_counter() - started) * 1000:.1f}ms）')
@@ -0,0 +1,68 @@
+"""
+レスポンス圧縮 - Accept-Encodingに応じてJSON・HTMLをbrotli / gzipで圧縮
+
+brotliパッケージがインストールされていればJSONはbrotliを優先し、それ以外はgzip
+（DjangoのGZipMiddleware、BREACH対策のランダムなパディング付き）で圧縮する。
+CSRFトークンを含み得るHTMLはパディングのないbrotliでは圧縮しない。
+圧縮済み（Content-Encodingあり）・ストリーミングのレスポンスはそのまま返す
+（エクスポートは必要に応じてビュー側でgzipにする）。
+"""
+from typing import Set
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html')
+BROTLI_TYPES = ('application/json',)
+MIN_LENGTH = 200        # これより短い本文は圧縮しない（GZipMiddlewareと同じ）
+BROTLI_QUALITY = 5      # 0〜11（動的なレスポンス向けに速度を優先）
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    """Accept-Encodingのうち q=0 でないもの"""
+    accepted = set()
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """JSON・HTMLレスポンスの圧縮（brotliが使えなければgzipのみ）"""
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if (content_type not in COMPRESSIBLE_TYPES or response.streaming
+                or response.has_header('Content-Encoding')):
+            return response
+
+        if (brotli is not None and content_type in BROTLI_TYPES
+                and len(response.content) >= MIN_LENGTH
+                and 'br' in _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))):
+            patch_vary_headers(response, ('Accept-Encoding',))
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+            etag = response.get('ETag')
+            if etag and etag.startswith('"'):
+                response.headers['ETag'] = 'W/' + etag
+            response.headers['Content-Encoding'] = 'br'
+            return response
+
+        return super().process_response(request, response)
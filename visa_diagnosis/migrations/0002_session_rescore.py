@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visa_diagnosis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosissession',
+            name='ruleset_version',
+            field=models.CharField(blank=True, db_index=True, max_length=40, verbose_name='ルールセットバージョン'),
+        ),
+        migrations.CreateModel(
+            name='SessionRescore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_ruleset_version', models.CharField(blank=True, max_length=40, verbose_name='変更前のルールセット')),
+                ('ruleset_version', models.CharField(db_index=True, max_length=40, verbose_name='ルールセット')),
+                ('previous_top_code', models.CharField(blank=True, max_length=50, verbose_name='変更前の第1候補')),
+                ('new_top_code', models.CharField(blank=True, max_length=50, verbose_name='変更後の第1候補')),
+                ('top_changed', models.BooleanField(default=False, verbose_name='第1候補の変化')),
+                ('previous_score', models.IntegerField(default=0, verbose_name='変更前のスコア')),
+                ('new_score', models.IntegerField(default=0, verbose_name='変更後のスコア')),
+                ('score_delta', models.IntegerField(default=0, verbose_name='スコア差')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rescores', to='visa_diagnosis.diagnosissession', verbose_name='診断セッション')),
+            ],
+            options={
+                'verbose_name': '再診断結果',
+                'verbose_name_plural': '再診断結果一覧',
+                'db_table': 'session_rescores',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# 全文検索インデックス（バックエンドごとに作成）
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE session_search_fts USING fts5(body, tokenize='unicode61')",
+    """CREATE TRIGGER session_search_fts_insert AFTER INSERT ON session_search_documents BEGIN
+        INSERT INTO session_search_fts(rowid, body) VALUES (new.session_id, new.body);
+    END""",
+    """CREATE TRIGGER session_search_fts_delete AFTER DELETE ON session_search_documents BEGIN
+        DELETE FROM session_search_fts WHERE rowid = old.session_id;
+    END""",
+    """CREATE TRIGGER session_search_fts_update AFTER UPDATE OF body ON session_search_documents BEGIN
+        DELETE FROM session_search_fts WHERE rowid = old.session_id;
+        INSERT INTO session_search_fts(rowid, body) VALUES (new.session_id, new.body);
+    END""",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS session_search_fts_update",
+    "DROP TRIGGER IF EXISTS session_search_fts_delete",
+    "DROP TRIGGER IF EXISTS session_search_fts_insert",
+    "DROP TABLE IF EXISTS session_search_fts",
+]
+POSTGRESQL_FORWARD = [
+    "CREATE INDEX session_search_body_tsv ON session_search_documents USING gin (to_tsvector('simple', body))",
+]
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS session_search_body_tsv",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+create_fulltext_index = _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD})
+drop_fulltext_index = _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visa_diagnosis', '0002_session_rescore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionSearchDocument',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='visa_diagnosis.diagnosissession', verbose_name='診断セッション')),
+                ('status', models.CharField(db_index=True, max_length=20, verbose_name='ステータス')),
+                ('nationality', models.CharField(blank=True, db_index=True, max_length=100, verbose_name='国籍')),
+                ('industry', models.CharField(blank=True, db_index=True, max_length=100, verbose_name='業種')),
+                ('position', models.CharField(blank=True, db_index=True, max_length=100, verbose_name='職種')),
+                ('jlpt_level', models.CharField(blank=True, db_index=True, max_length=2, verbose_name='日本語能力')),
+                ('top_visa_code', models.CharField(blank=True, db_index=True, max_length=50, verbose_name='第1候補')),
+                ('top_score', models.IntegerField(default=0, verbose_name='第1候補のスコア')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='作成日時')),
+                ('body', models.TextField(blank=True, verbose_name='検索テキスト（n-gram）')),
+            ],
+            options={
+                'verbose_name': '検索ドキュメント',
+                'verbose_name_plural': '検索ドキュメント一覧',
+                'db_table': 'session_search_documents',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
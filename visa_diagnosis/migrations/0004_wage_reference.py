@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visa_diagnosis', '0003_session_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WageReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('industry', models.CharField(blank=True, help_text='空欄は全業種', max_length=100, verbose_name='業種')),
+                ('occupation', models.CharField(blank=True, help_text='空欄は全職種', max_length=100, verbose_name='職種')),
+                ('prefecture', models.CharField(blank=True, help_text='空欄は全国', max_length=10, verbose_name='都道府県')),
+                ('experience_years_min', models.PositiveSmallIntegerField(default=0, verbose_name='経験年数（下限）')),
+                ('p10', models.PositiveIntegerField(blank=True, null=True, verbose_name='第1十分位（月額）')),
+                ('p25', models.PositiveIntegerField(blank=True, null=True, verbose_name='第1四分位（月額）')),
+                ('p50', models.PositiveIntegerField(blank=True, null=True, verbose_name='中央値（月額）')),
+                ('p75', models.PositiveIntegerField(blank=True, null=True, verbose_name='第3四分位（月額）')),
+                ('p90', models.PositiveIntegerField(blank=True, null=True, verbose_name='第9十分位（月額）')),
+                ('source', models.CharField(blank=True, max_length=200, verbose_name='出典')),
+            ],
+            options={
+                'verbose_name': '賃金の参照値',
+                'verbose_name_plural': '賃金の参照値一覧',
+                'db_table': 'wage_references',
+                'ordering': ['industry', 'occupation', 'prefecture', 'experience_years_min'],
+                'constraints': [models.UniqueConstraint(fields=('industry', 'occupation', 'prefecture', 'experience_years_min'), name='wage_reference_unique_band')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visa_diagnosis', '0004_wage_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=100, unique=True, verbose_name='ジョブID')),
+                ('name', models.CharField(blank=True, max_length=200, verbose_name='名称')),
+                ('status', models.CharField(choices=[('queued', '待機中'), ('running', '処理中'), ('completed', '完了'), ('failed', '失敗')], db_index=True, default='queued', max_length=20, verbose_name='ステータス')),
+                ('total', models.IntegerField(default=0, verbose_name='件数')),
+                ('processed', models.IntegerField(default=0, verbose_name='処理済み')),
+                ('failed', models.IntegerField(default=0, verbose_name='失敗')),
+                ('created_by', models.CharField(blank=True, max_length=150, verbose_name='登録者')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完了日時')),
+            ],
+            options={
+                'verbose_name': '一括診断ジョブ',
+                'verbose_name_plural': '一括診断ジョブ一覧',
+                'db_table': 'cohort_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CohortChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(verbose_name='順番')),
+                ('start_row', models.IntegerField(verbose_name='開始行')),
+                ('applicants', models.JSONField(default=list, verbose_name='申請者情報')),
+                ('status', models.CharField(choices=[('queued', '待機中'), ('running', '処理中'), ('done', '完了'), ('failed', '失敗')], default='queued', max_length=20, verbose_name='ステータス')),
+                ('worker', models.CharField(blank=True, max_length=200, verbose_name='ワーカー')),
+                ('leased_until', models.DateTimeField(blank=True, null=True, verbose_name='処理期限')),
+                ('attempts', models.IntegerField(default=0, verbose_name='試行回数')),
+                ('last_error', models.TextField(blank=True, verbose_name='最後のエラー')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='visa_diagnosis.cohortjob', verbose_name='ジョブ')),
+            ],
+            options={
+                'verbose_name': '一括診断の処理単位',
+                'verbose_name_plural': '一括診断の処理単位一覧',
+                'db_table': 'cohort_chunks',
+                'ordering': ['job', 'index'],
+                'indexes': [models.Index(fields=['status', 'leased_until'], name='cohort_chunk_claim')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'index'), name='cohort_chunk_unique_index')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CohortResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.IntegerField(verbose_name='行番号')),
+                ('error', models.TextField(blank=True, verbose_name='エラー')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='visa_diagnosis.cohortjob', verbose_name='ジョブ')),
+                ('session', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cohort_result', to='visa_diagnosis.diagnosissession', verbose_name='診断セッション')),
+            ],
+            options={
+                'verbose_name': '一括診断の結果',
+                'verbose_name_plural': '一括診断の結果一覧',
+                'db_table': 'cohort_results',
+                'ordering': ['job', 'row'],
+                'constraints': [models.UniqueConstraint(fields=('job', 'row'), name='cohort_result_unique_row')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visa_diagnosis', '0005_cohort_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='キー')),
+                ('count', models.IntegerField(default=0, verbose_name='件数')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='有効期限')),
+            ],
+            options={
+                'verbose_name': 'レート制限のカウンタ',
+                'verbose_name_plural': 'レート制限のカウンタ一覧',
+                'db_table': 'rate_limit_counters',
+            },
+        ),
+    ]
@@ -94,6 +94,37 @@ class IndustryVisaMapping(models.Model):
         return f"{self.industry} - {self.job_category} → {self.visa_category.code} ({self.match_score}点)"
 
 
+class WageReference(models.Model):
+    """賃金の参照値（業種×職種×都道府県×経験年数帯の月額賃金の分布）"""
+
+    industry = models.CharField('業種', max_length=100, blank=True, help_text='空欄は全業種')
+    occupation = models.CharField('職種', max_length=100, blank=True, help_text='空欄は全職種')
+    prefecture = models.CharField('都道府県', max_length=10, blank=True, help_text='空欄は全国')
+    experience_years_min = models.PositiveSmallIntegerField('経験年数（下限）', default=0)
+    p10 = models.PositiveIntegerField('第1十分位（月額）', null=True, blank=True)
+    p25 = models.PositiveIntegerField('第1四分位（月額）', null=True, blank=True)
+    p50 = models.PositiveIntegerField('中央値（月額）', null=True, blank=True)
+    p75 = models.PositiveIntegerField('第3四分位（月額）', null=True, blank=True)
+    p90 = models.PositiveIntegerField('第9十分位（月額）', null=True, blank=True)
+    source = models.CharField('出典', max_length=200, blank=True)
+
+    class Meta:
+        db_table = 'wage_references'
+        verbose_name = '賃金の参照値'
+        verbose_name_plural = '賃金の参照値一覧'
+        ordering = ['industry', 'occupation', 'prefecture', 'experience_years_min']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['industry', 'occupation', 'prefecture', 'experience_years_min'],
+                name='wage_reference_unique_band',
+            ),
+        ]
+
+    def __str__(self):
+        area = ' / '.join(v or '計' for v in (self.industry, self.occupation, self.prefecture))
+        return f"{area} 経験{self.experience_years_min}年以上: 中央値 {self.p50 or '-'}"
+
+
 class DiagnosisSession(models.Model):
     """診断セッション"""
     
@@ -107,6 +138,7 @@ class DiagnosisSession(models.Model):
     status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='in_progress')
     applicant_data = models.JSONField('申請者情報', default=dict)
     diagnosis_result = models.JSONField('診断結果', default=dict, blank=True)
+    ruleset_version = models.CharField('ルールセットバージョン', max_length=40, blank=True, db_index=True)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
     
@@ -120,6 +152,186 @@ class DiagnosisSession(models.Model):
         return f"診断 {self.session_id} ({self.get_status_display()})"
 
 
+class SessionSearchDocument(models.Model):
+    """診断セッションの検索用ドキュメント（全文検索・ファセット）"""
+    
+    session = models.OneToOneField(
+        DiagnosisSession,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document',
+        verbose_name='診断セッション'
+    )
+    status = models.CharField('ステータス', max_length=20, db_index=True)
+    nationality = models.CharField('国籍', max_length=100, blank=True, db_index=True)
+    industry = models.CharField('業種', max_length=100, blank=True, db_index=True)
+    position = models.CharField('職種', max_length=100, blank=True, db_index=True)
+    jlpt_level = models.CharField('日本語能力', max_length=2, blank=True, db_index=True)
+    top_visa_code = models.CharField('第1候補', max_length=50, blank=True, db_index=True)
+    top_score = models.IntegerField('第1候補のスコア', default=0)
+    created_at = models.DateTimeField('作成日時', db_index=True)
+    body = models.TextField('検索テキスト（n-gram）', blank=True)
+    
+    class Meta:
+        db_table = 'session_search_documents'
+        verbose_name = '検索ドキュメント'
+        verbose_name_plural = '検索ドキュメント一覧'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"検索 {self.session_id}"
+
+
+class SessionRescore(models.Model):
+    """ルールセット変更後の再診断による変化"""
+    
+    session = models.ForeignKey(
+        DiagnosisSession,
+        on_delete=models.CASCADE,
+        related_name='rescores',
+        verbose_name='診断セッション'
+    )
+    previous_ruleset_version = models.CharField('変更前のルールセット', max_length=40, blank=True)
+    ruleset_version = models.CharField('ルールセット', max_length=40, db_index=True)
+    previous_top_code = models.CharField('変更前の第1候補', max_length=50, blank=True)
+    new_top_code = models.CharField('変更後の第1候補', max_length=50, blank=True)
+    top_changed = models.BooleanField('第1候補の変化', default=False)
+    previous_score = models.IntegerField('変更前のスコア', default=0)
+    new_score = models.IntegerField('変更後のスコア', default=0)
+    score_delta = models.IntegerField('スコア差', default=0)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    
+    class Meta:
+        db_table = 'session_rescores'
+        verbose_name = '再診断結果'
+        verbose_name_plural = '再診断結果一覧'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.session.session_id}: {self.previous_top_code} → {self.new_top_code} ({self.score_delta:+d})"
+
+
+class CohortJob(models.Model):
+    """一括診断ジョブ（アップロードされた候補者名簿）"""
+
+    STATUS_CHOICES = [
+        ('queued', '待機中'),
+        ('running', '処理中'),
+        ('completed', '完了'),
+        ('failed', '失敗'),
+    ]
+
+    job_id = models.CharField('ジョブID', max_length=100, unique=True)
+    name = models.CharField('名称', max_length=200, blank=True)
+    status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    total = models.IntegerField('件数', default=0)
+    processed = models.IntegerField('処理済み', default=0)
+    failed = models.IntegerField('失敗', default=0)
+    created_by = models.CharField('登録者', max_length=150, blank=True)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    started_at = models.DateTimeField('開始日時', null=True, blank=True)
+    finished_at = models.DateTimeField('完了日時', null=True, blank=True)
+
+    class Meta:
+        db_table = 'cohort_jobs'
+        verbose_name = '一括診断ジョブ'
+        verbose_name_plural = '一括診断ジョブ一覧'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name or self.job_id} ({self.processed + self.failed}/{self.total})"
+
+
+class CohortChunk(models.Model):
+    """一括診断ジョブの処理単位（ワーカーが1つずつ取得するキューの要素）"""
+
+    STATUS_CHOICES = [
+        ('queued', '待機中'),
+        ('running', '処理中'),
+        ('done', '完了'),
+        ('failed', '失敗'),
+    ]
+
+    job = models.ForeignKey(
+        CohortJob,
+        on_delete=models.CASCADE,
+        related_name='chunks',
+        verbose_name='ジョブ'
+    )
+    index = models.IntegerField('順番')
+    start_row = models.IntegerField('開始行')  # 名簿の行番号（0始まり）
+    applicants = models.JSONField('申請者情報', default=list)
+    status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='queued')
+    worker = models.CharField('ワーカー', max_length=200, blank=True)
+    leased_until = models.DateTimeField('処理期限', null=True, blank=True)  # 過ぎたら他のワーカーが取得し直す
+    attempts = models.IntegerField('試行回数', default=0)
+    last_error = models.TextField('最後のエラー', blank=True)
+
+    class Meta:
+        db_table = 'cohort_chunks'
+        verbose_name = '一括診断の処理単位'
+        verbose_name_plural = '一括診断の処理単位一覧'
+        ordering = ['job', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='cohort_chunk_unique_index'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'leased_until'], name='cohort_chunk_claim'),
+        ]
+
+    def __str__(self):
+        return f"{self.job.job_id} #{self.index} ({self.get_status_display()})"
+
+
+class CohortResult(models.Model):
+    """一括診断の名簿1行ごとの結果（成功は診断セッション、失敗はエラー）"""
+
+    job = models.ForeignKey(
+        CohortJob,
+        on_delete=models.CASCADE,
+        related_name='results',
+        verbose_name='ジョブ'
+    )
+    row = models.IntegerField('行番号')  # 名簿の行番号（0始まり）
+    session = models.OneToOneField(
+        DiagnosisSession,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='cohort_result',
+        verbose_name='診断セッション'
+    )
+    error = models.TextField('エラー', blank=True)
+
+    class Meta:
+        db_table = 'cohort_results'
+        verbose_name = '一括診断の結果'
+        verbose_name_plural = '一括診断の結果一覧'
+        ordering = ['job', 'row']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'row'], name='cohort_result_unique_row'),
+        ]
+
+    def __str__(self):
+        return f"{self.job.job_id} 行{self.row + 1}: {self.session.session_id if self.session_id else self.error[:50]}"
+
+
+class RateLimitCounter(models.Model):
+    """レート制限のカウンタ（RATE_LIMIT_STORE='db' の場合。バケット・クライアント・ウィンドウごとの件数）"""
+
+    key = models.CharField('キー', max_length=255, unique=True)
+    count = models.IntegerField('件数', default=0)
+    expires_at = models.DateTimeField('有効期限', db_index=True)
+
+    class Meta:
+        db_table = 'rate_limit_counters'
+        verbose_name = 'レート制限のカウンタ'
+        verbose_name_plural = 'レート制限のカウンタ一覧'
+
+    def __str__(self):
+        return f"{self.key}: {self.count}"
+
+
 class DocumentTemplate(models.Model):
     """必要書類テンプレート"""
     
@@ -0,0 +1,157 @@
+"""
+申請者プロファイル - 診断で参照する申請者情報の正規化済みスナップショット
+
+リクエストの申請者情報（dict）は診断のたびに1回だけ解析し、経験年数の合計・
+日本語能力試験のレベル・学位の順位・報酬などを事前に求めておく。
+要件チェック・サマリー・AIのプロンプト・What-if分析はすべてこのプロファイルを参照する。
+"""
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from . import vocabulary, wages
+
+
+class ApplicantProfile(NamedTuple):
+    """正規化済みの申請者情報（タプルのため変更はvary()で新しいプロファイルを作る）"""
+
+    nationality: str
+    age: Optional[int]
+    has_education: bool
+    degree: str
+    degree_level: str                    # vocabulary.DEGREE_LEVELS の値
+    degree_rank: int                     # DEGREE_LEVELS 内の順位
+    major: str
+    university: str
+    japan_university: bool
+    multiple_degrees: bool
+    research_achievements: bool
+    total_years: int                     # 実務経験の合計年数
+    experience_field: str
+    qualifications: Tuple[str, ...]
+    held: vocabulary.Qualifications      # 保有資格の構造化結果
+    has_job_details: bool
+    industry: str
+    position: str
+    duties: str
+    industry_key: str                    # 照合用に正規化した業種
+    position_key: str                    # 照合用に正規化した職種
+    wage_industry_key: str               # 賃金の参照値の産業（wages.industry_key）
+    prefecture: str                      # 勤務地の都道府県（任意）
+    prefecture_key: str                  # 照合用に正規化した都道府県（wages.prefecture_key）
+    salary: int                          # 月額報酬
+    declared_annual_salary: int          # 申告された年収（未申告は0）
+    has_company: bool
+    company_name: str
+
+    @classmethod
+    def from_dict(cls, applicant_data: Dict[str, Any]) -> 'ApplicantProfile':
+        """
+        申請者情報（diagnose()と同じ形式）からプロファイルを作成
+
+        Args:
+            applicant_data: 申請者情報（加えて任意で age, annual_salary,
+                education.japan_university, education.multiple_degrees, research_achievements,
+                job_details.prefecture（勤務地の都道府県、なければ company_info.prefecture））
+        """
+        education = applicant_data.get('education') or {}
+        experience = applicant_data.get('experience') or []
+        job_details = applicant_data.get('job_details') or {}
+        company_info = applicant_data.get('company_info') or {}
+        qualifications = tuple(q for q in applicant_data.get('qualifications') or [] if q)
+        degree = education.get('degree') or ''
+        degree_level = vocabulary.parse_degree(degree)
+        industry = job_details.get('industry') or ''
+        position = job_details.get('position') or ''
+        prefecture = job_details.get('prefecture') or company_info.get('prefecture') or ''
+        age = applicant_data.get('age')
+
+        return cls(
+            nationality=applicant_data.get('nationality') or '',
+            age=int(age) if age not in (None, '') else None,
+            has_education=bool(education),
+            degree=degree,
+            degree_level=degree_level,
+            degree_rank=vocabulary.degree_rank(degree_level),
+            major=education.get('major') or '',
+            university=education.get('university') or '',
+            japan_university=bool(education.get('japan_university')),
+            multiple_degrees=bool(education.get('multiple_degrees')),
+            research_achievements=bool(applicant_data.get('research_achievements')),
+            total_years=sum(exp.get('years', 0) for exp in experience),
+            experience_field=experience[0].get('field', '') if experience else '',
+            qualifications=qualifications,
+            held=vocabulary.parse_qualifications(qualifications),
+            has_job_details=bool(job_details),
+            industry=industry,
+            position=position,
+            duties=job_details.get('duties') or '',
+            industry_key=vocabulary.normalize(industry),
+            position_key=vocabulary.normalize(position),
+            wage_industry_key=wages.industry_key(industry),
+            prefecture=prefecture,
+            prefecture_key=wages.prefecture_key(prefecture),
+            salary=int(applicant_data.get('salary') or 0),
+            declared_annual_salary=int(applicant_data.get('annual_salary') or 0),
+            has_company=bool(company_info),
+            company_name=company_info.get('name') or '',
+        )
+
+    def vary(self, salary: Optional[int] = None, total_years: Optional[int] = None,
+             added_qualifications: Tuple[str, ...] = ()) -> 'ApplicantProfile':
+        """報酬・経験年数を置き換え、または資格を追加したプロファイル（What-if分析用）"""
+        changes = {}
+        if salary is not None:
+            changes['salary'] = salary
+        if total_years is not None:
+            changes['total_years'] = total_years
+        if added_qualifications:
+            qualifications = self.qualifications + tuple(q for q in added_qualifications if q)
+            changes['qualifications'] = qualifications
+            changes['held'] = vocabulary.parse_qualifications(qualifications)
+        return self._replace(**changes)
+
+    @property
+    def jlpt_level(self) -> Optional[int]:
+        """保有する日本語能力試験の最上位レベル（1が最上位）"""
+        return self.held.jlpt_level
+
+    @property
+    def annual_salary(self) -> int:
+        """年収（申告がなければ月額報酬の12か月分）"""
+        return self.declared_annual_salary or self.salary * 12
+
+
+def applicant_data_from_form(post) -> Dict[str, Any]:
+    """
+    フォームの項目から申請者情報（diagnose()と同じ形式）を組み立てる
+
+    診断フォームの送信と一括診断の名簿（CSVの1行）で共用する。
+
+    Raises:
+        ValueError: 年齢・経験年数・月額報酬が整数でない場合
+    """
+    return {
+        'nationality': post.get('nationality', ''),
+        'age': int(post.get('age')) if post.get('age') else None,
+        'education': {
+            'degree': post.get('degree', ''),
+            'major': post.get('major', ''),
+            'university': post.get('university', ''),
+        },
+        'experience': [
+            {
+                'years': int(post.get('experience_years', 0)),
+                'field': post.get('experience_field', ''),
+            }
+        ] if post.get('experience_years') else [],
+        'qualifications': [q.strip() for q in post.get('qualifications', '').split(',') if q.strip()],
+        'job_details': {
+            'industry': post.get('industry', ''),
+            'position': post.get('position', ''),
+            'prefecture': post.get('prefecture', ''),
+            'duties': post.get('duties', ''),
+        },
+        'salary': int(post.get('salary', 0)) if post.get('salary') else 0,
+        'company_info': {
+            'name': post.get('company_name', ''),
+        }
+    }
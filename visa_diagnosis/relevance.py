@@ -0,0 +1,350 @@
+"""
+専攻と職種の関連性（オフライン判定）
+
+専攻・職種それぞれの語彙（分野ラベルつき）を文字n-gramのTF-IDFベクトルに変換しておき、
+入力に最も近い語の分野を引いて、分野×分野の関連度行列からスコアを求める。
+ネットワークを使わずに判定でき、近い語が見つからない（確信度が低い）組だけを
+Claude APIに回す。
+
+関連度行列と判定済みの組は、診断結果に保存されたAIの回答から学習できる
+（python manage.py train_relevance_model）。
+"""
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+# ---------------------------------------------------------------------------
+# 語彙と分野間の関連度
+# ---------------------------------------------------------------------------
+
+FIELD_NAMES = {
+    'it': '情報・IT',
+    'mechanical': '機械',
+    'electrical': '電気・電子',
+    'construction': '建築・土木',
+    'business': '経営・経済',
+    'accounting': '会計・財務',
+    'law': '法律',
+    'language': '語学・文学',
+    'international': '国際関係',
+    'hospitality': '観光・ホテル',
+    'care': '介護・福祉・看護',
+    'food': '調理・食品',
+    'agriculture': '農業',
+    'design': 'デザイン',
+    'education': '教育',
+}
+
+MAJOR_VOCABULARY = {
+    'it': ('情報工学', '情報科学', 'コンピュータサイエンス', 'コンピューター科学', 'ソフトウェア工学',
+           '情報システム', '情報処理', '電子情報工学', 'データサイエンス', 'it', 'computer science',
+           'information technology', 'software engineering', 'informatics'),
+    'mechanical': ('機械工学', '機械システム工学', '自動車工学', '精密工学', 'mechanical engineering'),
+    'electrical': ('電気工学', '電子工学', '電気電子工学', '通信工学', 'electrical engineering',
+                   'electronics'),
+    'construction': ('建築学', '土木工学', '都市工学', '建設工学', 'architecture', 'civil engineering'),
+    'business': ('経営学', '経済学', '商学', 'マーケティング', 'business administration',
+                 'economics', 'management', 'mba', 'commerce'),
+    'accounting': ('会計学', '財務', 'ファイナンス', 'accounting', 'finance'),
+    'law': ('法学', '法律学', '政治学', 'law', 'political science'),
+    'language': ('日本語学', '日本語', '英語学', '外国語学', '言語学', '文学', '日本文学', '通訳翻訳',
+                 'japanese', 'linguistics', 'english', 'literature'),
+    'international': ('国際関係学', '国際学', '国際コミュニケーション', 'international relations',
+                      'international studies'),
+    'hospitality': ('観光学', 'ホテル経営', 'ホスピタリティ', '観光', 'tourism', 'hospitality'),
+    'care': ('介護福祉', '社会福祉学', '看護学', '福祉', 'nursing', 'social welfare'),
+    'food': ('調理', '栄養学', '食品科学', '製菓', 'culinary', 'food science', 'nutrition'),
+    'agriculture': ('農学', '農業', '園芸学', '畜産学', 'agriculture'),
+    'design': ('デザイン', '美術', 'グラフィックデザイン', '芸術', 'design', 'fine arts'),
+    'education': ('教育学', '教育', 'education'),
+}
+
+JOB_VOCABULARY = {
+    'it': ('システムエンジニア', 'プログラマー', 'ソフトウェア開発', 'web開発', 'アプリ開発', 'インフラエンジニア',
+           'データ分析', 'itエンジニア', 'se', 'software engineer', 'developer'),
+    'mechanical': ('機械設計', '生産技術', '製造技術者', '設備保全', '品質管理', 'cad設計'),
+    'electrical': ('電気設計', '回路設計', '電子機器開発', '制御設計'),
+    'construction': ('建築技術者', '施工管理', '建築設計', '土木設計', '設計士'),
+    'business': ('営業', '経営企画', 'マーケティング', '企画', 'コンサルタント', '事業開発'),
+    'accounting': ('経理', '財務', '会計', '経理事務'),
+    'law': ('法務', '知的財産'),
+    'language': ('通訳', '翻訳', '語学講師', '日本語教師', '通訳翻訳'),
+    'international': ('海外営業', '貿易事務', '海外事業', '国際業務'),
+    'hospitality': ('フロント業務', 'ホテルスタッフ', '観光ガイド', '接客'),
+    'care': ('介護職員', '介護福祉士', '看護助手', '生活支援員'),
+    'food': ('調理師', '外国料理専門調理師', '食品製造', 'パティシエ'),
+    'agriculture': ('農業作業員', '農業技術者'),
+    'design': ('webデザイナー', 'デザイナー', 'グラフィックデザイナー'),
+    'education': ('講師', '教師', '教育担当'),
+}
+
+DIRECT_RELEVANCE = 95   # 同一分野
+RELATED_RELEVANCE = 70  # 関連分野
+DEFAULT_RELEVANCE = 25  # その他
+
+# 関連分野（専攻の分野 → 職種の分野）
+RELATED_FIELDS = {
+    'it': ('electrical', 'design', 'business'),
+    'mechanical': ('electrical', 'construction'),
+    'electrical': ('it', 'mechanical'),
+    'construction': ('mechanical', 'design'),
+    'business': ('accounting', 'international', 'hospitality', 'law'),
+    'accounting': ('business',),
+    'law': ('business', 'international'),
+    'language': ('international', 'hospitality', 'education'),
+    'international': ('business', 'language', 'hospitality'),
+    'hospitality': ('business', 'food', 'language'),
+    'care': (),
+    'food': ('hospitality', 'agriculture'),
+    'agriculture': ('food',),
+    'design': ('it', 'construction'),
+    'education': ('language',),
+}
+
+NGRAM_RANGE = (1, 3)
+# これより短い英数字の語（'it'・'se'・'mba'など）は文字n-gramでは照合せず、
+# 前後が英数字でない語として現れた場合のみ一致とする（'nurse'の'se'に一致しないように）
+MIN_NGRAM_ASCII_TERM_LENGTH = 4
+_ASCII_TOKEN = re.compile(r'[a-z0-9]+')
+PRIOR_WEIGHT = 5  # 学習時の関連度行列の事前値の重み（回答何件分に相当するか）
+
+
+def normalize(text: str) -> str:
+    """NFKC正規化・小文字化し、空白を除去"""
+    return ''.join(unicodedata.normalize('NFKC', text or '').lower().split())
+
+
+def _ngrams(text: str) -> List[str]:
+    padded = f'^{text}$'
+    low, high = NGRAM_RANGE
+    return [padded[i:i + n] for n in range(low, high + 1) for i in range(len(padded) - n + 1)]
+
+
+def relevance_level(score: int) -> str:
+    if score >= 70:
+        return '高い'
+    if score >= 50:
+        return '中程度'
+    return '低い'
+
+
+def _is_short_ascii(term: str) -> bool:
+    return term.isascii() and len(term) < MIN_NGRAM_ASCII_TERM_LENGTH
+
+
+class _Index:
+    """語彙の文字n-gram TF-IDF（転置インデックスで余弦類似度を計算）"""
+
+    def __init__(self, vocabulary: Dict[str, Tuple[str, ...]]):
+        self.terms: List[str] = []
+        self.fields: List[str] = []
+        for field, terms in vocabulary.items():
+            for term in terms:
+                self.terms.append(normalize(term))
+                self.fields.append(field)
+        # 語彙の語そのものは照合せずに引く。短い英数字の語はこの表と語単位の一致でのみ引く
+        self.exact = {term: i for i, term in reversed(list(enumerate(self.terms)))}
+        self.short_tokens = {term: i for term, i in self.exact.items() if _is_short_ascii(term)}
+
+        counts = [{} if _is_short_ascii(term) else self._counts(term) for term in self.terms]
+        document_frequency = defaultdict(int)
+        for c in counts:
+            for gram in c:
+                document_frequency[gram] += 1
+        total = len(self.terms)
+        self.idf = {gram: math.log((1 + total) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+
+        self.postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for i, c in enumerate(counts):
+            for gram, weight in self._vector(c).items():
+                self.postings[gram].append((i, weight))
+
+    @staticmethod
+    def _counts(text: str) -> Dict[str, int]:
+        counts = defaultdict(int)
+        for gram in _ngrams(text):
+            counts[gram] += 1
+        return counts
+
+    def _vector(self, counts: Dict[str, int]) -> Dict[str, float]:
+        vector = {gram: n * self.idf[gram] for gram, n in counts.items() if gram in self.idf}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {gram: w / norm for gram, w in vector.items()} if norm else {}
+
+    def nearest(self, text: str) -> Tuple[Optional[str], float, str]:
+        """最も類似する語の (分野, 類似度, 語)"""
+        i = self.exact.get(text)
+        if i is not None:
+            return self.fields[i], 1.0, self.terms[i]
+        scores = defaultdict(float)
+        for gram, weight in self._vector(self._counts(text)).items():
+            for i, term_weight in self.postings.get(gram, ()):
+                scores[i] += weight * term_weight
+        for token in _ASCII_TOKEN.findall(text):
+            i = self.short_tokens.get(token)
+            if i is not None:
+                # 語単位で一致した短い語は、入力のうちその語が占める割合を類似度とする
+                scores[i] = max(scores[i], len(token) / len(text))
+        if not scores:
+            return None, 0.0, ''
+        best = max(scores, key=scores.get)
+        return self.fields[best], min(scores[best], 1.0), self.terms[best]
+
+
+class RelevanceModel:
+    """専攻×職種の関連度モデル"""
+
+    def __init__(self, matrix: Optional[Dict[str, Dict[str, float]]] = None,
+                 pairs: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Args:
+            matrix: 学習済みの関連度行列（専攻の分野 → 職種の分野 → スコア）、Noneは既定値
+            pairs: AIで判定済みの組（'専攻|職種' → AIの回答）
+        """
+        self.majors = _Index(MAJOR_VOCABULARY)
+        self.jobs = _Index(JOB_VOCABULARY)
+        self.matrix = default_matrix()
+        for major_field, row in (matrix or {}).items():
+            for job_field, score in row.items():
+                if major_field in self.matrix and job_field in self.matrix[major_field]:
+                    self.matrix[major_field][job_field] = score
+        self.pairs = pairs or {}
+        self._predict = lru_cache(maxsize=4096)(self._predict_uncached)
+
+    def classify(self, major: str, job: str) -> Tuple[Optional[str], Optional[str], float]:
+        """専攻・職種の分野と確信度（2つの類似度の小さい方）"""
+        major_field, major_similarity, _ = self.majors.nearest(normalize(major))
+        job_field, job_similarity, _ = self.jobs.nearest(normalize(job))
+        return major_field, job_field, min(major_similarity, job_similarity)
+
+    def predict(self, major: str, job: str) -> Dict[str, Any]:
+        """
+        関連性を判定
+
+        Returns:
+            analyze_major_relevance() と同じ形式に confidence・source を加えた辞書
+        """
+        return dict(self._predict(normalize(major), normalize(job)))
+
+    def _predict_uncached(self, major: str, job: str) -> Dict[str, Any]:
+        learned = self.pairs.get(f'{major}|{job}')
+        if learned:
+            return {**learned, 'confidence': 1.0, 'source': 'learned'}
+
+        major_field, job_field, confidence = self.classify(major, job)
+        if major_field is None or job_field is None:
+            return {
+                'score': 50, 'level': '不明', 'confidence': 0.0, 'source': 'local',
+                'reason': '専攻または職種を判定できませんでした',
+                'recommendation': '専攻と職種の関連性を手動で確認してください',
+            }
+
+        score = int(round(self.matrix[major_field][job_field]))
+        level = relevance_level(score)
+        if level == '低い':
+            recommendation = '専攻と業務の関連性を説明する資料（履修科目・職務内容の詳細）を準備してください'
+        else:
+            recommendation = '履修科目と業務内容の対応を申請書類で具体的に示してください'
+        return {
+            'score': score,
+            'level': level,
+            'reason': f'専攻は{FIELD_NAMES[major_field]}分野、職種は{FIELD_NAMES[job_field]}分野として判定',
+            'recommendation': recommendation,
+            'confidence': round(confidence, 3),
+            'source': 'local',
+        }
+
+    def is_confident(self, prediction: Dict[str, Any]) -> bool:
+        return prediction['confidence'] >= settings.RELEVANCE_MIN_CONFIDENCE
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'matrix': self.matrix, 'pairs': self.pairs}
+
+
+def default_matrix() -> Dict[str, Dict[str, float]]:
+    """語彙の分野定義から作る既定の関連度行列"""
+    return {
+        major_field: {
+            job_field: (
+                DIRECT_RELEVANCE if major_field == job_field
+                else RELATED_RELEVANCE if job_field in RELATED_FIELDS[major_field]
+                else DEFAULT_RELEVANCE
+            )
+            for job_field in JOB_VOCABULARY
+        }
+        for major_field in MAJOR_VOCABULARY
+    }
+
+
+def train(examples: List[Tuple[str, str, Dict[str, Any]]], min_confidence: float) -> RelevanceModel:
+    """
+    AIの回答から学習
+
+    Args:
+        examples: (専攻, 職種, analyze_major_relevance()の回答) のリスト
+        min_confidence: 関連度行列の更新に使う分類の確信度の下限
+
+    Returns:
+        判定済みの組を記憶し、分野ごとの平均スコアで関連度行列を補正したモデル
+    """
+    base = RelevanceModel()
+    sums = defaultdict(float)
+    counts = defaultdict(int)
+    pairs = {}
+    for major, job, answer in examples:
+        if not isinstance(answer.get('score'), (int, float)) or answer.get('level') == '不明':
+            continue
+        key = f'{normalize(major)}|{normalize(job)}'
+        pairs[key] = {
+            'score': int(answer['score']),
+            'level': answer.get('level') or relevance_level(int(answer['score'])),
+            'reason': answer.get('reason', ''),
+            'recommendation': answer.get('recommendation', ''),
+        }
+        major_field, job_field, confidence = base.classify(major, job)
+        if major_field and job_field and confidence >= min_confidence:
+            sums[major_field, job_field] += answer['score']
+            counts[major_field, job_field] += 1
+
+    matrix = default_matrix()
+    for (major_field, job_field), n in counts.items():
+        prior = matrix[major_field][job_field]
+        matrix[major_field][job_field] = round((prior * PRIOR_WEIGHT + sums[major_field, job_field]) / (PRIOR_WEIGHT + n), 1)
+    return RelevanceModel(matrix, pairs)
+
+
+_lock = threading.Lock()
+_model: Optional[RelevanceModel] = None
+
+
+def get_model() -> RelevanceModel:
+    """学習済みモデル（RELEVANCE_MODEL_PATH、なければ既定の語彙のみ）をプロセス内で共有"""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _model = load(settings.RELEVANCE_MODEL_PATH)
+    return _model
+
+
+def load(path: str) -> RelevanceModel:
+    if not os.path.exists(path):
+        return RelevanceModel()
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return RelevanceModel(data.get('matrix'), data.get('pairs'))
+
+
+def save(model: RelevanceModel, path: str) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(model.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,440 @@
+"""
+ルールセット - 在留資格・要件・必要書類のメモリ内スナップショット
+
+賃金の参照値（wages.WageTable）も含む。
+管理画面での編集（シグナル）またはTTL経過で再構築される。
+構築したルールセットは共有キャッシュ（settings.RULESET_CACHE）にも載せ、
+他のワーカー・再起動後のプロセスはDBから構築せずにキャッシュから読み込む。
+賃金表は統計の全件で数MBになりmemcachedの項目の上限（1MB）を超えるため、
+ルールセットの共有エントリにはダイジェストだけを持たせ、表はダイジェストごとの別キーに載せる
+（載せられなければプロセスごとにDBから一度だけ読み込む）。
+バージョンは内容のハッシュであり、カタログAPIのETagとして使用する。
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import serialization, vocabulary, wages
+from .models import VisaCategory, VisaRequirement, IndustryVisaMapping, DocumentTemplate, WageReference
+
+
+# 要件種別ごとに判定が参照する申請者情報のキー（logic._check_requirement と対応）
+REQUIREMENT_DEPENDENCIES = {
+    'education': frozenset({'education', 'job_details'}),
+    'experience': frozenset({'experience'}),
+    'salary': frozenset({'salary'}),
+    'qualification': frozenset({'qualifications'}),
+    'company': frozenset({'company_info'}),
+}
+# 「日本人と同等以上」の報酬要件は業種・職種・勤務地・経験年数に応じた賃金の参照値と比較する
+EQUIVALENT_SALARY_DEPENDENCIES = frozenset({'salary', 'experience', 'job_details', 'company_info'})
+HSP_POINTS_DEPENDENCIES = frozenset({
+    'education', 'experience', 'salary', 'annual_salary', 'age', 'qualifications', 'research_achievements',
+})
+
+
+def requirement_dependencies(requirement_type: str, condition: str) -> FrozenSet[str]:
+    """要件の判定結果が依存する申請者情報のキー"""
+    if requirement_type == 'salary' and wages.is_equivalent_condition(condition):
+        return EQUIVALENT_SALARY_DEPENDENCIES
+    if requirement_type in REQUIREMENT_DEPENDENCIES:
+        return REQUIREMENT_DEPENDENCIES[requirement_type]
+    if 'ポイント' in condition:
+        return HSP_POINTS_DEPENDENCIES
+    return frozenset()
+
+
+def compile_predicate(requirement_type: str, condition: str) -> Tuple[Any, ...]:
+    """
+    要件の正規化した判定条件（述語）
+
+    logic._check_requirement の判定結果（充足・理由）は要件種別と文言から取り出した
+    基準（学位・年数・金額・日本語能力のレベルなど）だけで決まるため、文言が異なっても
+    述語が同じ要件は同じ判定になる。ルールセットは述語ごとに1つの要件にまとめ、
+    診断では申請者ごとに1回だけ判定する。文言の解析は構築時に一度だけ行う。
+    """
+    if requirement_type == 'education':
+        terms = vocabulary.parse_condition(condition)
+        rank = vocabulary.degree_rank(terms.degree) if terms.degree else None
+        return ('education', rank, '関連' in condition or '専攻' in condition)
+    if requirement_type == 'experience':
+        years = re.search(r'(\d+)年', condition)
+        return ('experience', int(years.group(1)) if years else None)
+    if requirement_type == 'salary':
+        if wages.is_equivalent_condition(condition):
+            return ('salary', 'equivalent')
+        amount = re.search(r'(\d+)万円', condition)
+        if amount:
+            return ('salary', 'annual' if '年収' in condition else 'monthly', int(amount.group(1)) * 10000)
+        return ('salary', None)
+    if requirement_type == 'qualification':
+        terms = vocabulary.parse_condition(condition)
+        if terms.jlpt_level:
+            return ('qualification', 'jlpt', terms.jlpt_level, terms.accepts_jft)
+        return ('qualification', 'skill_test' if terms.skill_test else None)
+    if requirement_type == 'company':
+        return ('company',)
+    if 'ポイント' in condition:
+        return ('hsp_points',)
+    return ('manual',)  # 手動確認（充足にならない）
+
+
+@dataclass(frozen=True)
+class CompiledRequirement:
+    """要件（VisaRequirementと同じ属性名で参照可能）"""
+    id: int
+    requirement_type: str
+    type_display: str
+    condition: str
+    is_mandatory: bool
+    alternative_condition: str
+    alternative_ok: bool
+    display_order: int
+    depends_on: FrozenSet[str] = frozenset()
+    predicate: Tuple[Any, ...] = ('manual',)  # compile_predicate の結果
+
+    @property
+    def weight(self) -> int:
+        return 20 if self.is_mandatory else 10
+
+    def get_requirement_type_display(self) -> str:
+        return self.type_display
+
+
+@dataclass(frozen=True)
+class CompiledVisa:
+    """在留資格と付随する要件・必要書類"""
+    id: int
+    code: str
+    name_ja: str
+    name_en: str
+    category_type: str
+    category_type_display: str
+    description: str
+    priority: int
+    requirements: Tuple[CompiledRequirement, ...]
+    documents: Tuple[Dict[str, Any], ...]
+
+    @property
+    def category_summary(self) -> Dict[str, Any]:
+        """診断結果の各候補に含める在留資格の情報"""
+        return {
+            'id': self.id,
+            'code': self.code,
+            'name_ja': self.name_ja,
+            'name_en': self.name_en,
+            'description': self.description,
+        }
+
+    @cached_property
+    def max_score(self) -> int:
+        """要件の配点の合計"""
+        return sum(req.weight for req in self.requirements)
+
+    @property
+    def mandatory_documents(self) -> List[Dict[str, str]]:
+        return [
+            {'name': doc['name'], 'description': doc['description'], 'url': doc['url']}
+            for doc in self.documents if doc['is_mandatory']
+        ]
+
+
+@dataclass(frozen=True)
+class CompiledMapping:
+    """業種・職種マッピング"""
+    industry: str
+    job_category: str
+    visa_category_id: int
+    match_score: int
+
+
+class Ruleset:
+    """有効な在留資格の不変スナップショット"""
+
+    def __init__(self, visas: List[CompiledVisa], mappings: List[CompiledMapping],
+                 wage_table: Optional[wages.WageTable] = None):
+        self.visas = tuple(visas)
+        self.mappings = tuple(mappings)
+        self._wages = wage_table if wage_table is not None else wages.WageTable()
+        self.wages_digest = self._wages.digest
+        self.by_id = {visa.id: visa for visa in self.visas}
+        self.by_code = {visa.code: visa for visa in self.visas}
+        # 述語ごとの代表の要件と、在留資格ごとの要件の述語番号（要件×在留資格の対応表）
+        index: Dict[Tuple[Any, ...], int] = {}
+        predicates: List[CompiledRequirement] = []
+        self.incidence: Dict[int, Tuple[int, ...]] = {}
+        for visa in self.visas:
+            for req in visa.requirements:
+                if req.predicate not in index:
+                    index[req.predicate] = len(predicates)
+                    predicates.append(req)
+            self.incidence[visa.id] = tuple(index[req.predicate] for req in visa.requirements)
+        self.predicates = tuple(predicates)
+        # 業種・職種の照合キー（candidates_by_job で毎回casefoldしない）
+        self._mapping_keys = tuple(
+            (m.industry.casefold(), m.job_category.casefold(), m.visa_category_id) for m in self.mappings
+        )
+
+        # カタログは構築時に一度だけシリアライズする
+        entries = [self._catalog_entry(visa) for visa in self.visas]
+        canonical = json.dumps(
+            {'visas': entries, 'mappings': [m.__dict__ for m in self.mappings]},
+            ensure_ascii=False, sort_keys=True, separators=(',', ':'),
+        )
+        digest = hashlib.sha256(canonical.encode('utf-8'))
+        if self.wages_digest:
+            # 賃金の参照値はカタログに含めないが、判定結果が変わるためバージョンに反映する
+            digest.update(self.wages_digest.encode('ascii'))
+        self.version = digest.hexdigest()[:20]
+        self.catalog_json = self._dumps({'version': self.version, 'visas': entries})
+        self.catalog_detail_json = {
+            entry['code']: self._dumps({'version': self.version, 'visa': entry})
+            for entry in entries
+        }
+        # 診断結果のうちルールセットで決まる部分（serialization.result_payload で埋め込む）
+        self.result_fragments = {
+            visa.code: {
+                'visa_category': serialization.dumps(visa.category_summary),
+                'required_documents': serialization.dumps(visa.mandatory_documents),
+            }
+            for visa in self.visas
+        }
+
+    @property
+    def wages(self) -> wages.WageTable:
+        """賃金表（共有キャッシュから読み込んだルールセットでは初回参照時に取得）"""
+        if self._wages is None:
+            self._wages = _load_wage_table(self.wages_digest)
+        return self._wages
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # 賃金表はダイジェストごとの別キーで共有する（ルールセットのエントリには含めない）
+        state = self.__dict__.copy()
+        state['_wages'] = None
+        return state
+
+    @staticmethod
+    def _dumps(data: Dict[str, Any]) -> bytes:
+        return serialization.dumps(data)
+
+    @staticmethod
+    def _catalog_entry(visa: CompiledVisa) -> Dict[str, Any]:
+        return {
+            'code': visa.code,
+            'name_ja': visa.name_ja,
+            'name_en': visa.name_en,
+            'category_type': visa.category_type,
+            'category_type_display': visa.category_type_display,
+            'description': visa.description,
+            'priority': visa.priority,
+            'requirements': [
+                {
+                    'type': req.requirement_type,
+                    'type_display': req.type_display,
+                    'condition': req.condition,
+                    'is_mandatory': req.is_mandatory,
+                    'alternative_condition': req.alternative_condition,
+                    'alternative_ok': req.alternative_ok,
+                }
+                for req in visa.requirements
+            ],
+            'documents': [dict(doc) for doc in visa.documents],
+        }
+
+    def candidates_by_job(self, industry: str, position: str) -> List[int]:
+        """業種・職種に部分一致するマッピングの在留資格ID（icontains相当）"""
+        industry = industry.casefold()
+        position = position.casefold()
+        ids = []
+        for industry_key, job_key, visa_id in self._mapping_keys:
+            if industry in industry_key or position in job_key:
+                if visa_id not in ids:
+                    ids.append(visa_id)
+        return ids
+
+
+def build_ruleset() -> Ruleset:
+    """データベースからルールセットを構築"""
+    categories = list(VisaCategory.objects.filter(is_active=True).order_by('priority', 'code'))
+    category_ids = [c.id for c in categories]
+
+    requirements: Dict[int, List[CompiledRequirement]] = {cid: [] for cid in category_ids}
+    for req in VisaRequirement.objects.filter(visa_category_id__in=category_ids):
+        requirements[req.visa_category_id].append(CompiledRequirement(
+            id=req.id,
+            requirement_type=req.requirement_type,
+            type_display=req.get_requirement_type_display(),
+            condition=req.condition,
+            is_mandatory=req.is_mandatory,
+            alternative_condition=req.alternative_condition,
+            alternative_ok=req.alternative_ok,
+            display_order=req.display_order,
+            depends_on=requirement_dependencies(req.requirement_type, req.condition),
+            predicate=compile_predicate(req.requirement_type, req.condition),
+        ))
+
+    documents: Dict[int, List[Dict[str, Any]]] = {cid: [] for cid in category_ids}
+    for doc in DocumentTemplate.objects.filter(visa_category_id__in=category_ids).order_by('display_order', 'id'):
+        documents[doc.visa_category_id].append({
+            'name': doc.document_name,
+            'description': doc.description,
+            'url': doc.url,
+            'is_mandatory': doc.is_mandatory,
+        })
+
+    visas = [
+        CompiledVisa(
+            id=c.id,
+            code=c.code,
+            name_ja=c.name_ja,
+            name_en=c.name_en,
+            category_type=c.category_type,
+            category_type_display=c.get_category_type_display(),
+            description=c.description,
+            priority=c.priority,
+            requirements=tuple(requirements[c.id]),
+            documents=tuple(documents[c.id]),
+        )
+        for c in categories
+    ]
+
+    mappings = [
+        CompiledMapping(
+            industry=m.industry,
+            job_category=m.job_category,
+            visa_category_id=m.visa_category_id,
+            match_score=m.match_score,
+        )
+        for m in IndustryVisaMapping.objects.filter(visa_category_id__in=category_ids)
+    ]
+
+    return Ruleset(visas, mappings, build_wage_table())
+
+
+def build_wage_table() -> wages.WageTable:
+    """DBから賃金表を構築"""
+    return wages.WageTable(
+        WageReference.objects.values_list(*wages.FIELDS).order_by().iterator(chunk_size=10000)
+    )
+
+
+# 共有キャッシュのキー（Ruleset・Compiled*の属性を変更したら番号を上げる）
+CACHE_KEY = 'ruleset:v5'
+WAGES_CACHE_KEY = 'wages:v1:{digest}'
+
+_lock = threading.Lock()
+_ruleset: Optional[Ruleset] = None
+_built_at = 0.0
+_wage_lock = threading.Lock()
+_wage_table: Optional[wages.WageTable] = None  # このプロセスで読み込んだ最新の賃金表
+
+
+def _load_wage_table(digest: str) -> wages.WageTable:
+    """
+    ダイジェストに対応する賃金表を取得
+
+    プロセス内の表 → 共有キャッシュ → DB の順に探す。
+    DBの表がダイジェストと異なる（構築後に取り込みがあった）場合もDBの表を使う
+    （取り込み時にルールセットは破棄されるため、次の再構築で揃う）。
+    """
+    global _wage_table
+    if not digest:
+        return wages.WageTable()
+    with _wage_lock:
+        table = _wage_table
+        if table is not None and table.digest == digest:
+            return table
+        try:
+            table = caches[settings.RULESET_CACHE].get(WAGES_CACHE_KEY.format(digest=digest))
+        except Exception as e:
+            print(f"警告: 賃金表のキャッシュを読み込めませんでした: {e}")
+            table = None
+        if table is None:
+            table = build_wage_table()
+            if table.digest == digest:
+                _store_wage_table(table)
+        _wage_table = table
+        return table
+
+
+def _store_wage_table(table: wages.WageTable) -> None:
+    if not table.digest:
+        return
+    try:
+        # 項目の上限を超えるとバックエンドによっては例外にならず保存されないだけなので、
+        # 読み込み側はDBからの構築に戻る
+        caches[settings.RULESET_CACHE].set(
+            WAGES_CACHE_KEY.format(digest=table.digest), table,
+            getattr(settings, 'RULESET_SHARED_CACHE_TTL', 86400),
+        )
+    except Exception as e:
+        print(f"警告: 賃金表をキャッシュに保存できませんでした: {e}")
+
+
+def _load_shared() -> Optional[Ruleset]:
+    """共有キャッシュのルールセット（読み込めなければNone）"""
+    try:
+        return caches[settings.RULESET_CACHE].get(CACHE_KEY)
+    except Exception as e:
+        print(f"警告: ルールセットのキャッシュを読み込めませんでした: {e}")
+        return None
+
+
+def _store_shared(ruleset: Ruleset) -> None:
+    _store_wage_table(ruleset.wages)
+    try:
+        caches[settings.RULESET_CACHE].set(CACHE_KEY, ruleset, getattr(settings, 'RULESET_SHARED_CACHE_TTL', 86400))
+    except Exception as e:
+        print(f"警告: ルールセットをキャッシュに保存できませんでした: {e}")
+
+
+def get_ruleset() -> Ruleset:
+    """
+    現在のルールセットを取得
+
+    他のワーカーでの編集はシグナルが届かないため、
+    RULESET_CACHE_TTL秒ごとに共有キャッシュ（なければDB）から読み直す。
+    """
+    global _ruleset, _built_at
+    ttl = getattr(settings, 'RULESET_CACHE_TTL', 300)
+    ruleset = _ruleset
+    if ruleset is not None and time.monotonic() - _built_at < ttl:
+        return ruleset
+
+    with _lock:
+        if _ruleset is None or time.monotonic() - _built_at >= ttl:
+            ruleset = _load_shared()
+            if ruleset is None:
+                ruleset = build_ruleset()
+                _store_shared(ruleset)
+            _ruleset = ruleset
+            _built_at = time.monotonic()
+        return _ruleset
+
+
+def warm_ruleset() -> Ruleset:
+    """DBからルールセットを構築し直して共有キャッシュに載せる（warm_cachesコマンド用）"""
+    global _ruleset, _built_at
+    with _lock:
+        _ruleset = build_ruleset()
+        _built_at = time.monotonic()
+        _store_shared(_ruleset)
+        return _ruleset
+
+
+def invalidate_ruleset(**kwargs) -> None:
+    """ルールセットを破棄（次回アクセス時にDBから再構築）"""
+    global _ruleset
+    _ruleset = None
+    try:
+        caches[settings.RULESET_CACHE].delete(CACHE_KEY)
+    except Exception as e:
+        print(f"警告: ルールセットのキャッシュを削除できませんでした: {e}")
@@ -0,0 +1,224 @@
+"""
+診断セッションの全文検索・ファセット検索
+
+申請者情報と診断結果から検索用ドキュメント（SessionSearchDocument）を作成し、
+本文はバックエンドの全文検索（SQLite: FTS5 / PostgreSQL: tsvector）で索引する。
+日本語は分かち書きせず、全角文字の連続をbigramに分割して空白区切りで格納する。
+"""
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db import connection
+from django.db.models import Count, QuerySet
+from django.db.models.expressions import RawSQL
+
+from . import vocabulary
+from .models import DiagnosisSession, SessionSearchDocument
+
+# ファセットとして絞り込み・集計できる項目（クエリパラメータ → フィールド）
+FACETS = {
+    'status': 'status',
+    'nationality': 'nationality',
+    'industry': 'industry',
+    'position': 'position',
+    'jlpt': 'jlpt_level',
+    'visa': 'top_visa_code',
+}
+FACET_LIMIT = 20
+
+_RUN_PATTERN = re.compile(r'\w+')
+
+_UPDATE_FIELDS = [
+    'status', 'nationality', 'industry', 'position', 'jlpt_level',
+    'top_visa_code', 'top_score', 'created_at', 'body',
+]
+
+
+def _is_wide(char: str) -> bool:
+    return unicodedata.east_asian_width(char) in ('W', 'F')
+
+
+def _runs(text: str) -> List[tuple]:
+    """正規化したテキストを (全角か, 文字列) の連続に分割"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    runs = []
+    for match in _RUN_PATTERN.finditer(text):
+        word = match.group()
+        start = 0
+        for i in range(1, len(word) + 1):
+            if i == len(word) or _is_wide(word[i]) != _is_wide(word[start]):
+                runs.append((_is_wide(word[start]), word[start:i]))
+                start = i
+    return runs
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    索引用のトークン列
+
+    全角の連続はbigram（末尾の1文字も加え、1文字検索に前方一致で応じる）、
+    半角の連続は単語のまま。
+    """
+    tokens = []
+    for wide, run in _runs(text):
+        if not wide:
+            tokens.append(run)
+            continue
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+    return tokens
+
+
+def query_phrases(text: str) -> List[List[str]]:
+    """検索語を、連続して出現すべきトークンの組（フレーズ）に分割"""
+    phrases = []
+    for wide, run in _runs(text):
+        if wide and len(run) > 1:
+            phrases.append([run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            phrases.append([run])
+    return phrases
+
+
+def jlpt_level(qualifications: Iterable[str]) -> str:
+    """資格から日本語能力試験の最上位レベル（例: 'N2'）を抽出"""
+    return vocabulary.parse_qualifications(qualifications).jlpt_label
+
+
+def build_document(session: DiagnosisSession) -> SessionSearchDocument:
+    """診断セッションから検索用ドキュメントを作成"""
+    applicant = session.applicant_data or {}
+    result = session.diagnosis_result or {}
+    education = applicant.get('education') or {}
+    job = applicant.get('job_details') or {}
+    qualifications = applicant.get('qualifications') or []
+    # detail=minimal の結果はtop_recommendationsを持たないため、スコア順のall_optionsの先頭で代用
+    recommendations = (result.get('top_recommendations') or result.get('all_options') or [])[:3]
+    top = recommendations[0] if recommendations else None
+
+    fields = [
+        session.session_id,
+        applicant.get('nationality', ''),
+        education.get('degree', ''),
+        education.get('major', ''),
+        education.get('university', ''),
+        *(exp.get('field', '') for exp in applicant.get('experience') or []),
+        *qualifications,
+        job.get('industry', ''),
+        job.get('position', ''),
+        job.get('duties', ''),
+        (applicant.get('company_info') or {}).get('name', ''),
+        *(
+            f"{r['visa_category']['code']} {r['visa_category']['name_ja']}"
+            for r in recommendations
+        ),
+    ]
+
+    return SessionSearchDocument(
+        session_id=session.pk,
+        status=session.status,
+        nationality=(applicant.get('nationality') or '')[:100],
+        industry=(job.get('industry') or '')[:100],
+        position=(job.get('position') or '')[:100],
+        jlpt_level=jlpt_level(qualifications),
+        top_visa_code=top['visa_category']['code'] if top else '',
+        top_score=top['match_score'] if top else 0,
+        created_at=session.created_at,
+        body=' '.join(tokenize(' '.join(str(f) for f in fields if f))),
+    )
+
+
+def bulk_index(sessions: Iterable[DiagnosisSession], batch_size: int = 500) -> int:
+    """検索用ドキュメントを一括で作成・更新（全文索引はトリガーで追従）"""
+    documents = [build_document(session) for session in sessions]
+    SessionSearchDocument.objects.bulk_create(
+        documents,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['session'],
+        update_fields=_UPDATE_FIELDS,
+    )
+    return len(documents)
+
+
+def index_session(sender=None, instance: Optional[DiagnosisSession] = None, **kwargs) -> None:
+    """診断セッションの保存時に検索用ドキュメントを更新（post_saveハンドラ）"""
+    if instance is None or kwargs.get('raw'):
+        return
+    bulk_index([instance])
+
+
+def _fulltext_matches(text: str) -> Optional[RawSQL]:
+    """
+    バックエンドに応じた全文検索の副問い合わせ（一致するセッションの主キー）
+
+    外側のテーブルを参照しないため、管理画面の検索のように入れ子にしても使える。
+    検索語がない、または全文索引のないバックエンドではNone。
+    """
+    phrases = query_phrases(text)
+    if not phrases:
+        return None
+
+    if connection.vendor == 'sqlite':
+        terms = []
+        for phrase in phrases:
+            quoted = '"' + ' '.join(phrase) + '"'
+            # 全角1文字はbigramの先頭に前方一致させる
+            terms.append(quoted + '*' if len(phrase) == 1 and _is_wide(phrase[0][0]) else quoted)
+        return RawSQL(
+            'SELECT rowid FROM session_search_fts WHERE session_search_fts MATCH %s',
+            [' AND '.join(terms)],
+        )
+
+    if connection.vendor == 'postgresql':
+        terms = []
+        for phrase in phrases:
+            term = ' <-> '.join(phrase)
+            terms.append(f'{term}:*' if len(phrase) == 1 and _is_wide(phrase[0][0]) else f'({term})')
+        return RawSQL(
+            "SELECT session_id FROM session_search_documents"
+            " WHERE to_tsvector('simple', body) @@ to_tsquery('simple', %s)",
+            [' & '.join(terms)],
+        )
+
+    return None
+
+
+def search_documents(text: str = '', filters: Optional[Dict[str, str]] = None) -> QuerySet:
+    """
+    検索用ドキュメントを全文検索とファセットで絞り込む
+
+    Args:
+        text: 検索語（空白区切りはAND）
+        filters: ファセットの完全一致条件（FACETSのキー → 値）
+
+    Returns:
+        作成日時の降順のQuerySet
+    """
+    queryset = SessionSearchDocument.objects.all()
+    for key, value in (filters or {}).items():
+        if key in FACETS and value:
+            queryset = queryset.filter(**{FACETS[key]: value})
+
+    matches = _fulltext_matches(text)
+    if matches is not None:
+        queryset = queryset.filter(session_id__in=matches)
+    elif query_phrases(text):
+        # 全文索引のないバックエンドでは部分一致で代用
+        for phrase in query_phrases(text):
+            queryset = queryset.filter(body__contains=' '.join(phrase))
+    return queryset.order_by('-created_at')
+
+
+def facet_counts(queryset: QuerySet, limit: int = FACET_LIMIT) -> Dict[str, List[Dict[str, Any]]]:
+    """絞り込み結果のファセットごとの件数（多い順）"""
+    counts = {}
+    for key, field in FACETS.items():
+        rows = (
+            queryset.order_by().values(field)
+            .annotate(count=Count('pk'))
+            .order_by('-count', field)[:limit]
+        )
+        counts[key] = [{'value': row[field], 'count': row['count']} for row in rows]
+    return counts
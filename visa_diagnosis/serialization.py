@@ -0,0 +1,108 @@
+"""
+JSONシリアライズ - 高速なエンコーダ（orjson）があれば使い、なければ標準ライブラリで代用
+
+診断結果のうち在留資格の情報・必要書類はルールセットごとに不変のため、
+標準ライブラリでエンコードする場合はルールセット構築時にシリアライズしたバイト列
+（Fragment）をそのまま埋め込む。orjsonは結果全体を一度にエンコードする方が速い。
+"""
+import json
+import secrets
+from typing import Any, Dict, List, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = DjangoJSONEncoder()
+
+
+class Fragment:
+    """シリアライズ済みのJSON（出力にそのまま埋め込む）"""
+    __slots__ = ('data',)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+def dumps(data: Any) -> bytes:
+    """
+    UTF-8のJSON（非ASCII文字はエスケープしない）
+
+    Fragmentを含む場合は目印の文字列（NUL＋呼び出しごとの乱数＋番号）に置き換えて
+    エンコードし、最後に1回の走査で差し込む。JSON文字列中のNULは必ず \u0000 に
+    エスケープされ、乱数を含むため入力データの文字列と取り違えることはない。
+    """
+    fragments: List[bytes] = []
+    nonce = secrets.token_hex(4)
+
+    def default(obj: Any) -> Any:
+        if isinstance(obj, Fragment):
+            fragments.append(obj.data)
+            return f'\x00{nonce}:{len(fragments) - 1}'
+        return _encoder.default(obj)
+
+    if orjson is not None:
+        # 日時はDjangoJSONEncoderに任せ、標準ライブラリの場合と同じ表記にする
+        encoded = orjson.dumps(data, default=default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    else:
+        encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+    if not fragments:
+        return encoded
+    pieces = encoded.split(b'"\\u0000' + nonce.encode('ascii') + b':')
+    out = [pieces[0]]
+    for piece in pieces[1:]:
+        index, _, rest = piece.partition(b'"')
+        out.append(fragments[int(index)])
+        out.append(rest)
+    return b''.join(out)
+
+
+def result_payload(result: Dict[str, Any], fragments: Dict[str, Dict[str, bytes]]) -> Dict[str, Any]:
+    """
+    診断結果をレスポンス用に組み替えたもの（元の結果は変更しない）
+
+    Args:
+        result: 診断結果
+        fragments: ルールセットのシリアライズ済みの部品（Ruleset.result_fragments）
+
+    各候補の在留資格・必要書類はルールセットの部品に置き換え、
+    top_recommendationsとall_optionsで共有している候補は1回だけシリアライズする。
+    """
+    encoded: Dict[int, Fragment] = {}
+
+    def option(item: Dict[str, Any]) -> Any:
+        if id(item) in encoded:
+            return encoded[id(item)]
+        parts = fragments.get((item.get('visa_category') or {}).get('code'))
+        if parts is None:
+            return item
+        static = {key: Fragment(data) for key, data in parts.items() if key in item}
+        encoded[id(item)] = Fragment(dumps({**item, **static}))
+        return encoded[id(item)]
+
+    payload = dict(result)
+    for key in ('top_recommendations', 'all_options'):
+        if isinstance(payload.get(key), list):
+            payload[key] = [option(item) for item in payload[key]]
+    return payload
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    dumps()でシリアライズするJSONレスポンス（JsonResponseと同じ使い方）
+
+    Args:
+        fragments: 診断結果の場合はルールセットのシリアライズ済みの部品（標準ライブラリ使用時のみ利用）
+    """
+
+    def __init__(self, data: Any, fragments: Optional[Dict[str, Dict[str, bytes]]] = None, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        if fragments is not None and orjson is None:
+            data = result_payload(data, fragments)
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,117 @@
+"""
+診断セッションの読み出し - セッションIDをキーにした読み込み時キャッシュ（read-through）
+
+保存済みの診断結果を返すだけで、診断エンジンは実行しない。
+完了したセッションの結果は再計算（rescore_sessions）以外では変わらないため
+キャッシュに載せ、保存・削除・再計算の時点でキャッシュから消す。
+進行中などのセッションは変わり得るため、キャッシュせず毎回DBから読む。
+"""
+import hashlib
+import re
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import DiagnosisSession
+
+CACHE_PREFIX = 'session:'
+# セッションIDとして受け付ける文字列（キャッシュキーに使えない文字・長さを除外）
+_SESSION_ID_PATTERN = re.compile(r'[\w-]{1,100}', re.ASCII)
+
+_FIELDS = ('session_id', 'status', 'diagnosis_result', 'ruleset_version', 'created_at', 'updated_at')
+
+
+def _cache():
+    return caches[settings.SESSION_RESULT_CACHE]
+
+
+def _key(session_id: str) -> str:
+    return CACHE_PREFIX + session_id
+
+
+def ai_status(diagnosis_result: Dict[str, Any]) -> str:
+    """
+    AI分析の状態
+
+    Returns:
+        not_requested（detail・fieldsで除外された）/ disabled（AI機能が無効）/
+        failed（AI分析でエラー）/ completed
+    """
+    ai_analysis = diagnosis_result.get('ai_analysis')
+    if not ai_analysis:
+        return 'not_requested'
+    if not ai_analysis.get('enabled'):
+        return 'disabled'
+    if ai_analysis.get('error'):
+        return 'failed'
+    return 'completed'
+
+
+def _entry(row: Dict[str, Any]) -> Dict[str, Any]:
+    """DBの行からキャッシュに載せるエントリを作成"""
+    result = row['diagnosis_result'] or {}
+    version = f'{row["session_id"]}:{row["updated_at"].isoformat()}:{row["ruleset_version"]}'
+    return {
+        'status': row['status'],
+        'etag': '"' + hashlib.sha1(version.encode('utf-8')).hexdigest()[:20] + '"',
+        'payload': {
+            'session_id': row['session_id'],
+            'status': row['status'],
+            'ruleset_version': row['ruleset_version'],
+            'created_at': row['created_at'].isoformat(),
+            'updated_at': row['updated_at'].isoformat(),
+            'ai_status': ai_status(result),
+            'diagnosis_result': result,
+        },
+    }
+
+
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    保存済みの診断セッション（キャッシュになければDBから読んでキャッシュに載せる）
+
+    Returns:
+        {'status', 'etag', 'payload'}。存在しなければNone
+    """
+    if not _SESSION_ID_PATTERN.fullmatch(session_id):
+        return None
+    cache = _cache()
+    entry = cache.get(_key(session_id))
+    if entry is not None:
+        return entry
+
+    row = DiagnosisSession.objects.filter(session_id=session_id).values(*_FIELDS).first()
+    if row is None:
+        return None
+    entry = _entry(row)
+    if entry['status'] == 'completed':
+        cache.set(_key(session_id), entry, settings.SESSION_RESULT_CACHE_TTL)
+    return entry
+
+
+def invalidate(session_ids: Iterable[str]) -> None:
+    """セッションのキャッシュを削除"""
+    keys = [_key(session_id) for session_id in session_ids]
+    if keys:
+        _cache().delete_many(keys)
+
+
+def invalidate_session(sender=None, instance: Optional[DiagnosisSession] = None, **kwargs) -> None:
+    """診断セッションの保存・削除時にキャッシュを削除（post_save・post_deleteハンドラ）"""
+    if instance is None or kwargs.get('raw'):
+        return
+    invalidate([instance.session_id])
+
+
+def cache_control(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    レスポンスのCache-Control（django.utils.cache.patch_cache_controlの引数）
+
+    完了したセッションは変わらないためimmutableとして一定期間再検証させない。
+    再計算で結果が変わった場合はETagが変わり、期間後の再検証で新しい結果を返す。
+    申請者の個人情報を含むため、いずれも共有キャッシュ（CDN等）には載せない。
+    """
+    if entry['status'] == 'completed':
+        return {'private': True, 'max_age': settings.SESSION_RESULT_MAX_AGE, 'immutable': True}
+    return {'private': True, 'no_cache': True}
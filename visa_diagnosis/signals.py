@@ -0,0 +1,20 @@
+"""
+シグナルハンドラ
+"""
+from django.db.models.signals import post_save, post_delete
+
+from .models import (
+    VisaCategory, VisaRequirement, IndustryVisaMapping, DocumentTemplate, WageReference, DiagnosisSession,
+)
+from .ruleset import invalidate_ruleset
+from .search import index_session
+from .session_store import invalidate_session
+
+
+for _model in (VisaCategory, VisaRequirement, IndustryVisaMapping, DocumentTemplate, WageReference):
+    post_save.connect(invalidate_ruleset, sender=_model, dispatch_uid=f'ruleset_save_{_model.__name__}')
+    post_delete.connect(invalidate_ruleset, sender=_model, dispatch_uid=f'ruleset_delete_{_model.__name__}')
+
+post_save.connect(index_session, sender=DiagnosisSession, dispatch_uid='search_index_session')
+post_save.connect(invalidate_session, sender=DiagnosisSession, dispatch_uid='session_cache_save')
+post_delete.connect(invalidate_session, sender=DiagnosisSession, dispatch_uid='session_cache_delete')
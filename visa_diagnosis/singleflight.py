@@ -0,0 +1,83 @@
+"""
+シングルフライト - 同一キーの同時実行を1回の実行にまとめる
+
+先に到着した呼び出し（リーダー）だけが実際に処理を実行し、
+実行中に同じキーで到着した呼び出しはその結果（または例外）を共有する。
+完了後はキーを破棄するため、結果のキャッシュは行わない。
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """スレッド間で同時実行をまとめる（同期版）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """fnを実行（または実行中の同一キーの結果を待機）"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """実行中のキー数"""
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """イベントループ内で同時実行をまとめる（非同期版）"""
+
+    def __init__(self):
+        self._tasks: Dict[Tuple[int, Hashable], asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        fn()をタスクとして実行（または実行中のタスクを待機）
+
+        待機側がキャンセルされてもリーダーのタスクは継続する。
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(loop_key)
+        if task is not None:
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn())
+        self._tasks[loop_key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(loop_key, None))
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        """実行中のキー数"""
+        return len(self._tasks)
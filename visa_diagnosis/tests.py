@@ -1,3 +1,1515 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import datetime
+import decimal
+import functools
+import gzip
+import io
+import json
+import os
+import pickle
+import random
+import signal
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.utils import timezone
+
+from visa_diagnosis import (
+    ai_integration, cohorts, counterfactual, detail, export, hsp_points, identifiers, loadtest, middleware, relevance, ruleset,
+    search, serialization, session_store, views, vocabulary, wages,
+)
+from visa_diagnosis.ai_integration import VisaAIAnalyzer
+from visa_diagnosis.logic import VisaDiagnosisEngine
+from visa_diagnosis.management.commands import importtime
+from visa_diagnosis.middleware import CompressionMiddleware
+from visa_diagnosis.models import (
+    CohortChunk, DiagnosisSession, RateLimitCounter, VisaCategory, VisaRequirement, WageReference,
+)
+from visa_diagnosis.profile import ApplicantProfile, applicant_data_from_form
+from visa_diagnosis.ruleset import get_ruleset, invalidate_ruleset
+from visa_diagnosis.throttling import RateLimiter, check_rate_limit_store, get_client_id
+from visa_diagnosis.whatif import apply_change
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+APPLICANT = {
+    'nationality': 'ベトナム',
+    'education': {'degree': '学士', 'major': '情報工学'},
+    'experience': [{'years': 3}],
+    'qualifications': ['日本語能力試験N2'],
+    'job_details': {'industry': 'IT・ソフトウェア', 'position': 'システムエンジニア', 'duties': 'Web開発'},
+    'salary': 300000,
+    'company_info': {'name': '株式会社サンプル'},
+}
+
+
+def sample_applicants():
+    """学歴・経験年数・報酬・資格・業種を組み合わせた申請者情報"""
+    jobs = [
+        {'industry': 'IT・ソフトウェア', 'position': 'システムエンジニア'},
+        {'industry': '介護', 'position': '介護職員'},
+        {'industry': '', 'position': ''},
+    ]
+    return [
+        {
+            'age': 28,
+            'education': {'degree': degree, 'major': '情報工学' if degree else ''},
+            'experience': [{'years': years}],
+            'qualifications': qualifications,
+            'job_details': job,
+            'salary': salary,
+            'company_info': {'name': '株式会社サンプル'},
+        }
+        for degree, years, salary, qualifications, job in product(
+            ['修士', '学士', '専門学校', ''],
+            [0, 3, 10],
+            [0, 250000, 500000],
+            [[], ['日本語能力試験N2'], ['特定技能評価試験（介護）', 'JLPT N4']],
+            jobs,
+        )
+    ]
+
+
+class RescoreSessionsCommandTest(TestCase):
+    """rescore_sessionsコマンドによる診断セッションの再計算"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+
+        result = VisaDiagnosisEngine(enable_ai=False).diagnose(APPLICANT)
+        result['ai_analysis'] = {'summary': '以前のAI分析'}
+        self.session = DiagnosisSession.objects.create(
+            session_id='rescore-test',
+            status='completed',
+            applicant_data=APPLICANT,
+            diagnosis_result=result,
+            ruleset_version='old',
+        )
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint = os.path.join(tmp_dir.name, 'checkpoint.json')
+
+    def test_rescore_updates_session(self):
+        previous = self.session.diagnosis_result
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('rescore_sessions', '--workers', '1', '--checkpoint', self.checkpoint, stdout=stdout, stderr=stderr)
+
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertIn('失敗: 0件', stdout.getvalue())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.ruleset_version, get_ruleset().version)
+        # 診断IDとAI分析結果は以前のものを引き継ぐ
+        self.assertEqual(self.session.diagnosis_result['diagnosis_id'], previous['diagnosis_id'])
+        self.assertEqual(self.session.diagnosis_result['ai_analysis'], previous['ai_analysis'])
+        self.assertEqual(
+            self.session.diagnosis_result['top_recommendations'][0]['visa_category']['code'],
+            previous['top_recommendations'][0]['visa_category']['code'],
+        )
+
+    def test_failures_keep_checkpoint_and_exit_with_error(self):
+        DiagnosisSession.objects.filter(pk=self.session.pk).update(applicant_data={'age': 'unknown'})
+
+        with self.assertRaises(CommandError):
+            call_command(
+                'rescore_sessions', '--workers', '1', '--checkpoint', self.checkpoint,
+                stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+
+        with open(self.checkpoint, encoding='utf-8') as f:
+            state = json.load(f)
+        self.assertEqual(state['failed'], 1)
+        self.assertEqual(state['failed_ids'], [self.session.pk])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.ruleset_version, 'old')
+
+
+class RateLimiterTest(SimpleTestCase):
+    """レート制限のカウンタ"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_burst_then_reject(self):
+        limiter = RateLimiter('test', '10/min', 5)
+        results = [limiter.consume('ip:127.0.0.1') for _ in range(6)]
+        self.assertEqual(results[:5], [0.0] * 5)
+        self.assertGreater(results[5], 0)
+        # 別のクライアントは別に数える
+        self.assertEqual(limiter.consume('ip:127.0.0.2'), 0.0)
+
+    def test_concurrent_requests_do_not_exceed_burst(self):
+        limiter = RateLimiter('test', '10/min', 5)
+        with ThreadPoolExecutor(16) as pool:
+            results = list(pool.map(lambda _: limiter.consume('ip:127.0.0.1'), range(50)))
+        self.assertEqual(results.count(0.0), 5)
+
+
+@override_settings(RATE_LIMIT_STORE='db')
+class DatabaseRateLimiterTest(TransactionTestCase):
+    """レート制限のDBのカウンタ（複数のワーカーからの同時リクエスト）"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('メモリ上のSQLiteは同時書き込みを待たないため、--settings=visa_system.test_settings で実行する')
+
+    def test_concurrent_requests_do_not_exceed_burst(self):
+        limiter = RateLimiter('test', '10/min', 5)
+
+        def consume(_):
+            try:
+                return limiter.consume('ip:127.0.0.1')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(consume, range(40)))
+        self.assertEqual(results.count(0.0), 5)
+        self.assertEqual(RateLimitCounter.objects.get().count, 5)
+
+
+class RateLimitStoreCheckTest(SimpleTestCase):
+    """複数プロセスで件数を取りこぼすカウンタの設定はシステムチェックのエラー"""
+
+    def check_ids(self, **overrides):
+        with self.settings(RATE_LIMIT_ENABLED=True, **overrides):
+            return [error.id for error in check_rate_limit_store()]
+
+    def test_file_cache_is_rejected(self):
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.gettempdir()}}
+        self.assertEqual(self.check_ids(CACHES=file_cache, RATE_LIMIT_STORE='cache'), ['visa_diagnosis.E002'])
+        self.assertEqual(self.check_ids(CACHES=file_cache, RATE_LIMIT_STORE='db'), [])
+
+    def test_local_memory_with_several_workers_is_rejected(self):
+        self.assertEqual(self.check_ids(RATE_LIMIT_STORE='cache', WEB_CONCURRENCY=1), [])
+        self.assertEqual(self.check_ids(RATE_LIMIT_STORE='cache', WEB_CONCURRENCY=4), ['visa_diagnosis.E003'])
+
+
+@override_settings(RATE_LIMIT_API_KEYS=frozenset({'registered-key'}), RATE_LIMIT_TRUSTED_PROXIES=0)
+class ClientIdTest(SimpleTestCase):
+    """レート制限のクライアント識別"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_unregistered_api_key_falls_back_to_ip(self):
+        request = self.factory.get('/', HTTP_X_API_KEY='random-value', REMOTE_ADDR='198.51.100.7')
+        self.assertEqual(get_client_id(request), 'ip:198.51.100.7')
+
+    def test_registered_api_key(self):
+        request = self.factory.get('/', HTTP_X_API_KEY='registered-key', REMOTE_ADDR='198.51.100.7')
+        self.assertTrue(get_client_id(request).startswith('key:'))
+
+    def test_forwarded_for_ignored_by_default(self):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='203.0.113.1', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(get_client_id(request), 'ip:10.0.0.1')
+
+    def test_forwarded_for_uses_trusted_proxy_hop(self):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='203.0.113.1, 198.51.100.7', REMOTE_ADDR='10.0.0.1')
+        with self.settings(RATE_LIMIT_TRUSTED_PROXIES=1):
+            self.assertEqual(get_client_id(request), 'ip:198.51.100.7')
+        with self.settings(RATE_LIMIT_TRUSTED_PROXIES=2):
+            self.assertEqual(get_client_id(request), 'ip:203.0.113.1')
+
+
+class WhatIfApiTest(TestCase):
+    """What-if分析APIの入力検証"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+
+    def post(self, **spec):
+        return self.client.post(
+            '/api/what-if/', json.dumps({'applicant': APPLICANT, **spec}), content_type='application/json'
+        )
+
+    def test_bare_qualification_names_are_options(self):
+        response = self.post(qualifications=[[], 'JLPT N1'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['axes']['qualifications'], [[], ['JLPT N1']])
+
+    def test_invalid_qualifications_return_400(self):
+        self.assertEqual(self.post(qualifications='JLPT N1').status_code, 400)
+        self.assertEqual(self.post(qualifications=[[1, 2]]).status_code, 400)
+
+    def test_non_integer_values_return_400(self):
+        self.assertEqual(self.post(salary={'values': [200000, 'abc']}).status_code, 400)
+
+
+class HspPointsTest(SimpleTestCase):
+    """高度専門職ポイントの計算"""
+
+    def test_negative_experience_scores_no_career_points(self):
+        result = hsp_points.score({'experience': [{'years': -1}]})
+        self.assertEqual(result['breakdown']['career'], 0)
+
+    def test_n2_bonus_not_given_to_japan_university_graduates(self):
+        applicant = {'education': {'degree': '修士', 'japan_university': True}, 'qualifications': ['日本語能力試験N2']}
+        self.assertEqual(hsp_points.score(applicant)['breakdown']['bonus'], hsp_points.JAPAN_UNIVERSITY_BONUS)
+        applicant['education']['japan_university'] = False
+        self.assertEqual(hsp_points.score(applicant)['breakdown']['bonus'], hsp_points.JLPT_BONUS['N2'])
+
+    @override_settings(RATE_LIMIT_ENABLED=True)
+    def test_batch_api_is_rate_limited(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        burst = settings.RATE_LIMITS['batch']['burst']
+        statuses = [
+            self.client.post('/api/hsp-points/', '{"candidates": []}', content_type='application/json').status_code
+            for _ in range(burst + 1)
+        ]
+        self.assertEqual(statuses, [200] * burst + [429])
+
+
+class CandidateScoringTest(TestCase):
+    """候補の判定の最適化（述語の共有・上位k件での打ち切り）が全件を個別に判定した結果と一致すること"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        # 要件未設定の在留資格（固定の50点）同士・他の候補との同点を含める
+        for code in ('no_requirements_a', 'no_requirements_b'):
+            VisaCategory.objects.create(code=code, name_ja=code, category_type='work')
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        self.engine = VisaDiagnosisEngine(enable_ai=False)
+        self.profiles = [ApplicantProfile.from_dict(applicant) for applicant in sample_applicants()]
+
+    def test_shared_predicates_match_separate_checks(self):
+        for profile in self.profiles:
+            evaluated = self.engine._new_evaluation()
+            for visa in self.engine.ruleset.visas:
+                shared = self.engine._check_visa(visa, profile, evaluated)
+                separate = [self.engine._check_requirement(req, profile) for req in visa.requirements]
+                self.assertEqual([c['met'] for c in shared], [c['met'] for c in separate], visa.code)
+                self.assertEqual(
+                    self.engine._calculate_match_score(visa, profile, checks=shared)['total_score'],
+                    self.engine._calculate_match_score(visa, profile)['total_score'],
+                    visa.code,
+                )
+
+    def test_top_candidates_match_full_sort(self):
+        ties, compared = 0, set()
+        for profile in self.profiles:
+            visas = self.engine._candidate_visas(profile)
+            full = [
+                (visa.code, score)
+                for visa in visas
+                for score in [self.engine._calculate_match_score(visa, profile)['total_score']]
+                if score > 0
+            ]
+            full.sort(key=lambda item: item[1], reverse=True)
+            ties += len(full) - len({score for _, score in full})
+            for k in (1, 2, 3, 5, len(visas)):
+                top = self.engine._top_candidates(visas, profile, k, True, True, self.engine._new_evaluation())
+                self.assertEqual([(visa.code, score['total_score']) for visa, score in top], full[:k])
+                compared.update(code for code, _ in full[:k])
+        self.assertGreater(ties, 0)
+        self.assertTrue({'no_requirements_a', 'no_requirements_b'} <= compared)
+
+
+def baseline_qualification_met(condition, qualifications):
+    """語彙の導入前の資格要件の判定（文字列の包含による）"""
+    if 'N4' in condition or 'JLPT' in condition:
+        return any('N4' in q or 'N3' in q or 'N2' in q or 'N1' in q for q in qualifications)
+    if '特定技能' in condition and '評価試験' in condition:
+        return any('特定技能' in q or '評価試験' in q for q in qualifications)
+    return bool(qualifications)
+
+
+class VocabularyTest(TestCase):
+    """要件の文言・保有資格の構造化が導入前の判定と一致すること"""
+
+    QUALIFICATIONS = [
+        '特定技能評価試験（介護）', '特定技能1号', '建設分野特定技能評価試験', '技能評価試験合格',
+        '日本語能力試験N2', 'JLPT N4', '普通自動車免許',
+    ]
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        self.conditions = list(VisaRequirement.objects.values_list('condition', flat=True))
+
+    def test_parse_condition_matches_baseline(self):
+        for condition in self.conditions + ['特定技能1号の在留資格', '特定技能評価試験（介護）に合格']:
+            terms = vocabulary.parse_condition(condition)
+            self.assertEqual(terms.skill_test, '特定技能' in condition and '評価試験' in condition, condition)
+            self.assertEqual(terms.jlpt_level is not None, 'N4' in condition or 'JLPT' in condition, condition)
+
+    def test_parse_qualifications_matches_baseline(self):
+        for q in self.QUALIFICATIONS:
+            held = vocabulary.parse_qualifications([q])
+            self.assertEqual(bool(held.skill_tests), '特定技能' in q or '評価試験' in q, q)
+        self.assertEqual(vocabulary.parse_qualifications(['特定技能評価試験（介護）']).skill_tests, ('care',))
+
+    def test_qualification_requirements_match_baseline(self):
+        engine = VisaDiagnosisEngine(enable_ai=False)
+        requirements = [
+            req for visa in engine.ruleset.visas for req in visa.requirements if req.requirement_type == 'qualification'
+        ]
+        self.assertTrue(requirements)
+        for req, applicant in product(requirements, sample_applicants()):
+            profile = ApplicantProfile.from_dict(applicant)
+            self.assertEqual(
+                engine._check_requirement(req, profile)['met'],
+                baseline_qualification_met(req.condition, applicant['qualifications']),
+                (req.condition, applicant['qualifications']),
+            )
+
+
+class RelevanceModelTest(TestCase):
+    """専攻と職種の関連性のオフライン判定"""
+
+    def setUp(self):
+        self.model = relevance.RelevanceModel()
+
+    def test_pinned_predictions(self):
+        for major, job, score in [
+            ('情報工学', 'システムエンジニア', 95),
+            ('Computer Science', 'SE', 95),
+            ('経済学', '営業', 95),
+            ('日本文学', '通訳', 95),
+            ('情報工学', 'Webデザイナー', 70),
+            ('介護福祉', 'システムエンジニア', 25),
+            ('IT', '介護職員', 25),
+        ]:
+            prediction = self.model.predict(major, job)
+            self.assertEqual(prediction['score'], score, (major, job))
+            self.assertTrue(self.model.is_confident(prediction), (major, job))
+
+    def test_short_ascii_terms_need_token_boundary(self):
+        self.assertNotEqual(self.model.jobs.nearest('nurse')[2], 'se')
+        self.assertFalse(self.model.is_confident(self.model.predict('情報工学', 'nurse')))
+        self.assertEqual(self.model.jobs.nearest(relevance.normalize('社内SE'))[2], 'se')
+        self.assertNotEqual(self.model.majors.nearest('suite')[2], 'it')
+
+    def test_unrelated_major_fails_education_requirement(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        engine = VisaDiagnosisEngine(enable_ai=False)
+        engine._relevance_model = self.model
+        requirement = next(
+            req for req in engine.ruleset.by_code['engineer_specialist'].requirements
+            if req.requirement_type == 'education'
+        )
+        for major, met in (('情報工学', True), ('介護福祉', False)):
+            profile = ApplicantProfile.from_dict({
+                **APPLICANT,
+                'education': {'degree': '専門学校', 'major': major},
+                'job_details': {'industry': 'IT・ソフトウェア', 'position': 'システムエンジニア'},
+            })
+            self.assertIs(engine._check_requirement(requirement, profile)['met'], met, major)
+
+
+class FakeMessages:
+    """Messages APIの代わり（呼び出し回数を数え、応答を遅らせる）"""
+
+    def __init__(self, text, delay=0.05):
+        self.text = text
+        self.delay = delay
+        self.calls = 0
+        self.params = []
+        self._lock = threading.Lock()
+
+    def _message(self, params):
+        with self._lock:
+            self.calls += 1
+            self.params.append(params)
+        usage = SimpleNamespace(input_tokens=100, output_tokens=20,
+                                cache_creation_input_tokens=0, cache_read_input_tokens=1500)
+        return SimpleNamespace(usage=usage, content=[SimpleNamespace(text=self.text)])
+
+    def create(self, **params):
+        time.sleep(self.delay)
+        return self._message(params)
+
+    async def acreate(self, **params):
+        await asyncio.sleep(self.delay)
+        return self._message(params)
+
+
+def fake_analyzer(text):
+    analyzer = VisaAIAnalyzer(api_key='test')
+    messages = FakeMessages(text)
+    # beta.prompt_cachingのないSDKと同じく、共通の指示もmessagesで送る
+    analyzer._client = SimpleNamespace(messages=messages, beta=SimpleNamespace())
+    analyzer._async_client = SimpleNamespace(messages=SimpleNamespace(create=messages.acreate), beta=SimpleNamespace())
+    return analyzer, messages
+
+
+class AIResponseCacheTest(SimpleTestCase):
+    """同一プロンプトの同時呼び出し・直後の呼び出しでAPIを1回だけ呼び出すこと"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_concurrent_callers_make_one_call(self):
+        analyzer, messages = fake_analyzer('```json\n{"score": 80}\n```')
+
+        def ask(i):
+            # 共有中・共有の終了直後・キャッシュ保存後に到着する呼び出しを混ぜる
+            time.sleep(i * 0.01)
+            return analyzer._create_message('同じプロンプト', label='テスト')
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(ask, range(16)))
+        self.assertEqual(messages.calls, 1)
+        self.assertEqual(results, [{'score': 80}] * 16)
+
+    def test_concurrent_async_callers_make_one_call(self):
+        analyzer, messages = fake_analyzer('応答')
+
+        async def ask(i):
+            await asyncio.sleep(i * 0.01)
+            return await analyzer._acreate_message('同じプロンプト')
+
+        async def main():
+            return await asyncio.gather(*(ask(i) for i in range(16)))
+
+        self.assertEqual(asyncio.run(main()), ['応答'] * 16)
+        self.assertEqual(messages.calls, 1)
+
+    def test_invalid_json_is_not_cached(self):
+        analyzer, messages = fake_analyzer('JSONではない応答')
+        for _ in range(2):
+            with self.assertRaises(Exception), contextlib.redirect_stdout(io.StringIO()):
+                analyzer._create_message('同じプロンプト', label='テスト')
+        self.assertEqual(messages.calls, 2)
+
+
+@skipUnless(serialization.orjson is not None, 'orjsonがインストールされていません')
+class SerializationTest(TestCase):
+    """orjsonと標準ライブラリ（Fragmentの差し込み）で同じJSONになること"""
+
+    def stdlib_dumps(self, data, fragments=None):
+        with mock.patch.object(serialization, 'orjson', None):
+            return serialization.FastJsonResponse(data, fragments=fragments).content
+
+    def test_values_match(self):
+        data = {
+            'text': '日本語\x00"\\',
+            'placeholder': '\x00deadbeef:0',
+            'datetime': datetime.datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc),
+            'date': datetime.date(2024, 1, 2),
+            'decimal': decimal.Decimal('1.50'),
+            'float': 0.1,
+            'list': [1, None, True, {'nested': []}],
+            1: 'int key',
+            'fragment': serialization.Fragment(b'{"x":[1,2]}'),
+            'fragments': [serialization.Fragment(b'"a"'), serialization.Fragment(b'null')],
+        }
+        self.assertEqual(serialization.FastJsonResponse(data).content, self.stdlib_dumps(data))
+        self.assertEqual(json.loads(self.stdlib_dumps(data))['fragment'], {'x': [1, 2]})
+
+    def test_diagnosis_results_match(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        engine = VisaDiagnosisEngine(enable_ai=False)
+        fragments = engine.ruleset.result_fragments
+        for applicant in sample_applicants()[::17]:
+            result = engine.diagnose(applicant)
+            self.assertEqual(
+                serialization.FastJsonResponse(result, fragments=fragments).content,
+                self.stdlib_dumps(result, fragments),
+            )
+
+
+class CompressionMiddlewareTest(SimpleTestCase):
+    """Accept-Encodingに応じた圧縮とVary・圧縮済み・ストリーミングのレスポンスの扱い"""
+
+    BODY = {'items': ['在留資格の診断結果'] * 50}
+
+    def respond(self, accept_encoding='', response=None):
+        if response is None:
+            response = JsonResponse(self.BODY, json_dumps_params={'ensure_ascii': False})
+            response['ETag'] = '"abc"'
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_gzip(self):
+        response = self.respond('gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.BODY)
+
+    def test_brotli(self):
+        fake = SimpleNamespace(compress=lambda data, quality: zlib.compress(data))
+        with mock.patch.object(middleware, 'brotli', middleware.brotli or fake):
+            response = self.respond('gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        decompress = middleware.brotli.decompress if middleware.brotli else zlib.decompress
+        self.assertEqual(json.loads(decompress(response.content)), self.BODY)
+
+    def test_brotli_refused_falls_back_to_gzip(self):
+        fake = SimpleNamespace(compress=lambda data, quality: zlib.compress(data))
+        with mock.patch.object(middleware, 'brotli', fake):
+            response = self.respond('br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_identity(self):
+        response = self.respond('')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(response.content), self.BODY)
+
+    def test_skips_encoded_and_streaming_responses(self):
+        encoded = HttpResponse(gzip.compress(b'{}' * 200), content_type='application/json')
+        encoded['Content-Encoding'] = 'gzip'
+        response = self.respond('gzip, br', encoded)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Vary'))
+        self.assertEqual(gzip.decompress(response.content), b'{}' * 200)
+
+        streaming = StreamingHttpResponse(iter([b'{}'] * 200), content_type='application/json')
+        response = self.respond('gzip, br', streaming)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), b'{}' * 200)
+
+
+@override_settings(COHORT_CHUNK_SIZE=2, COHORT_MAX_ATTEMPTS=2, COHORT_LEASE_SECONDS=600)
+class CohortQueueTest(TestCase):
+    """一括診断のキュー（取得・処理期限切れの取得し直し・試行回数の上限・--burst）"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        self.job = cohorts.create_job([APPLICANT] * 3, name='テスト')
+
+    def expire(self, chunk):
+        CohortChunk.objects.filter(pk=chunk.pk).update(leased_until=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_claim(self):
+        first = cohorts.claim_chunk('w1')
+        second = cohorts.claim_chunk('w2')
+        self.assertEqual((first.index, first.worker, first.attempts), (0, 'w1', 1))
+        self.assertEqual((second.index, second.worker), (1, 'w2'))
+        self.assertIsNone(cohorts.claim_chunk('w3'))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'running')
+
+        self.assertEqual(cohorts.process_chunk(first, 'w1'), (2, 0))
+        self.assertEqual(cohorts.process_chunk(second, 'w2'), (1, 0))
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.processed, self.job.failed), ('completed', 3, 0))
+        self.assertEqual(self.job.results.filter(session__isnull=False).count(), 3)
+
+    def test_expired_lease_is_taken_over(self):
+        stale = cohorts.claim_chunk('w1')
+        self.expire(stale)
+        taken = cohorts.claim_chunk('w2')
+        self.assertEqual((taken.pk, taken.worker, taken.attempts), (stale.pk, 'w2', 2))
+
+        with self.assertRaises(cohorts.LeaseLost):
+            cohorts.process_chunk(stale, 'w1')
+        self.assertFalse(DiagnosisSession.objects.exists())
+        self.assertEqual(cohorts.process_chunk(taken, 'w2'), (2, 0))
+        self.assertEqual(DiagnosisSession.objects.count(), 2)
+
+    def test_abandoned_chunk_fails_after_max_attempts(self):
+        for worker in ('w1', 'w2'):
+            chunk = cohorts.claim_chunk(worker)
+            self.assertEqual(chunk.index, 0)
+            self.expire(chunk)
+        # 試行回数が上限に達した処理単位は取得されず、全行が失敗になる
+        self.assertEqual(cohorts.claim_chunk('w3').index, 1)
+        chunk.refresh_from_db()
+        self.assertEqual(chunk.status, 'failed')
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.failed, 2)
+        self.assertEqual(list(self.job.results.filter(session__isnull=True).values_list('row', flat=True)), [0, 1])
+
+    def test_release_requeues_until_max_attempts(self):
+        chunk = cohorts.claim_chunk('w1')
+        self.assertTrue(cohorts.release_chunk(chunk, 'w1', 'エラー'))
+        chunk = cohorts.claim_chunk('w1')
+        self.assertEqual(chunk.attempts, 2)
+        self.assertFalse(cohorts.release_chunk(chunk, 'w1', 'エラー'))
+        chunk.refresh_from_db()
+        self.assertEqual((chunk.status, chunk.last_error), ('failed', 'エラー'))
+
+    def test_burst_worker_exits_when_queue_is_empty(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        out = io.StringIO()
+        # テストのトランザクション内で接続を閉じないようにする
+        with mock.patch('visa_diagnosis.management.commands.run_diagnosis_worker.close_old_connections'):
+            call_command('run_diagnosis_worker', '--burst', '--worker-id', 'w1', stdout=out)
+        self.assertIn('処理単位 2件', out.getvalue())
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.processed), ('completed', 3))
+        self.assertFalse(CohortChunk.objects.exclude(status='done').exists())
+
+
+class CatalogEtagTest(TestCase):
+    """カタログAPIのETag・304と、ルールセットの編集でETagが変わること"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+
+    def test_etag_changes_when_requirement_is_edited(self):
+        for url in ('/api/visas/', '/api/visas/engineer_specialist/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn(f'max-age={settings.CATALOG_CACHE_MAX_AGE}', response['Cache-Control'])
+            old_etag = response['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=old_etag).status_code, 304)
+
+            requirement = VisaRequirement.objects.filter(visa_category__code='engineer_specialist').first()
+            requirement.condition = f'{requirement.condition}（{url}で更新）'
+            requirement.save()
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=old_etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], old_etag)
+            self.assertIn(f'（{url}で更新）', response.content.decode('utf-8'))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class WageTableTest(SimpleTestCase):
+    """賃金の参照値の検索（完全一致・広げた区分・該当なし）"""
+
+    def setUp(self):
+        self.table = wages.WageTable([
+            ('G 情報通信業', 'システムエンジニア', '東京都', 0, None, 300000, None, None, None),
+            ('G 情報通信業', 'システムエンジニア', '東京都', 5, None, 380000, None, None, None),
+            ('Ｐ医療，福祉', '', '', 0, None, 210000, None, None, None),
+            ('計', '計', '全国', 0, None, 230000, None, None, None),
+        ])
+
+    def lookup(self, industry, occupation, prefecture, years):
+        return self.table.lookup(
+            wages.industry_key(industry), wages.area_key(occupation), wages.prefecture_key(prefecture), years,
+        )
+
+    def test_exact(self):
+        match = self.lookup('IT・ソフトウェア', 'システムエンジニア', '東京', 7)
+        self.assertEqual((match.amount, match.experience_years_min), (380000, 5))
+        self.assertEqual(match.label, 'G 情報通信業・システムエンジニア・東京都・経験5年以上')
+        self.assertEqual(self.lookup('情報通信業', 'システムエンジニア', '東京都', 2).amount, 300000)
+
+    def test_fallback(self):
+        # 都道府県 → 業種 → 職種の順に「計」へ広げる
+        self.assertEqual(self.lookup('介護', '介護職員', '大阪府', 3).amount, 210000)
+        self.assertEqual(self.lookup('IT・ソフトウェア', 'システムエンジニア', '大阪府', 3).amount, 230000)
+        self.assertEqual(self.lookup('その他', '', '', 0).amount, 230000)
+
+    def test_miss(self):
+        table = wages.WageTable([('製造業', '', '', 0, None, 250000, None, None, None)])
+        self.assertIsNone(table.lookup(wages.industry_key('介護'), '', '', 0))
+        self.assertIsNone(wages.WageTable().lookup('', '', '', 0))
+        self.assertEqual(table.lookup(wages.industry_key('製造業'), '', '', 0).amount, 250000)
+
+
+class ImportWageTableTest(TestCase):
+    """賃金の参照値の取り込みと「日本人と同等額以上」の判定"""
+
+    CSV = '\n'.join([
+        '産業,職種,都道府県,経験年数,第1・四分位数,中央値',
+        'G 情報通信業,,,0～4年,280.0,330.5',
+        'G 情報通信業,,,5～9年,320.0,380.0',
+        '計,,,0年,200,240',
+    ]) + '\n'
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'wages.csv')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(self.CSV)
+
+    def test_import_twice_is_idempotent(self):
+        call_command('import_wage_table', self.path, '--unit', 'thousand', stdout=io.StringIO())
+        first = list(WageReference.objects.values_list(*wages.FIELDS))
+        digest = get_ruleset().wages_digest
+        call_command('import_wage_table', self.path, '--unit', 'thousand', stdout=io.StringIO())
+        self.assertEqual(list(WageReference.objects.values_list(*wages.FIELDS)), first)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(get_ruleset().wages_digest, digest)
+        self.assertIn(('G 情報通信業', '', '', 5, None, 320000, 380000, None, None), first)
+
+    def test_equivalent_salary_requirement_uses_reference(self):
+        call_command('import_wage_table', self.path, '--unit', 'thousand', stdout=io.StringIO())
+        engine = VisaDiagnosisEngine(enable_ai=False)
+        requirement = next(
+            req for req in engine.ruleset.by_code['engineer_specialist'].requirements
+            if req.condition == '日本人が従事する場合に受ける報酬と同等額以上'
+        )
+        for salary, met in ((300000, True), (250000, False)):
+            profile = ApplicantProfile.from_dict({**APPLICANT, 'salary': salary})
+            check = engine._check_requirement(requirement, profile)
+            self.assertIs(check['met'], met, salary)
+            self.assertIn('G 情報通信業・全職種・全国の第1四分位 ¥280,000', check['reason'])
+
+
+class SessionSearchTest(TestCase):
+    """全文索引が診断セッションの作成・更新・削除と一括作成に追従すること"""
+
+    def hits(self, text):
+        return set(search.search_documents(text).values_list('session_id', flat=True))
+
+    def applicant(self, nationality, position):
+        return {**APPLICANT, 'nationality': nationality, 'job_details': {'industry': 'IT・ソフトウェア', 'position': position}}
+
+    def test_save_and_delete_follow_index(self):
+        session = DiagnosisSession.objects.create(
+            session_id=identifiers.new_id(), applicant_data=self.applicant('ウズベキスタン', 'データサイエンティスト'),
+        )
+        self.assertEqual(self.hits('データサイエンティスト'), {session.pk})
+        self.assertEqual(self.hits('ウズベキスタン 分析'), set())
+
+        session.applicant_data = self.applicant('ウズベキスタン', '通訳')
+        session.save()
+        self.assertEqual(self.hits('データサイエンティスト'), set())
+        self.assertEqual(self.hits('ウズベキスタン 通訳'), {session.pk})
+
+        session.delete()
+        self.assertEqual(self.hits('通訳'), set())
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM session_search_fts')
+                self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_bulk_created_sessions_are_indexed_by_bulk_index(self):
+        sessions = [
+            DiagnosisSession(session_id=identifiers.new_id(), applicant_data=self.applicant('モンゴル', '翻訳'))
+            for _ in range(3)
+        ]
+        DiagnosisSession.objects.bulk_create(sessions)
+        # bulk_createはシグナルを送らない
+        self.assertEqual(self.hits('モンゴル'), set())
+        search.bulk_index(sessions)
+        self.assertEqual(self.hits('モンゴル 翻訳'), {session.pk for session in sessions})
+
+        sessions[0].applicant_data = self.applicant('モンゴル', '貿易事務')
+        search.bulk_index(sessions[:1])
+        self.assertEqual(self.hits('モンゴル 翻訳'), {session.pk for session in sessions[1:]})
+        self.assertEqual(self.hits('貿易事務'), {sessions[0].pk})
+
+    def test_cohort_sessions_are_searchable(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        job = cohorts.create_job([self.applicant('ネパール', 'インフラエンジニア')] * 2)
+        cohorts.process_chunk(cohorts.claim_chunk('w1'), 'w1')
+        sessions = set(job.results.values_list('session_id', flat=True))
+        self.assertEqual(len(sessions), 2)
+        self.assertEqual(self.hits('ネパール インフラエンジニア'), sessions)
+        self.assertEqual(self.hits('engineer_specialist'), sessions)
+
+
+@override_settings(ENABLE_AI_FEATURES=False, ANTHROPIC_API_KEY=None)
+class AsyncViewsTest(TestCase):
+    """非同期版の診断ビューが同期版と同じ結果を返し、セッションを保存すること"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    @staticmethod
+    def without_ids(content):
+        result = json.loads(content)
+        for key in ('diagnosis_id', 'session_id', 'access_token'):
+            result.pop(key)
+        return result
+
+    async def test_diagnose_async_matches_sync(self):
+        body = json.dumps(APPLICANT)
+        sync_response = await sync_to_async(views.diagnose)(
+            RequestFactory().post('/diagnose/?detail=standard', body, content_type='application/json'),
+        )
+        response = await views.diagnose_async(
+            AsyncRequestFactory().post('/diagnose/?detail=standard', body, content_type='application/json'),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.without_ids(response.content), self.without_ids(sync_response.content))
+        result = json.loads(response.content)
+        session = await DiagnosisSession.objects.aget(session_id=result['session_id'])
+        self.assertEqual(session.applicant_data, APPLICANT)
+        self.assertTrue(identifiers.verify_access_token(result['session_id'], result['access_token']))
+
+    async def test_diagnose_async_rejects_invalid_detail(self):
+        response = await views.diagnose_async(
+            AsyncRequestFactory().post('/diagnose/?detail=unknown', json.dumps(APPLICANT), content_type='application/json'),
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error'], 'invalid_request')
+
+    async def test_submit_diagnosis_async_redirects_with_token(self):
+        form = {'nationality': 'ベトナム', 'degree': '学士', 'major': '情報工学', 'experience_years': '3',
+                'industry': 'IT・ソフトウェア', 'position': 'システムエンジニア', 'salary': '300000'}
+        response = await views.submit_diagnosis_async(AsyncRequestFactory().post('/submit-diagnosis/', form))
+        self.assertEqual(response.status_code, 302)
+        session = await DiagnosisSession.objects.aget()
+        self.assertEqual(
+            response['Location'],
+            f'/sessions/{session.session_id}/?token={identifiers.access_token(session.session_id)}',
+        )
+
+
+class CounterfactualTest(TestCase):
+    """改善パスの分枝限定法が全ての変更の組み合わせのうち最小コストのものを返すこと"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        self.engine = VisaDiagnosisEngine(enable_ai=False)
+
+    def brute_force(self, visa, profile, target_score):
+        evaluator = counterfactual._Evaluator(self.engine, visa)
+        levers = counterfactual.compile_levers(visa, profile, lambda p: self.engine.equivalent_salary(p)[0])
+        maxed = profile
+        for options in levers:
+            maxed = apply_change(maxed, options[-1].lever, options[-1].value)
+        max_met = evaluator.met(maxed)
+        goal = min(target_score, evaluator.score(evaluator.points(max_met)))
+        best = None
+        for choice in product(*[[None, *options] for options in levers]):
+            varied = profile
+            for option in choice:
+                if option is not None:
+                    varied = apply_change(varied, option.lever, option.value)
+            met = evaluator.met(varied)
+            if any(req.is_mandatory and ok and not now for req, ok, now in zip(visa.requirements, max_met, met)):
+                continue
+            if evaluator.score(evaluator.points(met)) < goal:
+                continue
+            cost = sum(option.cost for option in choice if option is not None)
+            best = cost if best is None else min(best, cost)
+        return best
+
+    def test_solve_matches_brute_force(self):
+        target = VisaDiagnosisEngine.IMPROVEMENT_TARGET_SCORE
+        for applicant in sample_applicants()[::7]:
+            profile = ApplicantProfile.from_dict(applicant)
+            for visa in self.engine.ruleset.visas:
+                path = counterfactual.solve(self.engine, visa, profile, target)
+                if not visa.requirements:
+                    self.assertIsNone(path)
+                    continue
+                self.assertEqual(path['total_cost'], self.brute_force(visa, profile, target), visa.code)
+                varied = profile
+                for change in path['changes']:
+                    varied = apply_change(varied, change['field'], change['value'])
+                score = self.engine._calculate_match_score(visa, varied)['total_score']
+                self.assertEqual(score, path['projected_score'], visa.code)
+
+    def test_low_salary_path_raises_salary(self):
+        profile = ApplicantProfile.from_dict({**APPLICANT, 'salary': 150000})
+        visa = self.engine.ruleset.by_code['engineer_specialist']
+        path = counterfactual.solve(self.engine, visa, profile, 100)
+        self.assertEqual([change['field'] for change in path['changes']], ['salary'])
+        self.assertGreater(path['projected_score'], path['current_score'])
+        self.assertFalse(path['target_reachable'])
+        result = self.engine.diagnose({**APPLICANT, 'salary': 150000})
+        scores = [(-p['projected_score'], p['total_cost']) for p in result['improvement_paths']]
+        self.assertEqual(scores, sorted(scores))
+
+
+class SessionExportTest(TestCase):
+    """診断セッションのエクスポートAPI（形式・絞り込み・権限）"""
+
+    url = '/api/sessions/export/'
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+
+        self.result = VisaDiagnosisEngine(enable_ai=False).diagnose(APPLICANT)
+        # detail=minimal の結果（top_recommendationsなし）
+        minimal = {key: value for key, value in self.result.items() if key != 'top_recommendations'}
+        self.completed = DiagnosisSession.objects.create(
+            session_id='export-completed', status='completed',
+            applicant_data=APPLICANT, diagnosis_result=self.result,
+        )
+        self.minimal = DiagnosisSession.objects.create(
+            session_id='export-minimal', status='completed',
+            applicant_data=APPLICANT, diagnosis_result=minimal,
+        )
+        self.in_progress = DiagnosisSession.objects.create(session_id='export-in-progress')
+        DiagnosisSession.objects.filter(pk=self.in_progress.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=10)
+        )
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def rows(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_requires_staff(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_csv_rows_in_chunks(self):
+        with mock.patch.object(export, 'ROWS_PER_WRITE', 1):
+            response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'], r'filename="diagnosis_sessions_\d{8}_\d{6}\.csv"')
+
+        rows = self.rows(response)
+        self.assertEqual(rows[0], export.HEADERS)
+        records = {row[0]: dict(zip(export.HEADERS, row)) for row in rows[1:]}
+        self.assertEqual(set(records), {'export-completed', 'export-minimal', 'export-in-progress'})
+
+        top = self.result['top_recommendations'][0]
+        record = records['export-completed']
+        self.assertEqual(record['nationality'], 'ベトナム')
+        self.assertEqual(record['experience_years'], '3')
+        self.assertEqual(record['top_visa_code'], top['visa_category']['code'])
+        self.assertEqual(record['recommended_codes'], '; '.join(
+            rec['visa_category']['code'] for rec in self.result['top_recommendations'][:3]
+        ))
+        # minimal の結果はall_optionsの先頭で代用する
+        self.assertEqual(records['export-minimal']['top_visa_code'], self.result['all_options'][0]['visa_category']['code'])
+        self.assertEqual(records['export-in-progress']['top_visa_code'], '')
+
+    def test_jsonl_with_filters(self):
+        response = self.client.get(self.url, {'format': 'jsonl', 'status': 'completed'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['session_id'] for line in lines], ['export-completed', 'export-minimal'])
+
+        today = timezone.localdate()
+        old = (today - datetime.timedelta(days=10)).isoformat()
+        self.assertEqual(
+            set(export.filter_sessions({'created_to': old}).values_list('session_id', flat=True)),
+            {'export-in-progress'},
+        )
+        self.assertEqual(export.filter_sessions({'created_from': today.isoformat()}).count(), 2)
+        self.assertEqual(export.filter_sessions({'created_from': old, 'created_to': today.isoformat()}).count(), 3)
+
+    def test_gzip(self):
+        plain = b''.join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz"'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_invalid_parameters(self):
+        for params in ({'format': 'xlsx'}, {'status': 'unknown'}, {'created_from': '2024/01/01'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], 'invalid_request')
+
+
+class ApplicantProfileTest(SimpleTestCase):
+    """申請者情報からのプロファイル作成とWhat-if分析用の変更"""
+
+    def test_from_dict(self):
+        profile = ApplicantProfile.from_dict({
+            **APPLICANT,
+            'age': '28',
+            'education': {'degree': '修士', 'major': '情報工学', 'japan_university': True},
+            'experience': [{'years': 3, 'field': 'Web開発'}, {'years': 2}],
+            'qualifications': ['日本語能力試験N2', '', 'JLPT N1'],
+            'company_info': {'name': '株式会社サンプル', 'prefecture': '東京都'},
+        })
+        self.assertEqual(profile.age, 28)
+        self.assertEqual(profile.degree_level, 'master')
+        self.assertEqual(profile.degree_rank, vocabulary.DEGREE_LEVELS.index('master'))
+        self.assertTrue(profile.japan_university)
+        self.assertEqual(profile.total_years, 5)
+        self.assertEqual(profile.experience_field, 'Web開発')
+        self.assertEqual(profile.qualifications, ('日本語能力試験N2', 'JLPT N1'))
+        self.assertEqual(profile.jlpt_level, 1)
+        self.assertEqual(profile.wage_industry_key, '情報通信業')
+        # 勤務地がなければ会社の所在地
+        self.assertEqual(profile.prefecture_key, wages.prefecture_key('東京'))
+        self.assertEqual(profile.annual_salary, 300000 * 12)
+
+    def test_from_dict_with_missing_fields(self):
+        profile = ApplicantProfile.from_dict({'annual_salary': 5000000})
+        self.assertIsNone(profile.age)
+        self.assertFalse(profile.has_education)
+        self.assertFalse(profile.has_job_details)
+        self.assertEqual(profile.degree_level, 'none')
+        self.assertEqual(profile.total_years, 0)
+        self.assertIsNone(profile.jlpt_level)
+        self.assertEqual(profile.salary, 0)
+        self.assertEqual(profile.annual_salary, 5000000)
+
+    def test_vary_returns_new_profile(self):
+        profile = ApplicantProfile.from_dict(APPLICANT)
+        varied = profile.vary(salary=400000, total_years=10, added_qualifications=('JLPT N1', ''))
+
+        self.assertEqual((varied.salary, varied.total_years), (400000, 10))
+        self.assertEqual(varied.qualifications, ('日本語能力試験N2', 'JLPT N1'))
+        self.assertEqual(varied.jlpt_level, 1)
+        self.assertEqual(varied.company_name, profile.company_name)
+        # 元のプロファイルは変わらない
+        self.assertEqual((profile.salary, profile.total_years, profile.jlpt_level), (300000, 3, 2))
+        self.assertEqual(profile.qualifications, ('日本語能力試験N2',))
+        self.assertEqual(profile.vary(), profile)
+
+
+@override_settings(ENABLE_AI_FEATURES=False, ANTHROPIC_API_KEY=None)
+class DetailLevelTest(TestCase):
+    """detail・fields・topによる診断結果の項目の選択"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.engine = VisaDiagnosisEngine(enable_ai=False)
+
+    def scores(self, options):
+        return [(option['visa_category']['code'], option['match_score']) for option in options]
+
+    def test_parse(self):
+        self.assertEqual(detail.parse(), detail.FULL)
+        self.assertEqual(detail.parse('minimal').result_fields, {'diagnosis_id', 'all_options'})
+        self.assertNotIn('ai_analysis', detail.parse('standard').result_fields)
+
+        spec = detail.parse('minimal', 'next_steps, options.missing_items', '2')
+        self.assertEqual(spec.result_fields, {'diagnosis_id', 'next_steps', 'all_options'})
+        self.assertEqual(spec.option_fields, {'visa_category', 'missing_items'})
+        self.assertEqual(spec.top, 2)
+        self.assertTrue(spec.needs_missing)
+        self.assertEqual(detail.parse(fields='top_recommendations').candidate_limit, detail.TOP_RECOMMENDATIONS)
+        self.assertEqual(detail.parse(fields='next_steps').candidate_limit, 1)
+
+        for args in (('verbose',), ('full', 'unknown'), ('full', 'options.unknown'), ('full', None, '0'),
+                     ('full', None, 'x')):
+            with self.subTest(args=args), self.assertRaises(detail.DetailError):
+                detail.parse(*args)
+
+    def test_minimal_result_has_scores_only(self):
+        full = self.engine.diagnose(APPLICANT)
+        minimal = self.engine.diagnose(APPLICANT, detail.SCORES_ONLY)
+
+        self.assertEqual(set(minimal), {'diagnosis_id', 'all_options'})
+        self.assertNotIn('top_recommendations', minimal)
+        for option in minimal['all_options']:
+            self.assertEqual(set(option), {'visa_category', 'match_score'})
+        # スコアと順位は完全な結果と同じ
+        self.assertEqual(self.scores(minimal['all_options']), self.scores(full['all_options']))
+
+    def test_standard_and_top(self):
+        full = self.engine.diagnose(APPLICANT)
+        standard = self.engine.diagnose(APPLICANT, detail.parse('standard'))
+        self.assertEqual(set(standard), set(detail.DETAIL_LEVELS['standard'][0]))
+        self.assertEqual(standard['top_recommendations'], full['top_recommendations'])
+        self.assertEqual(standard['next_steps'], full['next_steps'])
+
+        top = self.engine.diagnose(APPLICANT, detail.parse('standard', top='2'))
+        self.assertEqual(self.scores(top['all_options']), self.scores(full['all_options'])[:2])
+        self.assertEqual(top['top_recommendations'], full['top_recommendations'][:2])
+
+        summary = self.engine.diagnose(APPLICANT, detail.parse(fields='top_recommendations,options.match_score'))
+        self.assertEqual(set(summary), {'diagnosis_id', 'top_recommendations'})
+        self.assertEqual(self.scores(summary['top_recommendations']), self.scores(full['top_recommendations']))
+
+    def test_diagnose_api(self):
+        response = self.client.post('/diagnose/?detail=minimal', json.dumps(APPLICANT), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('top_recommendations', response.json())
+        session = DiagnosisSession.objects.get(session_id=response.json()['session_id'])
+        self.assertEqual(set(session.diagnosis_result), {'diagnosis_id', 'all_options'})
+
+        response = self.client.post('/diagnose/?fields=foo', json.dumps(APPLICANT), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'invalid_request')
+
+
+class FakeLoadClient:
+    """loadtestの送信先（httpx.AsyncClientの代わり、ステータスを順に返す）"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = []
+
+    async def _respond(self, method, path):
+        self.requests.append((method, path))
+        status = self.statuses[(len(self.requests) - 1) % len(self.statuses)]
+        if isinstance(status, Exception):
+            raise status
+        await asyncio.sleep(0.001)
+        return SimpleNamespace(status_code=status, aread=lambda: asyncio.sleep(0))
+
+    def post(self, path, **kwargs):
+        return self._respond('POST', path)
+
+    def get(self, path, **kwargs):
+        return self._respond('GET', path)
+
+
+class LoadTestTest(SimpleTestCase):
+    """負荷試験の負荷生成・集計とloadtestコマンド"""
+
+    def config(self, **kwargs):
+        return loadtest.LoadConfig(**{
+            'mode': 'closed',
+            'paths': {'diagnose': '/diagnose/', 'submit': '/submit-diagnosis/', 'visa_list': '/visa-list/'},
+            'mix': (('diagnose', 1), ('visa_list', 1)),
+            'payloads': [APPLICANT],
+            'duration': 0.1,
+            'warmup': 0,
+            'interval': 0.05,
+            **kwargs,
+        })
+
+    def test_histogram(self):
+        histogram = loadtest.LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms)
+        summary = histogram.summary()
+        self.assertEqual(summary['mean'], 50.5)
+        self.assertEqual(summary['max'], 100)
+        # ビン幅（約9%）の誤差で上側に丸める
+        self.assertTrue(50 <= summary['p50'] <= 50 * 2 ** (1 / 8))
+        self.assertTrue(90 <= summary['p90'] <= 90 * 2 ** (1 / 8))
+        self.assertEqual(histogram.percentile(100), 100)
+        self.assertEqual(sum(bucket['count'] for bucket in histogram.buckets()), 100)
+        self.assertEqual(loadtest.LatencyHistogram().percentile(99), 0.0)
+
+    def test_form_fields_round_trip(self):
+        rng = random.Random(1)
+        for applicant in [APPLICANT] + [loadtest.synthetic_applicant(rng) for _ in range(20)]:
+            expected = ApplicantProfile.from_dict(applicant)
+            profile = ApplicantProfile.from_dict(applicant_data_from_form(loadtest.form_fields(applicant)))
+            for name in ('nationality', 'degree', 'major', 'total_years', 'qualifications', 'industry',
+                         'position', 'salary', 'company_name'):
+                self.assertEqual(getattr(profile, name), getattr(expected, name), name)
+
+    def test_closed_model_counts_statuses(self):
+        client = FakeLoadClient([200, 429, 500, ConnectionError()])
+        stats = asyncio.run(loadtest.run_closed(client, self.config(), 2, random.Random(1)))
+        report = stats.report()
+
+        self.assertEqual(report['requests'], len(client.requests))
+        self.assertEqual(report['requests'], report['ok'] + report['throttled'] + report['errors'])
+        self.assertEqual(report['status_codes']['ConnectionError'], report['errors'] - report['status_codes']['500'])
+        self.assertEqual(sum(e['requests'] for e in report['endpoints'].values()), report['requests'])
+        self.assertEqual(sum(t['requests'] for t in report['timeline']), report['requests'])
+        self.assertEqual({method for method, _ in client.requests}, {'POST', 'GET'})
+
+    def test_open_model_drops_over_in_flight_limit(self):
+        client = FakeLoadClient([200])
+        config = self.config(mode='open', arrival='uniform', max_in_flight=1, mix=(('visa_list', 1),))
+        stats = asyncio.run(loadtest.run_open(client, config, 500, random.Random(1)))
+        report = stats.report()
+        self.assertGreater(report['dropped'], 0)
+        self.assertEqual(report['requests'], len(client.requests))
+        self.assertEqual(report['errors'], 0)
+
+    def test_best_stage(self):
+        def stage(level, rps, p99, errors=0.0, throttled=0):
+            return {'level': level, 'throughput_rps': rps, 'latency_ms': {'p99': p99},
+                    'error_rate': errors, 'throttled': throttled, 'dropped': 0}
+
+        stages = [stage(1, 10, 100), stage(2, 18, 400), stage(4, 25, 2000), stage(8, 30, 300, errors=0.5),
+                  stage(16, 40, 300, throttled=1)]
+        self.assertEqual(loadtest.best_stage(stages, 1000, 0.01), {'level': 2, 'throughput_rps': 18, 'p99_ms': 400})
+        self.assertIsNone(loadtest.best_stage(stages, 50, 0.01))
+
+    @skipUnless(httpx is not None, 'httpxがインストールされていません')
+    def test_command_report(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={})
+
+        client = functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler))
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        output = os.path.join(tmp_dir.name, 'report.json')
+        with mock.patch('httpx.AsyncClient', client):
+            call_command(
+                'loadtest', '--concurrency', '1,2', '--duration', '0.1', '--warmup', '0', '--mix', 'visa_list=1',
+                '--output', output, stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+
+        with open(output, encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual([stage['level'] for stage in report['stages']], [1, 2])
+        self.assertEqual(sum(stage['requests'] for stage in report['stages']), len(requests))
+        self.assertEqual({request.url.path for request in requests}, {'/visa-list/'})
+        self.assertIn(report['saturation']['level'], (1, 2))
+
+    def test_command_rejects_invalid_options(self):
+        for args in (['--concurrency', '0'], ['--mode', 'open', '--rate', 'x'], ['--mix', 'unknown=1'],
+                     ['--mix', 'diagnose=0'], ['--duration', '0']):
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                call_command('loadtest', *args, stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class ImportTimeCommandTest(SimpleTestCase):
+    """importtimeコマンド（起動時のモジュール読み込み時間と遅延読み込みの検査）"""
+
+    def run_command(self, *args):
+        stdout = io.StringIO()
+        call_command('importtime', '--repeat', '1', '--json', *args, stdout=stdout)
+        return json.loads(stdout.getvalue())
+
+    def test_startup_does_not_import_ai_client(self):
+        report = self.run_command('--top', '5')
+        self.assertEqual(report['entry'], settings.WSGI_APPLICATION)
+        self.assertIn('django', report['packages'])
+        self.assertIn('visa_diagnosis', report['packages'])
+        self.assertEqual(report['forbidden_imported'], [])
+        self.assertLessEqual(len(report['top_cumulative']), 5)
+        self.assertGreater(report['total_ms'], 0)
+
+    def test_forbidden_package_and_budget_fail(self):
+        with self.assertRaisesMessage(CommandError, 'django'):
+            self.run_command('--forbid', 'django')
+        with self.assertRaisesMessage(CommandError, '上限'):
+            self.run_command('--forbid', '', '--budget-ms', '0.001')
+
+    def test_parse(self):
+        entries = importtime._parse(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   _io\n'
+            'import time:      2500 |       2620 | visa_diagnosis.logic\n'
+        )
+        self.assertEqual(entries, [
+            {'module': '_io', 'self_ms': 0.12, 'cumulative_ms': 0.12, 'depth': 1},
+            {'module': 'visa_diagnosis.logic', 'self_ms': 2.5, 'cumulative_ms': 2.62, 'depth': 0},
+        ])
+
+
+COMBINED_ANSWER = {
+    'major_relevance': {'relevance_score': 70, 'reason': '関連あり'},
+    'job_suitability': {'suitable': True, 'concerns': []},
+    'improvement_suggestions': '日本語能力を高めてください',
+}
+
+
+@override_settings(ENABLE_AI_FEATURES=True, ANTHROPIC_API_KEY='test', AI_COMBINED_ANALYSIS=True)
+class CombinedAIAnalysisTest(TestCase):
+    """一括分析（1回のAPI呼び出し）とトークン数の集計"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.analyzer, self.messages = fake_analyzer(json.dumps(COMBINED_ANSWER, ensure_ascii=False))
+        patcher = mock.patch('visa_diagnosis.ai_integration.get_analyzer', return_value=self.analyzer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # オフライン判定では確信できない組み合わせ（関連性もAPIで分析する）
+        self.applicant = {
+            **APPLICANT,
+            'education': {'degree': '学士', 'major': '文化人類学'},
+            'job_details': {'industry': 'IT・ソフトウェア', 'position': 'ブリッジSE', 'duties': 'オフショア開発の調整'},
+        }
+
+    def diagnose(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return VisaDiagnosisEngine().diagnose(self.applicant)['ai_analysis']
+
+    def test_single_call_with_cached_instructions(self):
+        analysis = self.diagnose()
+
+        self.assertEqual(self.messages.calls, 1)
+        params = self.messages.params[0]
+        self.assertEqual(params['system'][0]['text'], ai_integration.COMBINED_INSTRUCTIONS)
+        self.assertEqual(params['system'][0]['cache_control'], {'type': 'ephemeral'})
+        request = json.loads(params['messages'][0]['content'])
+        self.assertEqual(request['sections'], list(ai_integration.COMBINED_SECTIONS))
+        self.assertEqual(request['申請者情報']['専攻'], '文化人類学')
+
+        for section, value in COMBINED_ANSWER.items():
+            self.assertEqual(analysis[section], value)
+        self.assertEqual(analysis['usage'], {
+            'requests': 1, 'cached_responses': 0, 'input_tokens': 100, 'output_tokens': 20,
+            'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 1500,
+        })
+
+        # 同じ申請者情報は応答のキャッシュから返す
+        again = self.diagnose()
+        self.assertEqual(self.messages.calls, 1)
+        self.assertEqual(again['usage']['requests'], 0)
+        self.assertEqual(again['usage']['cached_responses'], 1)
+        self.assertEqual(again['job_suitability'], COMBINED_ANSWER['job_suitability'])
+
+    def test_async_single_call(self):
+        engine = VisaDiagnosisEngine(ruleset=get_ruleset())  # ルールセットの読み込みは同期で済ませる
+        with contextlib.redirect_stdout(io.StringIO()):
+            analysis = asyncio.run(engine.adiagnose(self.applicant))['ai_analysis']
+        self.assertEqual(self.messages.calls, 1)
+        self.assertEqual(analysis['improvement_suggestions'], COMBINED_ANSWER['improvement_suggestions'])
+        self.assertEqual(analysis['usage']['requests'], 1)
+        self.assertEqual(analysis['usage']['input_tokens'], 100)
+
+    @override_settings(AI_COMBINED_ANALYSIS=False)
+    def test_separate_calls_are_counted(self):
+        analysis = self.diagnose()
+        self.assertEqual(self.messages.calls, 3)
+        self.assertEqual(analysis['usage']['requests'], 3)
+        self.assertEqual(analysis['usage']['output_tokens'], 60)
+        self.assertNotIn('system', self.messages.params[0])
+
+    def test_missing_sections_fall_back(self):
+        self.messages.text = json.dumps({'improvement_suggestions': '提案'}, ensure_ascii=False)
+        profile = ApplicantProfile.from_dict(self.applicant)
+        result = VisaDiagnosisEngine(enable_ai=False).diagnose(self.applicant)
+
+        combined = self.analyzer.analyze_combined(profile, result, include_major_relevance=False)
+        self.assertIsNone(combined['major_relevance'])
+        self.assertEqual(combined['improvement_suggestions'], '提案')
+        self.assertIn('AIの応答に含まれていません', json.dumps(combined['job_suitability'], ensure_ascii=False))
+        self.assertNotIn('major_relevance', json.loads(self.messages.params[0]['messages'][0]['content'])['sections'])
+
+
+class RulesetWageCacheTest(TestCase):
+    """賃金表はルールセットの共有エントリに含めず、ダイジェストごとのキーから読み込むこと"""
+
+    def setUp(self):
+        WageReference.objects.bulk_create([
+            WageReference(industry='', occupation='', prefecture='', experience_years_min=years, p50=p50)
+            for years, p50 in ((0, 220000), (5, 280000), (10, 330000))
+        ])
+        cache.clear()
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        self.addCleanup(cache.clear)
+
+    def test_shared_entry_keeps_only_digest(self):
+        built = get_ruleset()
+        self.assertTrue(built.wages_digest)
+        restored = pickle.loads(pickle.dumps(built))
+        self.assertIsNone(restored._wages)
+        self.assertEqual(restored.version, built.version)
+        self.assertIsNotNone(cache.get(ruleset.WAGES_CACHE_KEY.format(digest=built.wages_digest)))
+        self.assertEqual(restored.wages.digest, built.wages_digest)
+        self.assertEqual(restored.wages.lookup('', '', '', 7, 'p50'), built.wages.lookup('', '', '', 7, 'p50'))
+
+    def test_falls_back_to_db_when_table_not_cached(self):
+        built = get_ruleset()
+        # 項目の上限を超えて保存されなかった場合と同じ状態
+        cache.delete(ruleset.WAGES_CACHE_KEY.format(digest=built.wages_digest))
+        ruleset._wage_table = None
+        restored = pickle.loads(pickle.dumps(built))
+        with self.assertNumQueries(1):
+            self.assertEqual(restored.wages.digest, built.wages_digest)
+        self.assertIs(pickle.loads(pickle.dumps(built)).wages, restored.wages)
+
+
+class SessionAccessTokenTest(SimpleTestCase):
+    """診断セッションのアクセストークン"""
+
+    def test_token_is_bound_to_session_and_secret_key(self):
+        session_id = identifiers.new_id()
+        token = identifiers.access_token(session_id)
+        self.assertTrue(identifiers.verify_access_token(session_id, token))
+        self.assertFalse(identifiers.verify_access_token(identifiers.new_id(), token))
+        self.assertFalse(identifiers.verify_access_token(session_id, ''))
+        with self.settings(SECRET_KEY='another-secret-key'):
+            self.assertFalse(identifiers.verify_access_token(session_id, token))
+
+
+class SessionDetailTest(TestCase):
+    """診断セッション取得API・結果ページ（アクセス制御・条件付きGET・Cache-Control）"""
+
+    def setUp(self):
+        call_command('load_visa_data', stdout=io.StringIO())
+        invalidate_ruleset()
+        self.addCleanup(invalidate_ruleset)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        response = self.client.post('/diagnose/', json.dumps(APPLICANT), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.session_id = response.json()['session_id']
+        self.token = response.json()['access_token']
+        self.url = f'/api/sessions/{self.session_id}/'
+
+    def test_requires_access_token_or_staff(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'token': 'wrong'}).status_code, 404)
+        self.assertEqual(self.client.get(f'/sessions/{self.session_id}/').status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'token': self.token}).status_code, 200)
+        self.assertEqual(self.client.get(f'/sessions/{self.session_id}/', {'token': self.token}).status_code, 200)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_form_redirects_to_result_page_with_token(self):
+        response = self.client.post('/submit-diagnosis/', {'nationality': 'ベトナム', 'degree': '学士'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get(response['Location']).status_code, 200)
+
+    def test_completed_session_etag_and_cache_control(self):
+        response = self.client.get(self.url, {'token': self.token})
+        self.assertEqual(response.json()['session_id'], self.session_id)
+        self.assertEqual(
+            response['Cache-Control'], f'private, max-age={settings.SESSION_RESULT_MAX_AGE}, immutable'
+        )
+
+        cached = self.client.get(self.url, {'token': self.token}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(cached.content, b'')
+        # 304でもアクセストークンは必要
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+        # 再計算で結果が変わるとETagが変わる
+        DiagnosisSession.objects.get(session_id=self.session_id).save()
+        changed = self.client.get(self.url, {'token': self.token}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_in_progress_session_is_revalidated(self):
+        DiagnosisSession.objects.filter(session_id=self.session_id).update(status='in_progress')
+        session_store.invalidate([self.session_id])
+        response = self.client.get(self.url, {'token': self.token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(
+            self.client.get(self.url, {'token': self.token}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
@@ -0,0 +1,309 @@
+"""
+流量制御 - クライアント単位のスライディングウィンドウ・カウンタによるレート制限
+
+件数は不可分に増やせるカウンタで数えるため、同時に届いたリクエストも1件ずつ数えられる。
+カウンタの保存先は RATE_LIMIT_STORE で選ぶ。'cache' はDjangoキャッシュ（cache.add + cache.incr。
+複数プロセスで共有するにはredis・memcachedが必要）、'db' はDBの行（F()式で更新）。
+fileキャッシュのincrは読み込みと書き込みが別のため、複数プロセスでは使えない（システムチェックでエラー）。
+"""
+import contextlib
+import functools
+import hashlib
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from . import detail
+from .models import RateLimitCounter
+
+
+_PERIODS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+}
+
+
+def parse_rate(rate: str) -> float:
+    """'30/min' 形式のレートを1秒あたりの件数に変換"""
+    count, period = rate.split('/')
+    return int(count) / _PERIODS[period.strip().lower()]
+
+
+class CacheCounters:
+    """キャッシュのカウンタ（incrがプロセス間で不可分なredis・memcached向け）"""
+
+    def __init__(self, alias: str):
+        self.cache = caches[alias]
+
+    def incr(self, key: str, ttl: int) -> int:
+        self.cache.add(key, 0, ttl)
+        try:
+            return self.cache.incr(key)
+        except ValueError:  # 追加直後に期限切れになった
+            self.cache.add(key, 1, ttl)
+            return 1
+
+    def get(self, key: str) -> int:
+        return self.cache.get(key, 0)
+
+    def decr(self, key: str) -> None:
+        with contextlib.suppress(ValueError):
+            self.cache.decr(key)
+
+    async def aincr(self, key: str, ttl: int) -> int:
+        await self.cache.aadd(key, 0, ttl)
+        try:
+            return await self.cache.aincr(key)
+        except ValueError:
+            await self.cache.aadd(key, 1, ttl)
+            return 1
+
+    async def aget(self, key: str) -> int:
+        return await self.cache.aget(key, 0)
+
+    async def adecr(self, key: str) -> None:
+        with contextlib.suppress(ValueError):
+            await self.cache.adecr(key)
+
+
+class DatabaseCounters:
+    """
+    DBのカウンタ（RateLimitCounter）
+
+    F()式で増やして同じトランザクション内で読み直すため、増やした行は
+    コミットまで他のプロセスから更新されない（SQLiteでも複数プロセス間で不可分）。
+    """
+
+    def incr(self, key: str, ttl: int) -> int:
+        now = timezone.now()
+        with transaction.atomic():
+            RateLimitCounter.objects.bulk_create(
+                [RateLimitCounter(key=key, expires_at=now + timedelta(seconds=ttl))], ignore_conflicts=True
+            )
+            RateLimitCounter.objects.filter(key=key).update(count=F('count') + 1)
+            count = RateLimitCounter.objects.filter(key=key).values_list('count', flat=True).get()
+        if count == 1:
+            # 新しいウィンドウの最初のリクエストのときに期限切れのカウンタを削除する
+            RateLimitCounter.objects.filter(expires_at__lt=now).delete()
+        return count
+
+    def get(self, key: str) -> int:
+        return RateLimitCounter.objects.filter(key=key).values_list('count', flat=True).first() or 0
+
+    def decr(self, key: str) -> None:
+        RateLimitCounter.objects.filter(key=key).update(count=F('count') - 1)
+
+    async def aincr(self, key: str, ttl: int) -> int:
+        return await sync_to_async(self.incr)(key, ttl)
+
+    async def aget(self, key: str) -> int:
+        return await sync_to_async(self.get)(key)
+
+    async def adecr(self, key: str) -> None:
+        await sync_to_async(self.decr)(key)
+
+
+def get_counters():
+    """settings.RATE_LIMIT_STORE のカウンタ（'cache' または 'db'）"""
+    if settings.RATE_LIMIT_STORE == 'db':
+        return DatabaseCounters()
+    return CacheCounters(settings.RATE_LIMIT_CACHE)
+
+
+class RateLimiter:
+    """
+    スライディングウィンドウ・カウンタ（1ウィンドウ burst 件、平均 rate）
+
+    ウィンドウの長さは burst ÷ rate 秒（トークンバケットが空から満杯に戻るまでの時間）。
+    直前のウィンドウの件数を経過時間に応じて減らして現在のウィンドウの件数に足し、
+    burst を超えるリクエストを拒否する。
+    """
+
+    def __init__(self, name: str, rate: str, burst: int):
+        self.name = name
+        self.capacity = burst
+        self.window = max(1.0, burst / parse_rate(rate))
+        # 次のウィンドウで「直前のウィンドウ」として参照されるまで保持する
+        self.ttl = math.ceil(self.window * 2) + 1
+
+    def _keys(self, client_id: str, now: float) -> Tuple[str, str, float]:
+        """(現在のウィンドウのキー, 直前のウィンドウのキー, 現在のウィンドウの経過秒数)"""
+        index = int(now // self.window)
+        prefix = f'ratelimit:{self.name}:{client_id}:'
+        return f'{prefix}{index}', f'{prefix}{index - 1}', now - index * self.window
+
+    def _retry_after(self, previous: int, count: int, elapsed: float) -> float:
+        """許可なら0、拒否なら再試行までの秒数（countは今回を含む現在のウィンドウの件数）"""
+        if previous * (1 - elapsed / self.window) + count <= self.capacity:
+            return 0.0
+        room = self.capacity - count
+        if room >= 0:
+            # 直前のウィンドウの件数が減って収まるまで
+            return max(0.001, self.window * (1 - room / previous) - elapsed)
+        # 現在のウィンドウだけで上限を超えている（同時リクエスト）。次のウィンドウで収まるまで
+        return self.window - elapsed + self.window * (1 - (self.capacity - 1) / (count - 1))
+
+    def consume(self, client_id: str) -> float:
+        """1件数える。許可なら0、拒否なら再試行までの秒数"""
+        counters = get_counters()
+        current, previous, elapsed = self._keys(client_id, time.time())
+        count = counters.incr(current, self.ttl)
+        retry_after = self._retry_after(counters.get(previous), count, elapsed)
+        if retry_after:
+            counters.decr(current)  # 拒否したリクエストは数えない
+        return retry_after
+
+    async def aconsume(self, client_id: str) -> float:
+        """1件数える（非同期版）"""
+        counters = get_counters()
+        current, previous, elapsed = self._keys(client_id, time.time())
+        count = await counters.aincr(current, self.ttl)
+        retry_after = self._retry_after(await counters.aget(previous), count, elapsed)
+        if retry_after:
+            await counters.adecr(current)
+        return retry_after
+
+
+_buckets: Dict[str, RateLimiter] = {}
+
+
+def get_bucket(name: str) -> RateLimiter:
+    """settings.RATE_LIMITS の定義からバケットを取得"""
+    bucket = _buckets.get(name)
+    if bucket is None:
+        config = settings.RATE_LIMITS[name]
+        bucket = _buckets[name] = RateLimiter(name, config['rate'], config['burst'])
+    return bucket
+
+
+@checks.register(checks.Tags.caches)
+def check_rate_limit_store(app_configs=None, **kwargs):
+    """複数プロセスで件数を取りこぼすカウンタの設定をエラーにする"""
+    if not settings.RATE_LIMIT_ENABLED:
+        return []
+    if settings.RATE_LIMIT_STORE not in ('cache', 'db'):
+        return [checks.Error(
+            f"RATE_LIMIT_STORE には 'cache' または 'db' を指定してください（{settings.RATE_LIMIT_STORE!r}）",
+            id='visa_diagnosis.E001',
+        )]
+    if settings.RATE_LIMIT_STORE == 'db':
+        return []
+    backend = caches[settings.RATE_LIMIT_CACHE]
+    if isinstance(backend, FileBasedCache):
+        return [checks.Error(
+            'fileキャッシュのincrはプロセス間で不可分ではないため、レート制限の件数を取りこぼします',
+            hint="CACHE_PROFILEでredis・memcachedを指定するか、RATE_LIMIT_STORE=db を指定してください",
+            id='visa_diagnosis.E002',
+        )]
+    if isinstance(backend, LocMemCache) and settings.WEB_CONCURRENCY > 1:
+        return [checks.Error(
+            f'ローカルメモリのキャッシュはワーカープロセス（{settings.WEB_CONCURRENCY}）ごとに別のため、'
+            'レート制限の上限がワーカー数倍になります',
+            hint="CACHE_PROFILEでredis・memcachedを指定するか、RATE_LIMIT_STORE=db を指定してください",
+            id='visa_diagnosis.E003',
+        )]
+    return []
+
+
+def get_client_ip(request) -> str:
+    """
+    クライアントのIPアドレス
+
+    RATE_LIMIT_TRUSTED_PROXIES（信頼するプロキシの段数）が1以上なら、X-Forwarded-Forの
+    右からその段数目を使う（それより左はクライアントが自由に書き換えられる）。
+    """
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies > 0 and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',') if address.strip()]
+        if addresses:
+            return addresses[-min(proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def get_client_id(request) -> str:
+    """クライアント識別子（登録済みのAPIキー優先、なければIPアドレス）"""
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in settings.RATE_LIMIT_API_KEYS:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+    return 'ip:' + get_client_ip(request)
+
+
+def diagnosis_bucket_name(request=None) -> str:
+    """AI分析を伴う診断とルールのみの診断でバケットを分ける（detail・fieldsでAI分析を除いた場合はルールのみ）"""
+    if settings.ENABLE_AI_FEATURES and settings.ANTHROPIC_API_KEY:
+        if request is not None:
+            try:
+                spec = detail.parse(request.GET.get('detail'), request.GET.get('fields'))
+            except detail.DetailError:
+                return 'diagnose_ai'  # 指定エラーはビューで400を返す
+            if not spec.wants('ai_analysis'):
+                return 'diagnose_rule'
+        return 'diagnose_ai'
+    return 'diagnose_rule'
+
+
+def _too_many_requests(request, retry_after: float, html: bool):
+    seconds = max(1, math.ceil(retry_after))
+    message = f'リクエストが多すぎます。{seconds}秒後に再度お試しください。'
+    if html:
+        response = render(request, 'visa_diagnosis/error.html', {'error_message': message}, status=429)
+    else:
+        response = JsonResponse({
+            'error': 'rate_limited',
+            'message': message,
+            'retry_after': seconds,
+        }, status=429, json_dumps_params={'ensure_ascii': False})
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+def rate_limit(html: bool = False, bucket_name: Optional[str] = None):
+    """
+    レート制限デコレータ（同期・非同期ビューの両方に対応）
+
+    Args:
+        html: Trueの場合は429をエラーページで返す（フォーム送信用）
+        bucket_name: settings.RATE_LIMITS のバケット名（省略時は診断用のバケットを選ぶ）
+    """
+    def bucket_for(request) -> RateLimiter:
+        return get_bucket(bucket_name or diagnosis_bucket_name(request))
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def _async_view(request, *args, **kwargs):
+                if settings.RATE_LIMIT_ENABLED:
+                    bucket = bucket_for(request)
+                    retry_after = await bucket.aconsume(get_client_id(request))
+                    if retry_after:
+                        return _too_many_requests(request, retry_after, html)
+                return await view(request, *args, **kwargs)
+            return _async_view
+
+        @functools.wraps(view)
+        def _view(request, *args, **kwargs):
+            if settings.RATE_LIMIT_ENABLED:
+                bucket = bucket_for(request)
+                retry_after = bucket.consume(get_client_id(request))
+                if retry_after:
+                    return _too_many_requests(request, retry_after, html)
+            return view(request, *args, **kwargs)
+        return _view
+    return decorator
@@ -1,12 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'visa_diagnosis'
 
+# ASGIサーバーで動かす場合は非同期版の診断ビューを使用
+if settings.ASYNC_VIEWS:
+    diagnose_view = views.diagnose_async
+    submit_diagnosis_view = views.submit_diagnosis_async
+else:
+    diagnose_view = views.diagnose
+    submit_diagnosis_view = views.submit_diagnosis
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('visa-list/', views.visa_list, name='visa_list'),
-    path('diagnose/', views.diagnose, name='diagnose'),
+    path('diagnose/', diagnose_view, name='diagnose'),
     path('diagnosis-form/', views.diagnosis_form, name='diagnosis_form'),
-    path('submit-diagnosis/', views.submit_diagnosis, name='submit_diagnosis'),
+    path('submit-diagnosis/', submit_diagnosis_view, name='submit_diagnosis'),
+    path('sessions/<str:session_id>/', views.session_result, name='session_result'),
+    path('cohorts/', views.cohort_upload, name='cohort_upload'),
+    path('api/hsp-points/', views.api_hsp_points, name='api_hsp_points'),
+    path('api/what-if/', views.api_what_if, name='api_what_if'),
+    path('api/visas/', views.api_visa_list, name='api_visa_list'),
+    path('api/visas/<str:code>/', views.api_visa_detail, name='api_visa_detail'),
+    path('api/sessions/search/', views.api_session_search, name='api_session_search'),
+    path('api/sessions/export/', views.api_session_export, name='api_session_export'),
+    path('api/sessions/<str:session_id>/', views.api_session_detail, name='api_session_detail'),
+    path('api/cohorts/', views.api_cohort_create, name='api_cohort_create'),
+    path('api/cohorts/<str:job_id>/', views.api_cohort_detail, name='api_cohort_detail'),
+    path('api/cohorts/<str:job_id>/results/', views.api_cohort_results, name='api_cohort_results'),
 ]
@@ -1,11 +1,22 @@
-from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import redirect, render
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, etag
 import json
-import uuid
-from .models import VisaCategory, DiagnosisSession
+from asgiref.sync import sync_to_async
+from .models import CohortJob, DiagnosisSession
 from .logic import VisaDiagnosisEngine
+from .profile import applicant_data_from_form
+from . import cohorts, detail, export, hsp_points, identifiers, search, session_store, whatif
+from .ruleset import get_ruleset
+from .serialization import FastJsonResponse
+from .throttling import rate_limit
 
 
 def index(request):
@@ -14,36 +25,49 @@ def index(request):
 
 
 def visa_list(request):
-    """在留資格一覧"""
-    visas = VisaCategory.objects.filter(is_active=True).order_by('priority')
-    return render(request, 'visa_diagnosis/visa_list.html', {'visas': visas})
+    """在留資格一覧（ルールセットから描画し、一覧部分はバージョンごとにキャッシュ）"""
+    ruleset = get_ruleset()
+    return render(request, 'visa_diagnosis/visa_list.html', {
+        'visas': ruleset.visas,
+        'ruleset_version': ruleset.version,
+        'fragment_cache_ttl': settings.FRAGMENT_CACHE_TTL,
+    })
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@rate_limit()
 def diagnose(request):
     """診断API"""
     try:
         # リクエストボディからデータ取得
         data = json.loads(request.body)
+        spec = detail.parse(request.GET.get('detail'), request.GET.get('fields'), request.GET.get('top'))
         
         # 診断エンジンの実行
         engine = VisaDiagnosisEngine()
-        result = engine.diagnose(data)
+        result = engine.diagnose(data, spec)
         
         # セッションの保存
-        session_id = str(uuid.uuid4())
+        session_id = result['diagnosis_id']  # 診断IDをそのままセッションIDとして使う
         DiagnosisSession.objects.create(
             session_id=session_id,
             status='completed',
             applicant_data=data,
-            diagnosis_result=result
+            diagnosis_result=result,
+            ruleset_version=engine.ruleset.version
         )
         
         result['session_id'] = session_id
+        result['access_token'] = identifiers.access_token(session_id)  # 取得API・結果ページの ?token=
         
-        return JsonResponse(result, json_dumps_params={'ensure_ascii': False})
+        return FastJsonResponse(result, fragments=engine.ruleset.result_fragments)
         
+    except detail.DetailError as e:
+        return JsonResponse({
+            'error': 'invalid_request',
+            'message': str(e)
+        }, status=400, json_dumps_params={'ensure_ascii': False})
     except Exception as e:
         return JsonResponse({
             'error': str(e),
@@ -58,54 +82,417 @@ def diagnosis_form(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@rate_limit(html=True)
 def submit_diagnosis(request):
     """診断フォームの送信処理"""
     try:
         # フォームデータの取得
-        applicant_data = {
-            'nationality': request.POST.get('nationality', ''),
-            'education': {
-                'degree': request.POST.get('degree', ''),
-                'major': request.POST.get('major', ''),
-                'university': request.POST.get('university', ''),
-            },
-            'experience': [
-                {
-                    'years': int(request.POST.get('experience_years', 0)),
-                    'field': request.POST.get('experience_field', ''),
-                }
-            ] if request.POST.get('experience_years') else [],
-            'qualifications': [q.strip() for q in request.POST.get('qualifications', '').split(',') if q.strip()],
-            'job_details': {
-                'industry': request.POST.get('industry', ''),
-                'position': request.POST.get('position', ''),
-                'duties': request.POST.get('duties', ''),
-            },
-            'salary': int(request.POST.get('salary', 0)) if request.POST.get('salary') else 0,
-            'company_info': {
-                'name': request.POST.get('company_name', ''),
-            }
-        }
+        applicant_data = applicant_data_from_form(request.POST)
         
         # 診断実行
         engine = VisaDiagnosisEngine()
         result = engine.diagnose(applicant_data)
         
         # セッション保存
-        session_id = str(uuid.uuid4())
+        session_id = result['diagnosis_id']  # 診断IDをそのままセッションIDとして使う
         DiagnosisSession.objects.create(
             session_id=session_id,
             status='completed',
             applicant_data=applicant_data,
-            diagnosis_result=result
+            diagnosis_result=result,
+            ruleset_version=engine.ruleset.version
         )
         
-        return render(request, 'visa_diagnosis/result.html', {
-            'result': result,
-            'session_id': session_id
+        # 結果ページへリダイレクト（再読み込みで診断を再実行しない）
+        return redirect(_session_result_url(session_id))
+        
+    except Exception as e:
+        return render(request, 'visa_diagnosis/error.html', {
+            'error_message': f'診断処理中にエラーが発生しました: {str(e)}'
+        })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@rate_limit(bucket_name='batch')
+def api_hsp_points(request):
+    """高度専門職ポイント計算API（一括）"""
+    try:
+        data = json.loads(request.body)
+        candidates = data.get('candidates', [])
+        
+        if len(candidates) > settings.HSP_POINTS_BATCH_LIMIT:
+            return JsonResponse({
+                'error': 'too_many_candidates',
+                'message': f'一度に計算できるのは{settings.HSP_POINTS_BATCH_LIMIT}件までです'
+            }, status=400, json_dumps_params={'ensure_ascii': False})
+        
+        return FastJsonResponse({
+            'pass_line': hsp_points.PASS_LINE,
+            'results': hsp_points.score_batch(candidates),
         })
         
+    except Exception as e:
+        return JsonResponse({
+            'error': str(e),
+            'message': 'ポイント計算中にエラーが発生しました'
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@rate_limit(bucket_name='batch')
+def api_what_if(request):
+    """What-if分析API（報酬・経験年数・資格を変化させたスコア面）"""
+    try:
+        data = json.loads(request.body)
+        engine = VisaDiagnosisEngine()
+        result = whatif.sweep(engine, data.get('applicant', {}), data)
+        return FastJsonResponse(result)
+        
+    except whatif.WhatIfError as e:
+        return JsonResponse({
+            'error': 'invalid_request',
+            'message': str(e)
+        }, status=400, json_dumps_params={'ensure_ascii': False})
+    except Exception as e:
+        return JsonResponse({
+            'error': str(e),
+            'message': 'What-if分析中にエラーが発生しました'
+        }, status=500)
+
+
+# ---------------------------------------------------------------------------
+# 非同期版（ASGIサーバー用）
+# AI応答を待つ間ワーカーを占有しない。settings.ASYNC_VIEWS=Trueで有効化。
+# ---------------------------------------------------------------------------
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@rate_limit()
+async def diagnose_async(request):
+    """診断API（非同期版）"""
+    try:
+        # リクエストボディからデータ取得
+        data = json.loads(request.body)
+        spec = detail.parse(request.GET.get('detail'), request.GET.get('fields'), request.GET.get('top'))
+        
+        # 診断エンジンの実行
+        engine = VisaDiagnosisEngine(ruleset=await sync_to_async(get_ruleset)())
+        result = await engine.adiagnose(data, spec)
+        
+        # セッションの保存
+        session_id = result['diagnosis_id']  # 診断IDをそのままセッションIDとして使う
+        await DiagnosisSession.objects.acreate(
+            session_id=session_id,
+            status='completed',
+            applicant_data=data,
+            diagnosis_result=result,
+            ruleset_version=engine.ruleset.version
+        )
+        
+        result['session_id'] = session_id
+        result['access_token'] = identifiers.access_token(session_id)  # 取得API・結果ページの ?token=
+        
+        return FastJsonResponse(result, fragments=engine.ruleset.result_fragments)
+        
+    except detail.DetailError as e:
+        return JsonResponse({
+            'error': 'invalid_request',
+            'message': str(e)
+        }, status=400, json_dumps_params={'ensure_ascii': False})
+    except Exception as e:
+        return JsonResponse({
+            'error': str(e),
+            'message': '診断処理中にエラーが発生しました'
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@rate_limit(html=True)
+async def submit_diagnosis_async(request):
+    """診断フォームの送信処理（非同期版）"""
+    try:
+        # フォームデータの取得
+        applicant_data = applicant_data_from_form(request.POST)
+        
+        # 診断実行
+        engine = VisaDiagnosisEngine(ruleset=await sync_to_async(get_ruleset)())
+        result = await engine.adiagnose(applicant_data)
+        
+        # セッション保存
+        session_id = result['diagnosis_id']  # 診断IDをそのままセッションIDとして使う
+        await DiagnosisSession.objects.acreate(
+            session_id=session_id,
+            status='completed',
+            applicant_data=applicant_data,
+            diagnosis_result=result,
+            ruleset_version=engine.ruleset.version
+        )
+        
+        # 結果ページへリダイレクト（再読み込みで診断を再実行しない）
+        return redirect(_session_result_url(session_id))
+        
     except Exception as e:
         return render(request, 'visa_diagnosis/error.html', {
             'error_message': f'診断処理中にエラーが発生しました: {str(e)}'
         })
+
+
+def _catalog_etag(request, code=None):
+    """カタログのETag（ルールセットのバージョン）"""
+    ruleset = get_ruleset()
+    if code is not None and code not in ruleset.catalog_detail_json:
+        return None
+    return ruleset.version
+
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(public=True, max_age=settings.CATALOG_CACHE_MAX_AGE)
+@etag(_catalog_etag)
+def api_visa_list(request):
+    """在留資格カタログAPI（一覧）"""
+    return HttpResponse(get_ruleset().catalog_json, content_type='application/json; charset=utf-8')
+
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(public=True, max_age=settings.CATALOG_CACHE_MAX_AGE)
+@etag(_catalog_etag)
+def api_visa_detail(request, code):
+    """在留資格カタログAPI（個別）"""
+    body = get_ruleset().catalog_detail_json.get(code)
+    if body is None:
+        return JsonResponse({
+            'error': 'not_found',
+            'message': f'在留資格 {code} は存在しません'
+        }, status=404, json_dumps_params={'ensure_ascii': False})
+    return HttpResponse(body, content_type='application/json; charset=utf-8')
+
+
+@require_http_methods(["GET"])
+def api_session_search(request):
+    """診断セッション検索API（管理者用）"""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'error': 'forbidden',
+            'message': '管理者としてログインしてください'
+        }, status=403, json_dumps_params={'ensure_ascii': False})
+    
+    try:
+        limit = min(int(request.GET.get('limit', 50)), settings.SESSION_SEARCH_MAX_LIMIT)
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        return JsonResponse({
+            'error': 'invalid_request',
+            'message': 'limit・offsetは整数で指定してください'
+        }, status=400, json_dumps_params={'ensure_ascii': False})
+    
+    filters = {key: request.GET.get(key, '') for key in search.FACETS}
+    queryset = search.search_documents(request.GET.get('q', ''), filters)
+    
+    # 1件多く取得して次ページの有無を判定（件数の全数カウントはしない）
+    rows = list(queryset.values(
+        'session__session_id', 'status', 'nationality', 'industry', 'position',
+        'jlpt_level', 'top_visa_code', 'top_score', 'created_at'
+    )[offset:offset + limit + 1])
+    response = {
+        'results': [
+            {
+                'session_id': row.pop('session__session_id'),
+                **row,
+                'created_at': row['created_at'].isoformat(),
+            }
+            for row in rows[:limit]
+        ],
+        'offset': offset,
+        'limit': limit,
+        'has_more': len(rows) > limit,
+    }
+    if request.GET.get('facets'):
+        response['facets'] = search.facet_counts(queryset)
+    
+    return FastJsonResponse(response)
+
+
+@require_http_methods(["GET"])
+def api_session_export(request):
+    """診断セッションのエクスポートAPI（管理者用、CSV / JSONL）"""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'error': 'forbidden',
+            'message': '管理者としてログインしてください'
+        }, status=403, json_dumps_params={'ensure_ascii': False})
+    
+    try:
+        queryset = export.filter_sessions(request.GET)
+        return export.streaming_response(
+            queryset,
+            fmt=request.GET.get('format', 'csv'),
+            compress=request.GET.get('gzip') in ('1', 'true'),
+        )
+    except export.ExportError as e:
+        return JsonResponse({
+            'error': 'invalid_request',
+            'message': str(e)
+        }, status=400, json_dumps_params={'ensure_ascii': False})
+
+
+def _session_result_url(session_id):
+    """診断結果ページのURL（アクセストークン付き）"""
+    url = reverse('visa_diagnosis:session_result', args=[session_id])
+    return f'{url}?{urlencode({"token": identifiers.access_token(session_id)})}'
+
+
+def _session_response(request, session_id, build):
+    """
+    保存済みの診断セッションのレスポンス（診断エンジンは実行しない）
+
+    閲覧できるのはアクセストークン（?token=）を持つ診断した本人と管理者のみ。
+    それ以外は存在しない場合と同じくNoneを返す（セッションIDは秘密の値ではないため）。
+    ETagが一致すれば304を返し、完了したセッションはブラウザにキャッシュさせる。
+    """
+    if not (request.user.is_staff or identifiers.verify_access_token(session_id, request.GET.get('token', ''))):
+        return None
+    entry = session_store.get_session(session_id)
+    if entry is None:
+        return None
+    response = get_conditional_response(request, etag=entry['etag']) or build(entry)
+    response.headers['ETag'] = entry['etag']
+    patch_cache_control(response, **session_store.cache_control(entry))
+    return response
+
+
+@require_http_methods(["GET", "HEAD"])
+def api_session_detail(request, session_id):
+    """診断セッション取得API（保存済みの診断結果とAI分析の状態）"""
+    response = _session_response(request, session_id, lambda entry: FastJsonResponse(entry['payload']))
+    if response is None:
+        return JsonResponse({
+            'error': 'not_found',
+            'message': f'診断セッション {session_id} は存在しません'
+        }, status=404, json_dumps_params={'ensure_ascii': False})
+    return response
+
+
+@require_http_methods(["GET", "HEAD"])
+def session_result(request, session_id):
+    """診断結果ページ（保存済みの診断結果を表示）"""
+    response = _session_response(request, session_id, lambda entry: render(request, 'visa_diagnosis/result.html', {
+        'result': entry['payload']['diagnosis_result'],
+        'session_id': session_id
+    }))
+    if response is None:
+        return render(request, 'visa_diagnosis/error.html', {
+            'error_message': f'診断セッション {session_id} は存在しません'
+        }, status=404)
+    return response
+
+
+# ---------------------------------------------------------------------------
+# 一括診断（名簿のアップロード → run_diagnosis_worker が処理）
+# ---------------------------------------------------------------------------
+
+def _forbidden():
+    return JsonResponse({
+        'error': 'forbidden',
+        'message': '管理者としてログインしてください'
+    }, status=403, json_dumps_params={'ensure_ascii': False})
+
+
+def _cohort_job_or_404(job_id):
+    job = CohortJob.objects.filter(job_id=job_id).first()
+    if job is None:
+        return None, JsonResponse({
+            'error': 'not_found',
+            'message': f'一括診断ジョブ {job_id} は存在しません'
+        }, status=404, json_dumps_params={'ensure_ascii': False})
+    return job, None
+
+
+@staff_member_required
+def cohort_upload(request):
+    """一括診断ページ（名簿のアップロードと進捗の表示、管理者用）"""
+    return render(request, 'visa_diagnosis/cohort_upload.html', {
+        'jobs': CohortJob.objects.all()[:20],
+        'max_applicants': settings.COHORT_MAX_APPLICANTS,
+        'csv_headers': ', '.join(dict.fromkeys(cohorts.CSV_HEADER_ALIASES.values())),
+    })
+
+
+# ブラウザのセッションで認証するためCSRF検証は外さない（X-CSRFTokenヘッダーで送る）
+@require_http_methods(["POST"])
+def api_cohort_create(request):
+    """一括診断ジョブの登録API（名簿のアップロード、管理者用）"""
+    if not request.user.is_staff:
+        return _forbidden()
+    
+    try:
+        upload = request.FILES.get('file')
+        if upload is not None:
+            if upload.size > cohorts.MAX_UPLOAD_BYTES:
+                raise cohorts.CohortError(f'名簿ファイルは{cohorts.MAX_UPLOAD_BYTES // (1024 * 1024)}MBまでです')
+            fmt = request.POST.get('format') or cohorts.roster_format(upload.name)
+            applicants = cohorts.parse_roster(upload.read(), fmt)
+            name = request.POST.get('name') or upload.name
+        else:
+            applicants = cohorts.parse_roster(request.body, 'json')
+            name = request.GET.get('name', '')
+    except cohorts.CohortError as e:
+        return JsonResponse({
+            'error': 'invalid_roster',
+            'message': str(e)
+        }, status=400, json_dumps_params={'ensure_ascii': False})
+    
+    job = cohorts.create_job(applicants, name=name, created_by=request.user.get_username())
+    progress_url = reverse('visa_diagnosis:api_cohort_detail', args=[job.job_id])
+    response = FastJsonResponse({
+        'job_id': job.job_id,
+        'status': job.status,
+        'total': job.total,
+        'progress_url': progress_url,
+        'results_url': reverse('visa_diagnosis:api_cohort_results', args=[job.job_id]),
+    }, status=202)
+    response['Location'] = progress_url
+    return response
+
+
+@never_cache
+@require_http_methods(["GET"])
+def api_cohort_detail(request, job_id):
+    """一括診断ジョブの進捗API（処理済み件数・残り時間の見込み・失敗行、管理者用）"""
+    if not request.user.is_staff:
+        return _forbidden()
+    job, not_found = _cohort_job_or_404(job_id)
+    if not_found:
+        return not_found
+    return FastJsonResponse(cohorts.progress(job))
+
+
+@require_http_methods(["GET"])
+def api_cohort_results(request, job_id):
+    """一括診断ジョブの結果のダウンロードAPI（名簿の行順のCSV / JSONL、管理者用）"""
+    if not request.user.is_staff:
+        return _forbidden()
+    job, not_found = _cohort_job_or_404(job_id)
+    if not_found:
+        return not_found
+    if job.status not in ('completed', 'failed'):
+        return JsonResponse({
+            'error': 'not_finished',
+            'message': f'一括診断ジョブはまだ完了していません（{job.processed + job.failed}/{job.total}件）'
+        }, status=409, json_dumps_params={'ensure_ascii': False})
+    
+    try:
+        return export.rows_response(
+            cohorts.RESULT_HEADERS,
+            cohorts.result_rows(job),
+            fmt=request.GET.get('format', 'csv'),
+            compress=request.GET.get('gzip') in ('1', 'true'),
+            basename=f'cohort_{job.job_id}',
+        )
+    except export.ExportError as e:
+        return JsonResponse({
+            'error': 'invalid_request',
+            'message': str(e)
+        }, status=400, json_dumps_params={'ensure_ascii': False})
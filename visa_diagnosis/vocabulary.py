@@ -0,0 +1,316 @@
+"""
+語彙の正規化 - 学歴・日本語能力・技能試験の表記揺れを構造化した値に変換
+
+語彙はすべてデータとして定義し、1つのキーワードオートマトン（Aho-Corasick法）に
+コンパイルする。自由記述（学歴・保有資格・要件の文言）はNFKC正規化・小文字化した上で
+1回の走査で照合し、最左最長一致で重ならない語を取り出す。
+
+英数字で始まる・終わる語は前後が英数字でない場合のみ一致とする
+（「N1」が「CN100」などの一部に一致しないように）。
+"""
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# 語彙
+# ---------------------------------------------------------------------------
+
+# 学位（低い順）
+DEGREE_LEVELS = (
+    'none', 'high_school', 'vocational', 'associate', 'bachelor', 'master', 'professional_master', 'doctor',
+)
+
+DEGREE_TERMS = {
+    'high_school': ('高校', '高等学校', '高卒', 'high school'),
+    'vocational': ('専門学校', '専門士', '高度専門士', '専修学校', '専門課程', 'diploma'),
+    'associate': ('短期大学', '短大', '準学士', '高等専門学校', '高専', 'associate degree'),
+    'bachelor': ('学士', '大学', '大学卒', '大卒', '学部卒', 'bachelor', 'bachelors', "bachelor's",
+                 'bsc', 'b.sc', 'b.s.', 'b.a.'),
+    'master': ('修士', '大学院', 'master', 'masters', "master's", 'msc', 'm.sc', 'm.s.', 'm.a.', 'meng'),
+    'professional_master': ('mba', 'mot', '専門職学位', '専門職修士', '専門職大学院', '法務博士'),
+    'doctor': ('博士', 'phd', 'ph.d', 'ph.d.', 'doctor', 'doctoral', 'doctorate'),
+}
+
+# 日本語能力試験（数値はNレベル、Noneはレベル指定なし）
+# 旧試験の級は 1級≒N1、2級≒N2、3級≒N4、4級≒N5 として扱う
+JLPT_TERMS = {
+    None: ('日本語能力試験', 'jlpt'),
+    1: ('n1', 'jlptn1', 'jlpt-n1', '日本語能力試験1級'),
+    2: ('n2', 'jlptn2', 'jlpt-n2', '日本語能力試験2級'),
+    3: ('n3', 'jlptn3', 'jlpt-n3'),
+    4: ('n4', 'jlptn4', 'jlpt-n4', '日本語能力試験3級'),
+    5: ('n5', 'jlptn5', 'jlpt-n5', '日本語能力試験4級'),
+}
+
+# 国際交流基金日本語基礎テスト（特定技能1号でN4相当として扱われる）
+JFT_TERMS = ('国際交流基金日本語基礎テスト', '日本語基礎テスト', 'jft-basic', 'jft basic', 'jftbasic', 'jft')
+
+# 介護日本語評価試験（技能試験ではなく日本語の試験）
+CARE_JAPANESE_TERMS = ('介護日本語評価試験',)
+
+# 技能試験（分野別、''は分野の記載なし）
+SKILL_TEST_TERMS = {
+    '': ('特定技能評価試験', '技能評価試験', '技能測定試験', '特定技能1号評価試験', '特定技能2号評価試験'),
+    'care': ('介護技能評価試験',),
+    'building_cleaning': ('ビルクリーニング技能評価試験',),
+    'manufacturing': ('製造分野特定技能1号評価試験',),
+    'construction': ('建設分野特定技能評価試験',),
+    'automobile': ('自動車整備分野特定技能評価試験',),
+    'aviation': ('航空分野技能評価試験',),
+    'accommodation': ('宿泊業技能測定試験',),
+    'agriculture': ('農業技能測定試験',),
+    'fishery': ('漁業技能測定試験',),
+    'food_manufacturing': ('飲食料品製造業技能測定試験',),
+    'food_service': ('外食業技能測定試験',),
+}
+
+# 在留資格「特定技能」の名称（試験名ではない）
+# 保有資格に書かれていれば技能試験の合格として扱うが、要件の文言では技能試験の要否の判定に使わない
+# （「特定技能1号の在留資格」のように資格名を挙げただけの要件を技能試験の要件としない）
+SKILL_STATUS_TERMS = {
+    '': ('特定技能',),
+    'building_cleaning': ('ビルクリーニング分野特定技能',),
+    'manufacturing': ('製造分野特定技能',),
+    'construction': ('建設分野特定技能',),
+    'accommodation': ('宿泊分野特定技能',),
+    'food_manufacturing': ('飲食料品製造業特定技能',),
+    'food_service': ('外食業特定技能',),
+}
+SKILL_STATUS = '特定技能'
+
+# 技能試験と同じ資格に書かれた分野名（例: 「特定技能評価試験（介護）」）
+SKILL_FIELD_TERMS = {
+    'care': ('介護',),
+    'building_cleaning': ('ビルクリーニング',),
+    'manufacturing': ('製造', '素形材', '産業機械', '電気・電子情報'),
+    'construction': ('建設',),
+    'automobile': ('自動車整備',),
+    'aviation': ('航空',),
+    'accommodation': ('宿泊',),
+    'agriculture': ('農業',),
+    'fishery': ('漁業',),
+    'food_manufacturing': ('飲食料品製造',),
+    'food_service': ('外食',),
+}
+
+# ---------------------------------------------------------------------------
+# キーワードオートマトン
+# ---------------------------------------------------------------------------
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    """NFKC正規化・小文字化し、連続する空白を1つにまとめる"""
+    return _SPACES.sub(' ', unicodedata.normalize('NFKC', text or '').lower()).strip()
+
+
+def _is_ascii_alnum(char: str) -> bool:
+    return char.isascii() and char.isalnum()
+
+
+class KeywordAutomaton:
+    """複数キーワードの同時照合（Aho-Corasick法）"""
+
+    def __init__(self, vocabulary: Iterable[Tuple[str, Any]]):
+        """
+        Args:
+            vocabulary: (キーワード, 値) の列。キーワードは normalize() してから登録する
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._outputs: List[List[Tuple[int, Any]]] = [[]]
+        for keyword, value in vocabulary:
+            keyword = normalize(keyword)
+            if not keyword:
+                continue
+            node = 0
+            for char in keyword:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._outputs.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            if (len(keyword), value) not in self._outputs[node]:
+                self._outputs[node].append((len(keyword), value))
+
+        # 失敗遷移（幅優先で構築し、出力を失敗先から引き継ぐ）
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+    def find(self, text: str) -> List[Tuple[int, int, Any]]:
+        """
+        正規化済みのテキストから語を抽出
+
+        Returns:
+            重ならない一致 (開始位置, 終了位置, 値) の出現順のリスト（最左最長一致）
+        """
+        matches = []
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._outputs[node]:
+                start = end - length
+                if _is_ascii_alnum(text[start]) and start > 0 and _is_ascii_alnum(text[start - 1]):
+                    continue
+                if _is_ascii_alnum(text[end - 1]) and end < len(text) and _is_ascii_alnum(text[end]):
+                    continue
+                matches.append((start, end, value))
+
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        last_end = 0
+        for start, end, value in matches:
+            if start >= last_end:
+                selected.append((start, end, value))
+                last_end = end
+        return selected
+
+
+def _compile() -> KeywordAutomaton:
+    entries = []
+    for level, terms in DEGREE_TERMS.items():
+        entries.extend((term, ('degree', level)) for term in terms)
+    for level, terms in JLPT_TERMS.items():
+        entries.extend((term, ('jlpt', level)) for term in terms)
+    entries.extend((term, ('jft', 4)) for term in JFT_TERMS)
+    entries.extend((term, ('care_japanese', None)) for term in CARE_JAPANESE_TERMS)
+    for field, terms in SKILL_TEST_TERMS.items():
+        entries.extend((term, ('skill_test', field)) for term in terms)
+    for field, terms in SKILL_STATUS_TERMS.items():
+        entries.extend((term, ('skill_status', field)) for term in terms)
+    for field, terms in SKILL_FIELD_TERMS.items():
+        entries.extend((term, ('skill_field', field)) for term in terms)
+    return KeywordAutomaton(entries)
+
+
+@lru_cache(maxsize=None)
+def automaton() -> KeywordAutomaton:
+    """語彙の照合器（起動を速くするため初回使用時に構築）"""
+    return _compile()
+
+
+def extract(text: str) -> List[Tuple[str, Any]]:
+    """テキスト中の語彙を (種別, 値) の出現順のリストで取得"""
+    return [value for _, _, value in automaton().find(normalize(text))]
+
+
+# ---------------------------------------------------------------------------
+# 構造化
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Qualifications:
+    """保有資格の構造化結果"""
+    jlpt_level: Optional[int]         # 最上位のNレベル（1が最上位）
+    jft_basic: bool                   # 国際交流基金日本語基礎テスト
+    care_japanese: bool               # 介護日本語評価試験
+    skill_tests: Tuple[str, ...]      # 技能試験の分野（''は分野の記載なし）
+    unrecognized: Tuple[str, ...]     # 語彙に該当しない資格
+
+    @property
+    def jlpt_label(self) -> str:
+        return f'N{self.jlpt_level}' if self.jlpt_level else ''
+
+
+@dataclass(frozen=True)
+class ConditionTerms:
+    """要件の文言に含まれる基準"""
+    degree: Optional[str]        # 必要な学位（最も低いもの）
+    jlpt_level: Optional[int]    # 必要なNレベル（日本語能力試験の記載のみの場合は5）
+    accepts_jft: bool            # 日本語基礎テストでも可
+    skill_test: bool             # 技能試験の合格が必要
+
+
+def degree_rank(level: str) -> int:
+    return DEGREE_LEVELS.index(level)
+
+
+@lru_cache(maxsize=4096)
+def parse_degree(text: str) -> str:
+    """学歴の記述から最上位の学位（DEGREE_LEVELSの値）を取得"""
+    levels = [value for kind, value in extract(text) if kind == 'degree']
+    return max(levels, key=degree_rank) if levels else 'none'
+
+
+@lru_cache(maxsize=4096)
+def _parse_qualification(text: str) -> Tuple[Tuple[str, Any], ...]:
+    terms = [('skill_test', value) if kind == 'skill_status' else (kind, value) for kind, value in extract(text)]
+    skill_tests = [value for kind, value in terms if kind == 'skill_test']
+    if skill_tests and not any(skill_tests):
+        # 分野の記載がない技能試験は、同じ資格に書かれた分野名で補う
+        fields = [value for kind, value in terms if kind == 'skill_field']
+        if fields:
+            terms = [t for t in terms if t[0] != 'skill_test'] + [('skill_test', f) for f in fields]
+    return tuple(t for t in terms if t[0] != 'skill_field')
+
+
+@lru_cache(maxsize=4096)
+def _parse_qualifications(qualifications: Tuple[str, ...]) -> Qualifications:
+    jlpt_levels, skill_tests, unrecognized = [], [], []
+    jft_basic = care_japanese = False
+    for q in qualifications:
+        terms = _parse_qualification(q)
+        if not terms:
+            unrecognized.append(q)
+        for kind, value in terms:
+            if kind == 'jlpt' and value is not None:
+                jlpt_levels.append(value)
+            elif kind == 'jft':
+                jft_basic = True
+            elif kind == 'care_japanese':
+                care_japanese = True
+            elif kind == 'skill_test' and value not in skill_tests:
+                skill_tests.append(value)
+    return Qualifications(
+        jlpt_level=min(jlpt_levels) if jlpt_levels else None,
+        jft_basic=jft_basic,
+        care_japanese=care_japanese,
+        skill_tests=tuple(skill_tests),
+        unrecognized=tuple(unrecognized),
+    )
+
+
+def parse_qualifications(qualifications: Iterable[str]) -> Qualifications:
+    """保有資格のリストを構造化"""
+    return _parse_qualifications(tuple(q for q in qualifications or [] if q))
+
+
+@lru_cache(maxsize=1024)
+def parse_condition(condition: str) -> ConditionTerms:
+    """
+    要件の文言から学位・日本語能力・技能試験の基準を取得
+
+    技能試験は「特定技能」の名称と試験名の両方を含む文言のみ要件とする
+    （「特定産業分野の技能評価試験」のように「特定技能」を含まない文言は、その他の資格として扱う）。
+    """
+    text = normalize(condition)
+    matches = automaton().find(text)
+    terms = [value for _, _, value in matches]
+    degrees = [value for kind, value in terms if kind == 'degree']
+    jlpt = [value for kind, value in terms if kind == 'jlpt']
+    names_status = any(
+        value[0] in ('skill_test', 'skill_status') and SKILL_STATUS in text[start:end]
+        for start, end, value in matches
+    )
+    return ConditionTerms(
+        degree=min(degrees, key=degree_rank) if degrees else None,
+        jlpt_level=max((level for level in jlpt if level is not None), default=5) if jlpt else None,
+        accepts_jft=any(kind == 'jft' for kind, _ in terms),
+        skill_test=names_status and any(kind == 'skill_test' for kind, _ in terms),
+    )
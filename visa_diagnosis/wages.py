@@ -0,0 +1,261 @@
+"""
+賃金の参照値 - 業種×職種×都道府県×経験年数帯ごとの月額賃金の分布
+
+「日本人が従事する場合に受ける報酬と同等額以上」の報酬要件の判定に用いる。
+DBの WageReference（import_wage_table コマンドで統計のCSVから取り込む）を
+ルールセットの構築時に WageTable へ変換し、ダイジェストごとのキーで共有キャッシュに載せる。
+
+WageTable は（業種, 職種, 都道府県）の組ごとに経験年数帯の下限を昇順に並べた配列を持ち、
+組は辞書、経験年数帯は二分探索で引くため、1回の参照は行数nに対してO(log n)で済む。
+該当する組がなければ都道府県 → 業種 → 職種の順に「計」（全国・全業種・全職種）へ広げる。
+"""
+import csv
+import hashlib
+import re
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple
+
+from . import vocabulary
+
+PERCENTILES = ('p10', 'p25', 'p50', 'p75', 'p90')
+PERCENTILE_LABELS = {
+    'p10': '第1十分位',
+    'p25': '第1四分位',
+    'p50': '中央値',
+    'p75': '第3四分位',
+    'p90': '第9十分位',
+}
+
+# 「計」を表す値（空文字と同じく全国・全業種・全職種として扱う）
+_TOTAL = frozenset({'', '計', '全国', '産業計', '全産業', '職種計', '全職種'})
+
+# 経験年数帯の下限の上限（array('H')に収まる値）
+_MAX_YEARS = 0xFFFF
+
+# 診断フォームの業種 → 賃金構造基本統計調査の産業（大分類）
+# 統計の産業名と一致しない業種は、そのままでは全業種の参照値に広がってしまう
+INDUSTRY_CATEGORIES = {
+    'IT・ソフトウェア': '情報通信業',
+    '製造業': '製造業',
+    '商社・貿易': '卸売業，小売業',
+    '飲食業': '宿泊業，飲食サービス業',
+    '建設業': '建設業',
+    '介護': '医療，福祉',
+    '宿泊業': '宿泊業，飲食サービス業',
+    '農業': '農業，林業',
+    'サービス業': 'サービス業（他に分類されないもの）',
+    'その他': '',
+}
+
+# 統計表の産業名の前の記号（「Ｅ製造業」「E 製造業」）
+_INDUSTRY_CODE = re.compile(r'^[a-t] ?(?=[^\x00-\x7f])')
+
+
+def is_equivalent_condition(condition: str) -> bool:
+    """「日本人と同等以上」の報酬要件か"""
+    return '日本人と同等' in condition or '同等以上' in condition or '同等額' in condition
+
+
+def area_key(value: str) -> str:
+    """業種・職種の照合キー（「計」は空文字）"""
+    key = vocabulary.normalize(value)
+    return '' if key in _TOTAL else key
+
+
+def industry_key(value: str) -> str:
+    """業種の照合キー（産業の記号を除き、フォームの業種は統計の産業に読み替える）"""
+    key = _INDUSTRY_CODE.sub('', area_key(value))
+    return _INDUSTRY_KEYS.get(key, key)
+
+
+def prefecture_key(value: str) -> str:
+    """都道府県の照合キー（「東京都」「東京」はどちらも「東京」、全国は空文字）"""
+    key = area_key(value)
+    if key.endswith(('県', '府')) or key == '東京都':
+        key = key[:-1]
+    return key
+
+
+_INDUSTRY_KEYS = {area_key(form): area_key(category) for form, category in INDUSTRY_CATEGORIES.items()}
+
+
+class WageMatch(NamedTuple):
+    """参照値の検索結果"""
+    amount: int                 # 月額（円）
+    industry: str               # 空文字は全業種
+    occupation: str             # 空文字は全職種
+    prefecture: str             # 空文字は全国
+    experience_years_min: int
+
+    @property
+    def label(self) -> str:
+        """判定理由に表示する参照値の区分（例: 介護・介護職員・東京都・経験5年以上）"""
+        parts = [
+            self.industry or '全業種',
+            self.occupation or '全職種',
+            self.prefecture or '全国',
+        ]
+        if self.experience_years_min:
+            parts.append(f'経験{self.experience_years_min}年以上')
+        return '・'.join(parts)
+
+
+class WageTable:
+    """賃金の参照値の不変・省メモリな表（ダイジェストごとのキーで共有キャッシュに載せる）"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]] = ()):
+        """
+        Args:
+            rows: (業種, 職種, 都道府県, 経験年数帯の下限, p10, p25, p50, p75, p90) の並び
+                （金額は月額の円、Noneは値なし）
+        """
+        # (業種, 職種, 都道府県) の元の値 → 照合キー（正規化は組ごとに1回）
+        keys: Dict[Tuple[str, str, str], Tuple[str, str, str]] = {}
+        names: Dict[Tuple[str, str, str], Tuple[str, str, str]] = {}
+        # 照合キー → 経験年数帯の下限 → 賃金（同じ区分の重複は後の行で上書き）
+        bands: Dict[Tuple[str, str, str], Dict[int, Sequence[Any]]] = {}
+        for industry, occupation, prefecture, years, *values in rows:
+            raw = (industry or '', occupation or '', prefecture or '')
+            group = keys.get(raw)
+            if group is None:
+                group = keys[raw] = (industry_key(raw[0]), area_key(raw[1]), prefecture_key(raw[2]))
+                names.setdefault(group, tuple(name if k else '' for name, k in zip(raw, group)))
+                bands.setdefault(group, {})
+            bands[group][min(max(int(years or 0), 0), _MAX_YEARS)] = values
+
+        ordered_years: List[int] = []
+        ordered_values: List[Sequence[Any]] = []
+        # (業種, 職種, 都道府県) の照合キー → (開始位置, 終了位置, 表示名)
+        self._groups: Dict[Tuple[str, str, str], Tuple[int, int, Tuple[str, str, str]]] = {}
+        for group in sorted(bands):
+            start = len(ordered_years)
+            for years, values in sorted(bands[group].items()):
+                ordered_years.append(years)
+                ordered_values.append(values)
+            self._groups[group] = (start, len(ordered_years), names[group])
+
+        self._bands = array('H', ordered_years)
+        self._values = {
+            p: array('i', [int(values[i] or 0) for values in ordered_values])
+            for i, p in enumerate(PERCENTILES)
+        }
+
+        digest = hashlib.sha256(self._bands.tobytes())
+        for p in PERCENTILES:
+            digest.update(self._values[p].tobytes())
+        for group, (start, end, _) in self._groups.items():
+            digest.update('\x1f'.join(group).encode('utf-8'))
+            digest.update(f'{start}:{end}'.encode('ascii'))
+        self.digest = digest.hexdigest()[:20] if self._bands else ''
+
+    def __len__(self) -> int:
+        return len(self._bands)
+
+    def lookup(self, industry_key: str, occupation_key: str, prefecture: str, years: int,
+               percentile: str = 'p25') -> Optional[WageMatch]:
+        """
+        参照値を検索
+
+        Args:
+            industry_key: 業種（industry_keyで正規化済み）
+            occupation_key: 職種（area_keyで正規化済み）
+            prefecture: 都道府県（prefecture_keyで正規化済み）
+            years: 実務経験年数
+            percentile: PERCENTILESのいずれか
+
+        Returns:
+            最も詳細な区分で見つかった参照値（なければNone）
+        """
+        if not self._groups:
+            return None
+        values = self._values[percentile]
+        for group in self._fallbacks(industry_key, occupation_key, prefecture):
+            found = self._groups.get(group)
+            if found is None:
+                continue
+            start, end, names = found
+            i = bisect_right(self._bands, years, start, end) - 1
+            if i >= start and values[i]:
+                return WageMatch(values[i], *names, self._bands[i])
+        return None
+
+    @staticmethod
+    def _fallbacks(industry: str, occupation: str, prefecture: str) -> Tuple[Tuple[str, str, str], ...]:
+        """検索する区分（詳細な順。空文字の項目があると重複するが、辞書を引き直すだけで結果は変わらない）"""
+        return (
+            (industry, occupation, prefecture), (industry, occupation, ''),
+            ('', occupation, prefecture), ('', occupation, ''),
+            (industry, '', prefecture), (industry, '', ''),
+            ('', '', prefecture), ('', '', ''),
+        )
+
+
+# WageReference・WageTableの行の並び
+FIELDS = ('industry', 'occupation', 'prefecture', 'experience_years_min', *PERCENTILES)
+
+# CSVの列名（英語・統計表の日本語の見出しのどちらでも可）
+CSV_COLUMNS = {
+    'industry': ('industry', '業種', '産業'),
+    'occupation': ('occupation', '職種'),
+    'prefecture': ('prefecture', '都道府県'),
+    'experience_years_min': ('experience_years_min', '経験年数', '経験年数階級'),
+    'p10': ('p10', '第1十分位', '第1・十分位数'),
+    'p25': ('p25', '第1四分位', '第1・四分位数'),
+    'p50': ('p50', '中央値'),
+    'p75': ('p75', '第3四分位', '第3・四分位数'),
+    'p90': ('p90', '第9十分位', '第9・十分位数'),
+}
+
+_LEADING_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+def _number(value: str, unit: int) -> Optional[int]:
+    """「1,234.5」→ 金額（円）。「-」「…」・空欄はNone"""
+    try:
+        return round(float(value.replace(',', '')) * unit)
+    except ValueError:
+        match = _LEADING_NUMBER.search(value)
+        return round(float(match.group()) * unit) if match else None
+
+
+def _years(value: str) -> int:
+    """経験年数帯の下限（「5～9年」→ 5、空欄は0）"""
+    match = _LEADING_NUMBER.search(value)
+    return min(int(float(match.group())), _MAX_YEARS) if match else 0
+
+
+def read_csv(f: TextIO, unit: int = 1) -> Iterator[Tuple[Any, ...]]:
+    """
+    CSVの各行をFIELDSの並びのタプルにして返す
+
+    Args:
+        f: CSVファイル（1行目は見出し）
+        unit: 金額の単位（円なら1、統計表の「千円」なら1000）
+
+    Raises:
+        ValueError: 業種・職種の列、または賃金の列がない場合
+    """
+    reader = csv.reader(f)
+    headers = {vocabulary.normalize(h): i for i, h in enumerate(next(reader, []))}
+    columns: Dict[str, int] = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if vocabulary.normalize(alias) in headers:
+                columns[field] = headers[vocabulary.normalize(alias)]
+                break
+    if 'occupation' not in columns and 'industry' not in columns:
+        raise ValueError('業種（industry）または職種（occupation）の列が必要です')
+    if not any(p in columns for p in PERCENTILES):
+        raise ValueError(f'賃金の列（{", ".join(PERCENTILES)}）が1つ以上必要です')
+
+    # 列がない項目は範囲外の位置にして空欄として読む
+    indexes = [columns.get(field, -1) for field in FIELDS]
+    for row in reader:
+        if not row:
+            continue
+        cells = [row[i].strip() if 0 <= i < len(row) else '' for i in indexes]
+        yield (
+            cells[0], cells[1], cells[2], _years(cells[3]),
+            *(_number(value, unit) for value in cells[4:]),
+        )
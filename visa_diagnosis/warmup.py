@@ -0,0 +1,73 @@
+"""
+起動時のウォームアップ - サーバープロセスの起動直後にバックグラウンドで準備する
+
+URLconf（ビュー・診断エンジンの読み込み）、ルールセット、語彙の照合器、関連性モデル、
+AI機能が有効ならanthropic SDKとクライアントを、最初のリクエストを待たずに準備する。
+どれも初回使用時に準備する作りのため、ウォームアップが終わる前にリクエストが来ても
+そのまま処理でき、同じ部品の準備はロックで1回にまとまる。
+
+wsgi.py・asgi.py から呼び出す（manage.pyのコマンドでは動かない）。
+gunicornの --preload のようにフォーク前に読み込む構成では WARMUP_ON_START=False にする。
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import connections
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    各部品を準備
+
+    Returns:
+        部品ごとの所要時間（ミリ秒）
+    """
+    from django.urls import get_resolver
+
+    from . import ai_integration, relevance, vocabulary
+    from .ruleset import get_ruleset
+
+    timings: Dict[str, float] = {}
+
+    def step(name: str, fn: Callable[[], object]):
+        started = time.perf_counter()
+        fn()
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    step('urls', lambda: get_resolver().url_patterns)
+    step('ruleset', get_ruleset)
+    step('vocabulary', vocabulary.automaton)
+    step('relevance_model', relevance.get_model)
+    if settings.ENABLE_AI_FEATURES and settings.ANTHROPIC_API_KEY:
+        analyzer = ai_integration.get_analyzer(settings.ANTHROPIC_API_KEY)
+        if analyzer.is_available():
+            step('anthropic', lambda: analyzer.client)
+    return timings
+
+
+def _run():
+    try:
+        timings = warm_up()
+        print(f"ウォームアップ完了: {', '.join(f'{name} {ms}ms' for name, ms in timings.items())}")
+    except Exception as e:
+        # マイグレーション前など。各部品は最初のリクエストで改めて準備される
+        print(f"警告: ウォームアップに失敗しました: {e}")
+    finally:
+        connections.close_all()
+
+
+def start_background_warmup() -> Optional[threading.Thread]:
+    """ウォームアップのスレッドを開始（WARMUP_ON_START=Falseの場合・開始済みの場合は何もしない）"""
+    global _thread
+    if not settings.WARMUP_ON_START:
+        return None
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='visa-warmup', daemon=True)
+            _thread.start()
+    return _thread
@@ -0,0 +1,172 @@
+"""
+What-if分析 - 報酬・経験年数・資格を変化させたときのスコア面
+
+各要件について、変化させる項目のうち判定に影響するもの（CompiledRequirement.depends_on）
+だけの組み合わせで再判定し、影響しない要件は1回だけ判定してスコアに足し込む。
+"""
+from itertools import product
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence
+
+from django.conf import settings
+
+from . import detail
+from .profile import ApplicantProfile
+
+if TYPE_CHECKING:
+    from .logic import VisaDiagnosisEngine
+
+# 変化させる軸の順序（scoresの添字順: [qualifications][experience_years][salary]）
+AXES = ('qualifications', 'experience_years', 'salary')
+
+# 軸と、その軸が書き換える申請者情報のキー
+AXIS_FIELDS = {
+    'salary': 'salary',
+    'experience_years': 'experience',
+    'qualifications': 'qualifications',
+}
+
+
+class WhatIfError(ValueError):
+    """What-if分析の入力エラー"""
+
+
+def _numeric_axis(spec: Any, name: str) -> List[int]:
+    """{'values': [...]} または {'min', 'max', 'step'} から軸の値を生成"""
+    if isinstance(spec, dict) and 'values' in spec:
+        values = spec['values']
+    elif isinstance(spec, dict):
+        try:
+            start, stop, step = int(spec['min']), int(spec['max']), int(spec['step'])
+        except (KeyError, TypeError, ValueError):
+            raise WhatIfError(f'{name}には values、または min・max・step を指定してください')
+        if step <= 0 or stop < start:
+            raise WhatIfError(f'{name}の範囲指定が不正です')
+        if (stop - start) // step + 1 > settings.WHATIF_MAX_GRID_POINTS:
+            raise WhatIfError(f'{name}の点数が多すぎます（上限{settings.WHATIF_MAX_GRID_POINTS}点）')
+        values = list(range(start, stop + 1, step))
+    elif isinstance(spec, list):
+        values = spec
+    else:
+        raise WhatIfError(f'{name}の指定形式が不正です')
+    if not isinstance(values, list):
+        raise WhatIfError(f'{name}の values には整数のリストを指定してください')
+    try:
+        return [int(v) for v in values]
+    except (TypeError, ValueError):
+        raise WhatIfError(f'{name}の values には整数のリストを指定してください')
+
+
+def _qualifications_axis(spec: Any) -> List[List[str]]:
+    """追加で取得する資格の組の候補リスト（各候補は資格名のリスト、資格名1つの文字列も可）"""
+    if not isinstance(spec, list):
+        raise WhatIfError('qualificationsには資格の組のリストを指定してください')
+    options = []
+    for option in spec:
+        if isinstance(option, str):
+            option = [option]
+        if not isinstance(option, list) or not all(isinstance(q, str) for q in option):
+            raise WhatIfError('qualificationsの各候補には資格名のリスト（または資格名）を指定してください')
+        options.append(option)
+    return options
+
+
+def build_axes(profile: ApplicantProfile, spec: Dict[str, Any]) -> Dict[str, List[Any]]:
+    """リクエストの指定から各軸の値を決定（未指定の軸は現在値のみ）"""
+    axes = {
+        'salary': _numeric_axis(spec['salary'], 'salary') if 'salary' in spec else [profile.salary],
+        'experience_years': (
+            _numeric_axis(spec['experience_years'], 'experience_years')
+            if 'experience_years' in spec else [profile.total_years]
+        ),
+        # 資格は「追加で取得する資格の組」の候補リスト（[] は追加なし）
+        'qualifications': _qualifications_axis(spec.get('qualifications', [[]])) or [[]],
+    }
+
+    points = len(axes['salary']) * len(axes['experience_years']) * len(axes['qualifications'])
+    if points > settings.WHATIF_MAX_GRID_POINTS:
+        raise WhatIfError(f'グリッドが大きすぎます（{points}点、上限{settings.WHATIF_MAX_GRID_POINTS}点）')
+    return axes
+
+
+def apply_change(profile: ApplicantProfile, axis: str, value: Any) -> ApplicantProfile:
+    """申請者プロファイルの1項目を軸の値で置き換えたコピー（資格は追加）"""
+    if axis == 'salary':
+        return profile.vary(salary=value)
+    if axis == 'experience_years':
+        return profile.vary(total_years=value)
+    return profile.vary(added_qualifications=tuple(value))
+
+
+def _evaluate(engine: 'VisaDiagnosisEngine', requirement, profile: ApplicantProfile,
+              axes: Dict[str, List[Any]], used: Sequence[str]) -> Dict[tuple, bool]:
+    """要件を、影響する軸の値の組み合わせごとに判定"""
+    met = {}
+    for combo in product(*(range(len(axes[a])) for a in used)):
+        varied = profile
+        for axis, index in zip(used, combo):
+            varied = apply_change(varied, axis, axes[axis][index])
+        met[combo] = bool(engine._check_requirement(requirement, varied)['met'])
+    return met
+
+
+def sweep(engine: 'VisaDiagnosisEngine', applicant: Dict[str, Any], spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    候補となる各在留資格のスコア面を計算
+
+    Args:
+        engine: 診断エンジン
+        applicant: 申請者情報（diagnose()と同じ形式）
+        spec: 変化させる範囲 {salary, experience_years, qualifications}
+
+    Returns:
+        {'axes': {...}, 'options': [{'visa_category', 'current_score', 'scores'}]}
+    """
+    profile = ApplicantProfile.from_dict(applicant)
+    axes = build_axes(profile, spec)
+    shape = [len(axes[a]) for a in AXES]
+    varied_fields = {AXIS_FIELDS[a] for a in AXES if a in spec}
+
+    current = engine._score_candidates(profile, detail.SCORES_ONLY)
+    current_scores = {r['visa_category']['code']: r['match_score'] for r in current}
+
+    options = []
+    for visa in engine._candidate_visas(profile):
+        if not visa.requirements:
+            grid = [[[50] * shape[2] for _ in range(shape[1])] for _ in range(shape[0])]
+        else:
+            max_score = sum(req.weight for req in visa.requirements)
+            fixed = 0
+            # 加点の格子（[q][e][s]）に各要件の充足を足し込む
+            earned = [[[0] * shape[2] for _ in range(shape[1])] for _ in range(shape[0])]
+            for req in visa.requirements:
+                used = [a for a in AXES if AXIS_FIELDS[a] in req.depends_on and AXIS_FIELDS[a] in varied_fields]
+                if not used:
+                    if engine._check_requirement(req, profile)['met']:
+                        fixed += req.weight
+                    continue
+
+                met = _evaluate(engine, req, profile, axes, used)
+                positions = [AXES.index(a) for a in used]
+                for q, e, s in product(range(shape[0]), range(shape[1]), range(shape[2])):
+                    index = (q, e, s)
+                    if met[tuple(index[p] for p in positions)]:
+                        earned[q][e][s] += req.weight
+
+            grid = [
+                [[int((fixed + points) / max_score * 100) for points in row] for row in plane]
+                for plane in earned
+            ]
+
+        options.append({
+            'visa_category': {'code': visa.code, 'name_ja': visa.name_ja},
+            'current_score': current_scores.get(visa.code, 0),
+            'scores': grid,
+        })
+
+    options.sort(key=lambda o: o['current_score'], reverse=True)
+    return {
+        'axes': {a: axes[a] for a in AXES},
+        'axis_order': list(AXES),
+        'level_thresholds': {'◎ 強く推奨': 80, '○ 推奨': 60, '△ 条件付き可能': 40},
+        'options': options,
+    }
@@ -0,0 +1,46 @@
+"""
+gunicorn設定（Render.com用）
+gunicorn -c visa_system/gunicorn.conf.py visa_system.wsgi:application
+
+SQLiteはWebサービスのディスクにあるため、一括診断のワーカー（run_diagnosis_worker）を
+gunicornのマスタープロセスの子プロセスとして同じインスタンスで起動する。
+ワーカーが異常終了したら再起動し、gunicornの終了時にはSIGTERMで停止する
+（処理中の処理単位を保存してから終了する）。
+"""
+import subprocess
+import sys
+import threading
+import time
+
+RESTART_DELAY = 5  # 秒（ワーカーが終了してから再起動するまで）
+STOP_TIMEOUT = 60  # 秒（終了時に処理中の処理単位の保存を待つ時間）
+
+_worker = None
+_stopping = threading.Event()
+
+
+def _supervise(log):
+    global _worker
+    while not _stopping.is_set():
+        _worker = subprocess.Popen([sys.executable, 'manage.py', 'run_diagnosis_worker'])
+        log.info('run_diagnosis_worker を起動しました (pid: %s)', _worker.pid)
+        _worker.wait()
+        if _stopping.is_set():
+            break
+        # gunicornが子プロセスを回収するため終了コードは取得できないことがある
+        log.error('run_diagnosis_worker が終了しました。%s秒後に再起動します', RESTART_DELAY)
+        time.sleep(RESTART_DELAY)
+
+
+def when_ready(server):
+    threading.Thread(target=_supervise, args=(server.log,), name='diagnosis-worker', daemon=True).start()
+
+
+def on_exit(server):
+    _stopping.set()
+    if _worker is not None and _worker.poll() is None:
+        _worker.terminate()
+        try:
+            _worker.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            _worker.kill()
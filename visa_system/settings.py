@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Render.com用
+    'visa_diagnosis.middleware.CompressionMiddleware',  # JSON・HTMLのbrotli / gzip圧縮
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -70,6 +71,13 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'visa_system.wsgi.application'
+ASGI_APPLICATION = 'visa_system.asgi.application'
+
+# gunicornのワーカープロセス数（gunicornも同じ環境変数を読む。レート制限のシステムチェックに使う）
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# 診断ビューを非同期版にする（ASGIサーバーで起動する場合にTrue）
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
 
 
 # Database
@@ -128,3 +136,94 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # AI統合設定
 ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY', None)
 ENABLE_AI_FEATURES = bool(ANTHROPIC_API_KEY)
+# 専攻と職種の関連性・業務内容・改善提案を1回のAPI呼び出しで分析する（共通の指示はプロンプトキャッシュを使う）
+AI_COMBINED_ANALYSIS = os.environ.get('AI_COMBINED_ANALYSIS', 'False') == 'True'
+
+# キャッシュ設定
+# CACHE_PROFILE で選択（既定はローカルメモリ）。locmemはプロセスごと・再起動で消えるため、
+# 複数ワーカー・再起動後も共有するにはfile（同一ホスト）またはredis / memcached（共有サーバー）を指定する。
+# CACHE_LOCATION でファイルの保存先・サーバーのアドレスを上書きできる。
+CACHE_PROFILES = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'visa-system',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(BASE_DIR, '.django_cache')),
+    },
+    'redis': {  # redisパッケージが必要
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://127.0.0.1:6379/0'),
+    },
+    'memcached': {  # pymemcacheパッケージが必要
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', '127.0.0.1:11211'),
+    },
+}
+CACHE_PROFILE = os.environ.get('CACHE_PROFILE', 'locmem')  # テストではtest_settingsでlocmemに固定する
+CACHES = {
+    'default': {
+        **CACHE_PROFILES[CACHE_PROFILE],
+        'KEY_PREFIX': 'visa-system',
+        'TIMEOUT': 300,
+    },
+}
+# 用途ごとのキャッシュ（CACHESのエイリアス。テンプレートの{% cache %}は'default'を使う）
+RULESET_CACHE = 'default'
+AI_RESPONSE_CACHE = 'default'
+AI_RESPONSE_CACHE_TTL = int(os.environ.get('AI_RESPONSE_CACHE_TTL', 86400))  # 秒（同一プロンプトのAI応答を再利用する期間）
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 86400))  # 秒（ルールセットから描画したHTML断片）
+
+# 起動直後にルールセット・AIのSDK等をバックグラウンドで準備する（wsgi.py・asgi.py）
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', 'True') == 'True'
+
+# ルールセット・カタログAPI設定
+RULESET_CACHE_TTL = int(os.environ.get('RULESET_CACHE_TTL', 300))  # 秒（他ワーカーでの編集の反映間隔）
+# 秒（共有キャッシュのルールセットの保持期間。編集時は削除されるため長くてよい。build.shのwarm_cachesから起動まで残す）
+RULESET_SHARED_CACHE_TTL = int(os.environ.get('RULESET_SHARED_CACHE_TTL', 86400))
+CATALOG_CACHE_MAX_AGE = int(os.environ.get('CATALOG_CACHE_MAX_AGE', 86400))  # 秒（CDN・クライアントのキャッシュ期間）
+
+# レート制限（スライディングウィンドウ・カウンタ）
+# rate: 平均の上限、burst: 連続リクエストの上限（burst÷rate秒あたりの件数）
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+# 件数の保存先（cache: RATE_LIMIT_CACHEのキャッシュ、db: DBの行）。fileキャッシュは複数プロセスで不可分でないため使えない
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'cache')
+RATE_LIMIT_CACHE = 'default'  # RATE_LIMIT_STORE=cacheの場合。複数ワーカーで共有するにはCACHE_PROFILEでredis / memcachedを指定
+# X-Forwarded-Forを付ける信頼済みプロキシの段数（0ならREMOTE_ADDRを使う。Render.comでは1）
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+# クライアントを識別するX-API-Keyの値（カンマ区切り。登録されていないキーはIPアドレスで識別する）
+RATE_LIMIT_API_KEYS = frozenset(key.strip() for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key.strip())
+RATE_LIMITS = {
+    'diagnose_ai': {'rate': os.environ.get('RATE_LIMIT_AI', '20/hour'), 'burst': 5},
+    'diagnose_rule': {'rate': os.environ.get('RATE_LIMIT_RULE', '60/min'), 'burst': 20},
+    'batch': {'rate': os.environ.get('RATE_LIMIT_BATCH', '30/min'), 'burst': 10},  # ポイント計算・What-if分析API
+}
+
+# 高度専門職ポイント計算APIの1リクエストあたりの上限件数
+HSP_POINTS_BATCH_LIMIT = 5000
+
+# What-if分析APIのグリッド点数の上限
+WHATIF_MAX_GRID_POINTS = 20000
+
+# 診断セッション検索APIの1ページあたりの上限件数
+SESSION_SEARCH_MAX_LIMIT = 200
+
+# 診断セッション取得API・結果ページ
+SESSION_RESULT_CACHE = 'default'  # 完了したセッションの読み込み時キャッシュ
+SESSION_RESULT_CACHE_TTL = int(os.environ.get('SESSION_RESULT_CACHE_TTL', 3600))  # 秒（サーバー側のキャッシュ期間）
+SESSION_RESULT_MAX_AGE = int(os.environ.get('SESSION_RESULT_MAX_AGE', 3600))  # 秒（ブラウザのキャッシュ期間）
+
+# 一括診断（候補者名簿のアップロード・run_diagnosis_worker）
+COHORT_MAX_APPLICANTS = int(os.environ.get('COHORT_MAX_APPLICANTS', 5000))  # 1ファイルあたりの上限人数
+COHORT_CHUNK_SIZE = int(os.environ.get('COHORT_CHUNK_SIZE', 50))  # ワーカーが1回に受け取る人数
+COHORT_LEASE_SECONDS = int(os.environ.get('COHORT_LEASE_SECONDS', 600))  # 秒（応答のないワーカーのチャンクを再配布するまで）
+COHORT_MAX_ATTEMPTS = int(os.environ.get('COHORT_MAX_ATTEMPTS', 3))  # チャンクの再試行回数の上限
+
+# 「日本人と同等以上」の報酬要件で比較する賃金の参照値（p10・p25・p50・p75・p90）
+WAGE_REFERENCE_PERCENTILE = os.environ.get('WAGE_REFERENCE_PERCENTILE', 'p25')
+
+# 専攻と職種の関連性（オフライン判定）
+# 確信度がこれ未満の組だけをClaude APIで判定する
+RELEVANCE_MIN_CONFIDENCE = float(os.environ.get('RELEVANCE_MIN_CONFIDENCE', 0.6))
+RELEVANCE_MODEL_PATH = os.environ.get('RELEVANCE_MODEL_PATH', os.path.join(BASE_DIR, 'relevance_model.json'))
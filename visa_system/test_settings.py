@@ -0,0 +1,21 @@
+"""
+テスト用の設定
+python manage.py test --settings=visa_system.test_settings
+（pytest等では DJANGO_SETTINGS_MODULE=visa_system.test_settings を指定する）
+"""
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHE_PROFILES, CACHES, DATABASES
+
+# 共有キャッシュ（file・redis・memcached）の代わりにローカルメモリを使う
+CACHE_PROFILE = 'locmem'
+CACHES = {
+    'default': {**CACHES['default'], **CACHE_PROFILES['locmem']},
+}
+
+# 本番と同じくファイルのSQLiteを使う（メモリ上のDBは複数の接続からの同時書き込みを待たずにエラーにする）
+DATABASES = {
+    'default': {**DATABASES['default'], 'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'visa_system_test.sqlite3')}},
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'visa_system.settings')
 
 application = get_wsgi_application()
+
+# 最初のリクエストを待たずにルールセット等をバックグラウンドで準備（WARMUP_ON_START）
+from visa_diagnosis.warmup import start_background_warmup  # noqa: E402
+
+start_background_warmup()